@@ -0,0 +1,314 @@
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from config import Config
+from metrics import observe, incr
+
+# Idle per-user buckets are dropped once there are more than this many
+MAX_TRACKED_USERS = 10000
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously
+    Args:
+        rate (float): Tokens added per second
+        capacity (float): Bucket size, the largest burst allowed
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now=None):
+        """Seconds until amount is available, 0 when it is available now"""
+        self._refill(time.monotonic() if now is None else now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        # Callers check wait_time() first; settling actual usage may go into debt
+        self.tokens -= min(amount, self.capacity)
+
+    def give(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class AdmissionRejected(Exception):
+    """The wait queue is full or the request waited longer than allowed"""
+
+
+class Ticket:
+    __slots__ = ("user_id", "tokens", "enqueued", "granted")
+
+    def __init__(self, user_id, tokens):
+        self.user_id = user_id
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+
+class AdmissionController:
+    """
+    Admits LLM calls under global and per-user limits on requests and tokens
+    per minute, plus a cap on calls in flight. Waiting calls sit in a bounded
+    queue served round-robin across users, so one busy user can't starve the
+    others. A limit of 0 disables it.
+    Args:
+        requests_per_minute (int): Global request limit
+        tokens_per_minute (int): Global token limit
+        user_requests_per_minute (int): Request limit per user
+        user_tokens_per_minute (int): Token limit per user
+        max_concurrent (int): Calls allowed in flight at once
+        max_queue (int): Calls allowed to wait; more are rejected
+        max_wait (float): Seconds a call may wait before it is rejected
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, user_requests_per_minute=0,
+                 user_tokens_per_minute=0, max_concurrent=0, max_queue=64, max_wait=60.0):
+        self.user_requests_per_minute = user_requests_per_minute
+        self.user_tokens_per_minute = user_tokens_per_minute
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._global = self._buckets(requests_per_minute, tokens_per_minute)
+        self._users = OrderedDict()   # user_id -> buckets, least recently used first
+        self._queues = OrderedDict()  # user_id -> deque of tickets, in round-robin order
+        self._waiting = 0
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def _buckets(requests_per_minute, tokens_per_minute):
+        buckets = []
+        if requests_per_minute:
+            buckets.append(("requests", TokenBucket(requests_per_minute / 60, requests_per_minute)))
+        if tokens_per_minute:
+            buckets.append(("tokens", TokenBucket(tokens_per_minute / 60, tokens_per_minute)))
+        return buckets
+
+    def _user_buckets(self, user_id):
+        buckets = self._users.get(user_id)
+        if buckets is None:
+            buckets = self._users[user_id] = self._buckets(self.user_requests_per_minute,
+                                                           self.user_tokens_per_minute)
+            while len(self._users) > MAX_TRACKED_USERS:
+                self._users.popitem(last=False)
+        self._users.move_to_end(user_id)
+        return buckets
+
+    @staticmethod
+    def _wait_for(buckets, tokens, now):
+        return max((bucket.wait_time(1 if kind == "requests" else tokens, now) for kind, bucket in buckets),
+                   default=0.0)
+
+    def _dispatch(self, now):
+        """Grant every queued ticket that fits, one user at a time; caller holds the lock.
+        Returns seconds until the next grant could become possible, None when unknown."""
+        retry_in = None
+        if self._paused_until > now:
+            return self._paused_until - now
+        progress = True
+        while progress and self._queues:
+            progress = False
+            for user_id in list(self._queues):
+                if self.max_concurrent and self._in_flight >= self.max_concurrent:
+                    # Wait for a release() rather than a refill
+                    return None
+                ticket = self._queues[user_id][0]
+                user = self._user_buckets(user_id)
+                wait = max(self._wait_for(self._global, ticket.tokens, now),
+                           self._wait_for(user, ticket.tokens, now))
+                if wait > 0:
+                    retry_in = wait if retry_in is None else min(retry_in, wait)
+                    continue
+                for kind, bucket in self._global + user:
+                    bucket.take(1 if kind == "requests" else ticket.tokens)
+                self._queues[user_id].popleft()
+                # Served users go to the back of the rotation
+                if self._queues[user_id]:
+                    self._queues.move_to_end(user_id)
+                else:
+                    del self._queues[user_id]
+                ticket.granted = True
+                self._waiting -= 1
+                self._in_flight += 1
+                progress = True
+                self._cond.notify_all()
+        return retry_in
+
+    def _position(self, ticket):
+        """1-based place of ticket in the round-robin serving order"""
+        users = list(self._queues)
+        rank = users.index(ticket.user_id)
+        index = self._queues[ticket.user_id].index(ticket)
+        ahead = index
+        for i, user_id in enumerate(users):
+            if user_id != ticket.user_id:
+                ahead += min(len(self._queues[user_id]), index + (1 if i < rank else 0))
+        return ahead + 1
+
+    def acquire(self, user_id, tokens, on_wait=None, poll=0.5):
+        """
+        Block until the call may go ahead and return its ticket
+        Args:
+            user_id (str): Caller, for per-user limits and fair scheduling
+            tokens (int): Estimated tokens the call will use
+            on_wait (callable): Called as on_wait(position, estimated_seconds) while
+                waiting, and once with (0, 0) after a wait ends
+            poll (float): Seconds between on_wait updates
+        """
+        ticket = Ticket(user_id, tokens)
+        waited = False
+        with self._cond:
+            if self._waiting >= self.max_queue:
+                incr("chat_admission_rejected_total")
+                raise AdmissionRejected("Too many requests are waiting")
+            self._queues.setdefault(user_id, deque()).append(ticket)
+            self._waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    retry_in = self._dispatch(now)
+                    if ticket.granted:
+                        break
+                    waited_seconds = now - ticket.enqueued
+                    if self.max_wait and waited_seconds >= self.max_wait:
+                        incr("chat_admission_rejected_total")
+                        raise AdmissionRejected("Timed out waiting for a free slot")
+                    if on_wait is not None:
+                        position = self._position(ticket)
+                        estimate = (retry_in or poll) * position
+                        # Callbacks may draw to the page, never hold the lock meanwhile
+                        self._cond.release()
+                        try:
+                            on_wait(position, estimate)
+                        finally:
+                            self._cond.acquire()
+                        waited = True
+                        if ticket.granted:
+                            break
+                    self._cond.wait(min(poll, retry_in) if retry_in else poll)
+            except BaseException:
+                if not ticket.granted:
+                    self._remove(ticket)
+                raise
+        observe("llm.queue_wait", time.monotonic() - ticket.enqueued)
+        if waited and on_wait is not None:
+            on_wait(0, 0)
+        return ticket
+
+    def _remove(self, ticket):
+        # Caller holds the lock
+        pending = self._queues.get(ticket.user_id)
+        if pending is not None and ticket in pending:
+            pending.remove(ticket)
+            if not pending:
+                del self._queues[ticket.user_id]
+            self._waiting -= 1
+            self._cond.notify_all()
+
+    def release(self, ticket, used_tokens=None):
+        """Free the in-flight slot, charging or refunding the difference to actual token usage"""
+        with self._cond:
+            self._in_flight -= 1
+            if used_tokens is not None and used_tokens != ticket.tokens:
+                difference = ticket.tokens - used_tokens
+                for kind, bucket in self._global + self._users.get(ticket.user_id, []):
+                    if kind == "tokens":
+                        if difference > 0:
+                            bucket.give(difference)
+                        else:
+                            bucket.take(-difference)
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        """Hold every waiting call for seconds, e.g. after the provider answered 429"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @contextmanager
+    def admitted(self, user_id, tokens, on_wait=None):
+        """acquire() and release() around a block; the yielded dict's "used_tokens" settles usage"""
+        ticket = self.acquire(user_id, tokens, on_wait)
+        usage = {"used_tokens": None}
+        try:
+            yield usage
+        finally:
+            self.release(ticket, usage["used_tokens"])
+
+    def stats(self):
+        with self._cond:
+            return {"waiting": self._waiting, "in_flight": self._in_flight,
+                    "users_queued": len(self._queues)}
+
+
+def is_rate_limit_error(error):
+    """True for provider 429 / rate limit errors, including ones wrapped by the router"""
+    if getattr(error, "status_code", None) == 429:
+        return True
+    if getattr(getattr(error, "response", None), "status_code", None) == 429:
+        return True
+    # groq.RateLimitError, openai.RateLimitError, ... matched by name so neither SDK is imported
+    if any(cls.__name__ == "RateLimitError" for cls in type(error).__mro__):
+        return True
+    nested = getattr(error, "errors", None)
+    if nested:
+        return any(is_rate_limit_error(e) for _, e in nested)
+    return False
+
+
+def retry_after(error):
+    """Seconds the provider asked to wait, if it said"""
+    nested = getattr(error, "errors", None)
+    if nested:
+        delays = [retry_after(e) for _, e in nested if is_rate_limit_error(e)]
+        return max((delay for delay in delays if delay is not None), default=None)
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        delay = float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+    return delay if delay >= 0 else None
+
+
+def backoff_delay(attempt, base=0.5, cap=20.0):
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """Process-wide controller configured from Config, or None when every limit is off"""
+    global _controller
+    if not (Config.LLM_REQUESTS_PER_MINUTE or Config.LLM_TOKENS_PER_MINUTE or Config.USER_REQUESTS_PER_MINUTE
+            or Config.USER_TOKENS_PER_MINUTE or Config.LLM_MAX_CONCURRENT):
+        return None
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController(
+                    requests_per_minute=Config.LLM_REQUESTS_PER_MINUTE,
+                    tokens_per_minute=Config.LLM_TOKENS_PER_MINUTE,
+                    user_requests_per_minute=Config.USER_REQUESTS_PER_MINUTE,
+                    user_tokens_per_minute=Config.USER_TOKENS_PER_MINUTE,
+                    max_concurrent=Config.LLM_MAX_CONCURRENT,
+                    max_queue=Config.LLM_QUEUE_SIZE,
+                    max_wait=Config.LLM_QUEUE_MAX_WAIT
+                )
+    return _controller
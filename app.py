@@ -1,15 +1,53 @@
 import streamlit as st
 import uuid
-from ui import setup_page_config, apply_custom_styles, display_header, display_message, history_sidebar
-from llm_utils import load_llm
-from chat_utils import generate_response
-from db_utils import init_db, save_message, get_session_messages
-from config import set_streamlit_config
+from ui import setup_page_config, apply_custom_styles, display_header, display_message, history_sidebar, render_transcript, open_session_page, refresh_sidebar, queue_notice, request_session_title
+from llm_utils import warm_llm
+from chat_utils import generate_response, stream_response
+from db_utils import init_db, save_message
+from config import Config, set_streamlit_config
+from transcript import Transcript
+import metrics
+
+def save_assistant_message(response):
+    st.session_state.messages.append({"role": "assistant", "content": response})
+    save_message(
+        session_id=st.session_state.session_id,
+        user_id=st.session_state.user_id,
+        role="assistant",
+        content=response
+    )
+
+def stream_assistant_reply(prompt):
+    """
+    Render the reply as it streams in and persist it once the stream ends or is
+    cancelled. A stream that fails midway raises after its partial reply is saved
+    """
+    on_wait = queue_notice()
+    placeholder = st.empty()
+    response = ""
+    try:
+        for chunk in stream_response(prompt=prompt, history=st.session_state.messages,
+                                     user_id=st.session_state.user_id, on_wait=on_wait):
+            response += chunk
+            display_message("assistant", response, container=placeholder)
+    finally:
+        # Streamlit interrupts the script on stop/rerun, keep what already arrived;
+        # on a provider error that is the model's text only, the error is shown by the caller
+        if response.strip():
+            save_assistant_message(response.strip())
+    return response
 
 def main():
     # Initialize app configuration
     set_streamlit_config()
+    if Config.METRICS_PORT:
+        metrics.start_metrics_server(Config.METRICS_PORT)
     
+    # Every script run is one turn; runs that answer a prompt are "chat" turns
+    with metrics.turn("rerun"):
+        run_chat()
+
+def run_chat():
     # Setup UI
     apply_custom_styles()
     display_header()
@@ -23,25 +61,42 @@ def main():
     
     if 'session_id' not in st.session_state:
         st.session_state.session_id = str(uuid.uuid4())
-        st.session_state.messages = [{
-            "role": "assistant", 
-            "content": "Hello! How can I help you today?"
-        }]
+        st.session_state.messages = Transcript.new(st.session_state.session_id)
     elif 'messages' not in st.session_state:
-        st.session_state.messages = get_session_messages(st.session_state.session_id) or [{
-            "role": "assistant",
-            "content": "Hello! How can I help you today?"
-        }]
+        st.session_state.messages = (open_session_page(st.session_state.session_id)
+                                     or Transcript.new(st.session_state.session_id))
     
     # Show sidebar
     history_sidebar()
     
+    chat_pane()
+    
+    # The page is drawn; load the LLM client while the user types
+    warm_llm()
+
+@st.fragment
+def chat_pane():
+    """
+    Transcript and chat input. Sending a message reruns only this fragment;
+    the full app, and with it the sidebar, reruns only when the session list changed
+    """
+    # Fragment reruns don't pass through main(), so open the turn here as well
+    with metrics.turn("rerun") as current_turn, metrics.timed("ui.chat_pane"):
+        handle_chat(current_turn)
+
+def handle_chat(current_turn):
     # Display messages
-    for msg in st.session_state.messages:
-        display_message(msg["role"], msg["content"])
+    with metrics.timed("ui.render_messages"):
+        render_transcript()
     
     # Handle user input
     if prompt := st.chat_input("Ask me anything..."):
+        current_turn["kind"] = "chat"
+        
+        # The session's first user message is what makes it show up in the sidebar
+        first_message = (st.session_state.messages.older_cursor is None
+                         and not any(msg.role == "user" for msg in st.session_state.messages))
+        
         # Save user message
         st.session_state.messages.append({"role": "user", "content": prompt})
         save_message(
@@ -51,35 +106,44 @@ def main():
             content=prompt
         )
         
+        # Show the prompt right away while the reply streams in
+        display_message("user", prompt)
+        
         # Generate response with error handling
-        with st.spinner("Thinking..."):
-            try:
-                response = generate_response(
-                    prompt=prompt,
-                    history=st.session_state.messages
-                )
+        try:
+            if Config.STREAM_RESPONSES:
+                stream_assistant_reply(prompt)
+            else:
+                on_wait = queue_notice()
+                with st.spinner("Thinking..."):
+                    response = generate_response(
+                        prompt=prompt,
+                        history=st.session_state.messages,
+                        user_id=st.session_state.user_id,
+                        on_wait=on_wait
+                    )
                 
                 # Save and display AI response
-                st.session_state.messages.append({"role": "assistant", "content": response})
-                save_message(
-                    session_id=st.session_state.session_id,
-                    user_id=st.session_state.user_id,
-                    role="assistant",
-                    content=response
-                )
-            except Exception as e:
-                if "model_decommissioned" in str(e):
-                    # Special handling for deprecated model error
-                    error_msg = "System is upgrading its AI model. Please refresh the page."
-                    # Optionally add automatic refresh:
-                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
-                    st.experimental_rerun()
-                else:
-                    error_msg = f"Sorry, I encountered an error: {str(e)}"
-                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
+                save_assistant_message(response)
+                display_message("assistant", response)
+        except Exception as e:
+            if "model_decommissioned" in str(e):
+                # Special handling for deprecated model error
+                error_msg = "System is upgrading its AI model. Please refresh the page."
+                # Optionally add automatic refresh:
+                st.session_state.messages.append({"role": "assistant", "content": error_msg}, saved=False)
+                st.experimental_rerun()
+            else:
+                error_msg = f"Sorry, I encountered an error: {str(e)}"
+                st.session_state.messages.append({"role": "assistant", "content": error_msg}, saved=False)
+                display_message("assistant", error_msg)
 
-        # Rerun to update UI
-        st.rerun()
+        # The reply is already drawn in place; only a new session needs the
+        # full rerun that refreshes the sidebar
+        if first_message:
+            request_session_title(prompt)
+            refresh_sidebar()
+            st.rerun()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
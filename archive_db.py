@@ -0,0 +1,17 @@
+import sys
+from db_utils import init_db, archive_sessions, enable_incremental_vacuum, ARCHIVE_AFTER_DAYS
+
+# Run periodically (e.g. from cron): python archive_db.py [days] [--enable-incremental-vacuum]
+init_db()
+if "--enable-incremental-vacuum" in sys.argv:
+    # One-off full VACUUM so later archive runs can hand freed pages back
+    converted = enable_incremental_vacuum()
+    if converted:
+        print(f"Converted {converted} database file(s) to incremental auto-vacuum")
+
+days = next((int(arg) for arg in sys.argv[1:] if arg.isdigit()), ARCHIVE_AFTER_DAYS)
+stats = archive_sessions(days)
+ratio = stats["raw_bytes"] / stats["compressed_bytes"] if stats["compressed_bytes"] else 0
+print(f"Archived {stats['sessions']} sessions idle for {days}+ days "
+      f"({stats['messages']} messages, {stats['raw_bytes']:,} -> {stats['compressed_bytes']:,} bytes, {ratio:.1f}x)")
+print(f"Freed {stats['pages_freed']} pages")
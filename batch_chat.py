@@ -0,0 +1,218 @@
+"""Run prompts from a JSONL file through the chat pipeline without the UI.
+
+Usage:
+    python batch_chat.py prompts.jsonl results.jsonl --concurrency 16
+    python batch_chat.py prompts.jsonl results.jsonl --to-chats --user-id eval-bot
+
+Each input line is either
+    {"id": "q1", "prompt": "...", "history": [{"role": "user", "content": "..."}, ...]}
+or a whole conversation whose last message is the prompt
+    {"id": "q2", "messages": [{"role": "user", "content": "..."}, ...]}
+with optional "user_id" and "session_id". Lines without an id are numbered.
+
+Every item goes through chat_utils.complete, i.e. the same context building,
+response cache, admission control and load_llm() router as the app, on a
+thread pool bounded by --concurrency. Long-term memory is left out, so an
+item's prompt never depends on which other items finished (and were saved
+with --to-chats) before it. One result line is appended per item:
+    {"id", "status": "ok" | "error" | "rejected" | "invalid", "response",
+     "error", "latency_ms"}
+The results file doubles as the checkpoint: re-running the same command skips
+ids that already have an "ok" line and retries the rest. With --to-chats the
+conversation and reply are also saved to chats as a session of their own.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import AdmissionRejected, backoff_delay
+from chat_utils import complete
+from metrics import incr
+
+DEFAULT_CONCURRENCY = 8
+# Retries of an item whose admission wait ran out, before it is recorded as rejected
+ADMISSION_RETRIES = 3
+# Results are fsynced every this many lines; every line is flushed
+FSYNC_EVERY = 100
+BATCH_USER_ID = "batch"
+
+
+def completed_ids(path):
+    """Ids with an "ok" result in an existing results file"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash; that item simply runs again
+                continue
+            if result.get("status") == "ok":
+                done.add(str(result.get("id")))
+    return done
+
+
+def parse_item(line, number):
+    """
+    (id, prompt, history, item) for one input line
+    Raises:
+        ValueError: Not JSON or no prompt in it
+    """
+    item = json.loads(line)
+    item_id = str(item.get("id", number))
+    if "messages" in item:
+        messages = item["messages"]
+        if not messages or messages[-1].get("role") != "user":
+            raise ValueError("the last message must be from the user")
+        return item_id, messages[-1]["content"], messages[:-1], item
+    if not item.get("prompt"):
+        raise ValueError("missing prompt")
+    return item_id, item["prompt"], item.get("history", []), item
+
+
+def session_for(item_id, item):
+    # Stable per item, so a rerun of an unfinished item doesn't start a second session
+    return item.get("session_id") or str(uuid.uuid5(uuid.NAMESPACE_URL, f"batch-chat:{item_id}"))
+
+
+def run_item(prompt, history, user_id, use_cache):
+    """Blocking call on a worker thread; returns (status, response, error)"""
+    attempt = 0
+    while True:
+        try:
+            return "ok", complete(prompt, history, use_cache, user_id, use_memory=False), None
+        except AdmissionRejected as e:
+            if attempt >= ADMISSION_RETRIES:
+                return "rejected", None, str(e)
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+        except Exception as e:
+            return "error", None, str(e)
+
+
+def save_to_chats(item_id, item, user_id, prompt, history, response):
+    from datetime import datetime
+    from db_utils import save_messages
+
+    session_id = session_for(item_id, item)
+    now = datetime.now()
+    rows = [(session_id, user_id, msg["role"], msg["content"], now) for msg in history]
+    rows.append((session_id, user_id, "user", prompt, now))
+    rows.append((session_id, user_id, "assistant", response, datetime.now()))
+    save_messages(rows)
+    return session_id
+
+
+async def run_batch(input_path, output_path, concurrency=DEFAULT_CONCURRENCY, use_cache=True,
+                    to_chats=False, user_id=None, limit=None):
+    """
+    Process input_path into output_path, skipping items already done there
+    Returns:
+        {status: count} for this run, plus "skipped" and "seconds"
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-chat")
+    slots = asyncio.Semaphore(concurrency)
+    done = completed_ids(output_path)
+    counts = {"ok": 0, "error": 0, "rejected": 0, "invalid": 0, "skipped": 0}
+    written = 0
+    start = time.perf_counter()
+
+    if to_chats:
+        from db_utils import init_db
+        init_db()
+
+    with open(output_path, "a", encoding="utf-8") as out:
+
+        def record(result):
+            nonlocal written
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            written += 1
+            if written % FSYNC_EVERY == 0:
+                os.fsync(out.fileno())
+            counts[result["status"]] += 1
+            incr(f"chat_batch_{result['status']}_total")
+
+        async def process(item_id, prompt, history, item):
+            try:
+                owner = item.get("user_id") or user_id or BATCH_USER_ID
+                began = time.perf_counter()
+                response = None
+                try:
+                    status, response, error = await loop.run_in_executor(
+                        executor, run_item, prompt, history, owner, use_cache)
+                    result = {"id": item_id, "status": status, "response": response, "error": error}
+                    if status == "ok" and to_chats:
+                        result["session_id"] = await loop.run_in_executor(
+                            executor, save_to_chats, item_id, item, owner, prompt, history, response)
+                except Exception as e:
+                    # Recorded rather than lost with the task, so a resumed run retries the item
+                    result = {"id": item_id, "status": "error", "response": response, "error": str(e)}
+                result["latency_ms"] = round((time.perf_counter() - began) * 1000, 3)
+                record(result)
+            finally:
+                slots.release()
+
+        tasks = set()
+        with open(input_path, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                if limit is not None and number > limit:
+                    break
+                try:
+                    item_id, prompt, history, item = parse_item(line, number)
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    record({"id": str(number), "status": "invalid", "response": None, "error": str(e),
+                            "latency_ms": 0})
+                    continue
+                if item_id in done:
+                    counts["skipped"] += 1
+                    continue
+                # Reading stops here while every slot is busy, so the input is never held in memory
+                await slots.acquire()
+                task = asyncio.create_task(process(item_id, prompt, history, item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        os.fsync(out.fileno())
+
+    executor.shutdown()
+    counts["seconds"] = round(time.perf_counter() - start, 3)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="JSONL file of prompts or conversations")
+    parser.add_argument("output", help="JSONL results file, appended to and used to resume")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="LLM calls in flight")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the response cache")
+    parser.add_argument("--to-chats", action="store_true", help="Also save each conversation to chats")
+    parser.add_argument("--user-id", help=f"Owner for items without a user_id (default {BATCH_USER_ID!r})")
+    parser.add_argument("--limit", type=int, help="Only read this many input lines")
+    args = parser.parse_args()
+
+    counts = asyncio.run(run_batch(args.input, args.output, args.concurrency, not args.no_cache,
+                                   args.to_chats, args.user_id, args.limit))
+    processed = sum(counts[s] for s in ("ok", "error", "rejected"))
+    rate = processed / counts["seconds"] if counts["seconds"] else 0
+    print(f"{counts['ok']} ok, {counts['error']} errors, {counts['rejected']} rejected, "
+          f"{counts['invalid']} invalid, {counts['skipped']} already done "
+          f"in {counts['seconds']}s ({rate:,.1f} items/s)", file=sys.stderr)
+    if args.to_chats:
+        from db_utils import flush_pending_writes
+        flush_pending_writes()
+
+
+if __name__ == "__main__":
+    main()
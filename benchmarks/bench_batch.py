@@ -0,0 +1,108 @@
+"""Measure batch_chat throughput against sequential llm.invoke calls.
+
+Usage:
+    python benchmarks/bench_batch.py --items 500 --concurrency 1 8 32 64 --latency 0.05
+
+Runs the offline fake model with a fixed per-call latency standing in for the
+provider round trip. "sequential" calls load_llm().invoke once per prompt in
+a loop; the other rows run the same prompts end to end through
+batch_chat.run_batch (context building, admission, router, results file) at
+each concurrency, with the response cache off. Results are printed as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "0")
+
+
+def write_prompts(path, items):
+    with open(path, "w") as f:
+        for i in range(items):
+            f.write(json.dumps({"id": f"q{i}", "prompt": f"Benchmark question number {i}?",
+                                "history": [{"role": "user", "content": "Earlier question"},
+                                            {"role": "assistant", "content": "Earlier answer"}]}) + "\n")
+
+
+def latency_stats(path):
+    with open(path) as f:
+        samples = sorted(json.loads(line)["latency_ms"] for line in f)
+    return {
+        "p50_ms": round(samples[len(samples) // 2], 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "mean_ms": round(statistics.fmean(samples), 3)
+    }
+
+
+def run_sequential(items):
+    from langchain_core.messages import HumanMessage
+    from llm_utils import load_llm
+
+    llm = load_llm()
+    start = time.perf_counter()
+    for i in range(items):
+        llm.invoke([HumanMessage(content=f"Benchmark question number {i}?")])
+    seconds = time.perf_counter() - start
+    return {"mode": "sequential", "items": items, "seconds": round(seconds, 3),
+            "items_per_second": round(items / seconds, 1)}
+
+
+def run_batched(prompts, output, items, concurrency):
+    from batch_chat import run_batch
+
+    if os.path.exists(output):
+        os.remove(output)
+    counts = asyncio.run(run_batch(prompts, output, concurrency, use_cache=False))
+    return {"mode": "batch", "concurrency": concurrency, "items": counts["ok"],
+            "failed": counts["error"] + counts["rejected"], "seconds": counts["seconds"],
+            "items_per_second": round(counts["ok"] / counts["seconds"], 1), **latency_stats(output)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake model seconds per call")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    # Read by config at import time, so set before anything imports it
+    os.environ["FAKE_LLM_LATENCY"] = str(args.latency)
+    tmp_dir = tempfile.mkdtemp(prefix="bench_batch_")
+    try:
+        prompts = os.path.join(tmp_dir, "prompts.jsonl")
+        write_prompts(prompts, args.items)
+        results = [run_sequential(args.items)]
+        for concurrency in args.concurrency:
+            results.append(run_batched(prompts, os.path.join(tmp_dir, "results.jsonl"), args.items, concurrency))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "fake_latency_seconds": args.latency,
+        "results": results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Time db_utils operations against a synthetic chat_history.db.
+
+Usage:
+    python benchmarks/bench_db.py --users 100 --sessions-per-user 20 --messages-per-session 50
+    python benchmarks/bench_db.py --db /tmp/big.db --users 20000 --sessions-per-user 50 \
+        --messages-per-session 20 --keep --output results.json
+
+The database is generated once and reused when --db points at an existing
+file. Results are printed (or written with --output) as JSON with latency
+percentiles in milliseconds per operation. Reads are timed against SQLite:
+db_utils' read cache is cleared before each call, and hits on a warm cache
+are reported separately under "cached_reads". The timed writes, renames and
+deletes modify the database, so point --db at a copy when reusing one.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_utils
+
+WORDS = ("the model answer question python data chat history session token cache "
+         "latency query index table user assistant stream vector memory search").split()
+
+# Rows per executemany/transaction while generating
+GENERATE_BATCH = 50000
+
+
+def random_text(rng, min_words, max_words):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+
+def generate_database(path, users, sessions_per_user, messages_per_session, seed=0):
+    """Create a synthetic database with users * sessions * messages chat rows"""
+    db_utils.DB_PATH = path
+    db_utils.init_db()
+    db_utils.close_all_pools()
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous=OFF")
+    chat_rows = []
+    session_rows = []
+    start = datetime(2024, 1, 1)
+    total = users * sessions_per_user * messages_per_session
+    written = 0
+
+    def flush():
+        nonlocal written
+        with conn:
+            conn.executemany("""INSERT INTO chats (session_id, user_id, role, content, timestamp)
+                                VALUES (?, ?, ?, ?, ?)""", chat_rows)
+            conn.executemany("""INSERT INTO sessions
+                                (id, user_id, name, created_at, last_used, message_count, preview)
+                                VALUES (?, ?, 'New Chat', ?, ?, ?, ?)""", session_rows)
+        written += len(chat_rows)
+        chat_rows.clear()
+        session_rows.clear()
+        print(f"  generated {written:,}/{total:,} messages", file=sys.stderr)
+
+    for _ in range(users):
+        user_id = str(uuid.uuid4())
+        for _ in range(sessions_per_user):
+            session_id = str(uuid.uuid4())
+            ts = start + timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+            created_at = ts
+            preview = None
+            for i in range(messages_per_session):
+                role = "user" if i % 2 == 0 else "assistant"
+                content = random_text(rng, 5, 25) if role == "user" else random_text(rng, 30, 150)
+                if preview is None and role == "user":
+                    preview = content[:db_utils.PREVIEW_LENGTH]
+                chat_rows.append((session_id, user_id, role, content, ts))
+                ts += timedelta(seconds=rng.randint(5, 120))
+            session_rows.append((session_id, user_id, created_at, ts, messages_per_session, preview))
+            if len(chat_rows) >= GENERATE_BATCH:
+                flush()
+    if chat_rows:
+        flush()
+
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def sample_ids(path, count):
+    conn = sqlite3.connect(path)
+    users = [r[0] for r in conn.execute(
+        "SELECT user_id FROM sessions ORDER BY random() LIMIT ?", (count,))]
+    sessions = [r[0] for r in conn.execute(
+        "SELECT id FROM sessions ORDER BY random() LIMIT ?", (count * 3,))]
+    conn.close()
+    return users, sessions
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+
+    def pct(p):
+        return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+    return {
+        "count": len(samples),
+        "mean_ms": round(statistics.fmean(samples), 4),
+        "p50_ms": round(pct(50), 4),
+        "p90_ms": round(pct(90), 4),
+        "p95_ms": round(pct(95), 4),
+        "p99_ms": round(pct(99), 4),
+        "max_ms": round(samples[-1], 4)
+    }
+
+
+def time_op(fn, args_list, cold_cache=False):
+    samples = []
+    for args in args_list:
+        if cold_cache:
+            # Sampled ids repeat, so without this later calls would time cache hits
+            db_utils._read_cache.clear()
+        start = time.perf_counter()
+        fn(*args)
+        samples.append((time.perf_counter() - start) * 1000)
+    return percentiles(samples)
+
+
+def time_cached(fn, args_list):
+    """Time calls answered by the read cache, after one warming call per argument set"""
+    db_utils._read_cache.clear()
+    for args in args_list:
+        fn(*args)
+    return time_op(fn, args_list)
+
+
+def run_benchmarks(path, iterations, seed=0):
+    db_utils.DB_PATH = path
+    rng = random.Random(seed)
+    users, sessions = sample_ids(path, iterations)
+    if not users:
+        raise SystemExit("Database has no sessions to benchmark")
+
+    def pick(seq, n):
+        return [rng.choice(seq) for _ in range(n)]
+
+    # Reads first, then writes, then destructive operations on their own sessions
+    write_sessions = [(str(uuid.uuid4()), u) for u in pick(users, iterations)]
+    delete_targets = sessions[-iterations:]
+    reads = {
+        "get_all_sessions": (db_utils.get_all_sessions, [(u,) for u in pick(users, iterations)]),
+        "list_sessions": (db_utils.list_sessions, [(u, 20) for u in pick(users, iterations)]),
+        "get_session_messages": (db_utils.get_session_messages, [(s,) for s in pick(sessions, iterations)]),
+        "get_session_preview": (db_utils.get_session_preview, [(s,) for s in pick(sessions, iterations)])
+    }
+    results = {
+        "init_db": time_op(db_utils.init_db, [()] * max(1, iterations // 10)),
+        **{name: time_op(fn, args_list, cold_cache=True) for name, (fn, args_list) in reads.items()},
+        "cached_reads": {name: time_cached(fn, args_list) for name, (fn, args_list) in reads.items()},
+        "save_message": time_op(db_utils.save_message,
+                                [(s, u, "user", random_text(rng, 5, 25)) for s, u in write_sessions]),
+        "update_session_name": time_op(db_utils.update_session_name,
+                                       [(s, f"Renamed {i}") for i, s in enumerate(pick(sessions, iterations))]),
+        "delete_session": time_op(db_utils.delete_session, [(s,) for s in delete_targets])
+    }
+    db_utils.close_all_pools()
+    return results
+
+
+def database_stats(path):
+    conn = sqlite3.connect(path)
+    stats = {
+        "chats": conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0],
+        "sessions": conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0],
+        "file_bytes": os.path.getsize(path)
+    }
+    conn.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", help="Database file to generate or reuse (default: temporary)")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--sessions-per-user", type=int, default=20)
+    parser.add_argument("--messages-per-session", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=200, help="Calls timed per operation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="Keep the generated database")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    tmp_dir = None
+    path = args.db
+    if path is None:
+        tmp_dir = tempfile.mkdtemp(prefix="bench_db_")
+        path = os.path.join(tmp_dir, "chat_history.db")
+
+    generated = False
+    generate_seconds = None
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        generate_database(path, args.users, args.sessions_per_user, args.messages_per_session, args.seed)
+        generate_seconds = round(time.perf_counter() - start, 2)
+        generated = True
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "database": dict(database_stats(path), path=path, generated=generated,
+                         generate_seconds=generate_seconds),
+        "iterations": args.iterations,
+        "operations": run_benchmarks(path, args.iterations, args.seed)
+    }
+
+    if not args.keep and (tmp_dir or generated):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        if tmp_dir:
+            os.rmdir(tmp_dir)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
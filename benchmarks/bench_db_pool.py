@@ -0,0 +1,113 @@
+"""Compare pooled connections against the old connect-per-call pattern.
+
+Usage:
+    python benchmarks/bench_db_pool.py --turns 500 --threads 4
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_utils
+
+
+def legacy_save_message(db_path, session_id, user_id, role, content):
+    """save_message as it was before pooling: connect, count, insert, close"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    c = conn.cursor()
+    c.execute("SELECT COUNT(*) FROM chats WHERE session_id = ?", (session_id,))
+    c.fetchone()
+    c.execute("""INSERT INTO chats (session_id, user_id, role, content, timestamp)
+                 VALUES (?, ?, ?, ?, ?)""",
+              (session_id, user_id, role, content, datetime.now()))
+    conn.commit()
+    conn.close()
+
+
+def legacy_get_session_messages(db_path, session_id):
+    conn = sqlite3.connect(db_path, timeout=30)
+    c = conn.cursor()
+    c.execute("""SELECT role, content, timestamp FROM chats
+                 WHERE session_id = ? ORDER BY timestamp""", (session_id,))
+    rows = c.fetchall()
+    conn.close()
+    return rows
+
+
+def run_turns(save, load, turns, threads):
+    """Simulate chat turns (user + assistant write, then transcript read) across threads"""
+    per_thread = max(1, turns // threads)
+
+    def worker():
+        user_id = str(uuid.uuid4())
+        session_id = str(uuid.uuid4())
+        for i in range(per_thread):
+            save(session_id, user_id, "user", f"question {i}")
+            save(session_id, user_id, "assistant", f"answer {i} " * 20)
+            load(session_id)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "turns": per_thread * threads,
+        "seconds": round(elapsed, 4),
+        "turns_per_second": round(per_thread * threads / elapsed, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        pooled_path = os.path.join(tmp, "pooled.db")
+
+        # Legacy database keeps SQLite's default rollback journal
+        db_utils.DB_PATH = legacy_path
+        db_utils.init_db()
+        db_utils.close_all_pools()
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+
+        db_utils.DB_PATH = pooled_path
+        db_utils.init_db()
+
+        results = {
+            "connect_per_call": run_turns(
+                lambda *a: legacy_save_message(legacy_path, *a),
+                lambda s: legacy_get_session_messages(legacy_path, s),
+                args.turns, args.threads
+            ),
+            "pooled": run_turns(
+                db_utils.save_message,
+                db_utils.get_session_messages,
+                args.turns, args.threads
+            )
+        }
+        db_utils.close_all_pools()
+
+    results["speedup"] = round(
+        results["pooled"]["turns_per_second"] / results["connect_per_call"]["turns_per_second"], 2
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
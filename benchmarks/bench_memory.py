@@ -0,0 +1,114 @@
+"""Measure long-term memory indexing and recall latency for one large user.
+
+Usage:
+    python benchmarks/bench_memory.py --messages 10000 50000 --queries 200
+
+Seeds a temporary database with one user's messages, builds their vector
+index from scratch (the catch-up the background thread runs the first time
+memory is used), then times memory_index.recall and the similarity search
+alone. Results are printed as JSON with p50/p95 per message count.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db_utils
+import memory_index
+from config import Config
+
+WORDS = ("garden tomato recipe python error deploy kubernetes invoice holiday flight hotel budget "
+         "sqlite index query latency dog vet birthday gift guitar chord marathon training knee "
+         "mortgage rate tax refund resume interview salary vacation paris train ticket").split()
+
+
+def make_messages(count, rng):
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 40))) for _ in range(count)]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3)
+    }
+
+
+def run(messages, queries, rng):
+    tmp_dir = tempfile.mkdtemp(prefix="bench_memory_")
+    try:
+        db_utils.set_backend(db_utils.SQLiteBackend(os.path.join(tmp_dir, "chat_history.db")))
+        Config.MEMORY_INDEX_DIR = os.path.join(tmp_dir, "chat_vectors")
+        db_utils.init_db()
+        user_id = str(uuid.uuid4())
+        texts = make_messages(messages, rng)
+        for start in range(0, messages, 5000):
+            session_id = str(uuid.uuid4())
+            db_utils.save_messages([(session_id, user_id, "user" if i % 2 == 0 else "assistant", text, datetime.now())
+                                    for i, text in enumerate(texts[start:start + 5000])])
+
+        start = time.perf_counter()
+        memory_index.sync(user_id)
+        build_seconds = time.perf_counter() - start
+
+        index = memory_index.get_index(user_id)
+        prompts = make_messages(queries, rng)
+        search, recall = [], []
+        for prompt in prompts:
+            query = memory_index.embed(prompt)
+            start = time.perf_counter()
+            index.search(query, Config.MEMORY_TOP_K * memory_index.OVERFETCH)
+            search.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            memory_index.recall(user_id, prompt)
+            recall.append(time.perf_counter() - start)
+        return {
+            "messages": messages,
+            "index_build_seconds": round(build_seconds, 3),
+            "index_bytes": index.count * (memory_index.DIM * 4 + 8),
+            "search": summarize(search),
+            "recall": summarize(recall)
+        }
+    finally:
+        db_utils.close_all_pools()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "dim": memory_index.DIM,
+        "top_k": Config.MEMORY_TOP_K,
+        "results": [run(count, args.queries, rng) for count in args.messages]
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
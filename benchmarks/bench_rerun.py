@@ -0,0 +1,162 @@
+"""Measure Streamlit rerun cost of sending a chat message, before and after fragment isolation.
+
+Usage:
+    python benchmarks/bench_rerun.py --sessions 200 --turns 30 [--baseline 24d91aa^]
+
+Runs app.py headlessly with streamlit.testing's AppTest and the offline fake
+model, once from the --baseline commit (by default the one before the sidebar
+and chat pane became fragments, extracted with git archive) and once from
+this tree. Each runs in its own process against its own freshly seeded
+database. Both sides report the same spans per message sent:
+  - script: every script run the message caused (turn.* spans); the baseline
+    also reran the whole script once more after each reply
+  - history_sidebar: the sidebar (ui.history_sidebar) within those runs
+  - chat_pane: the chat fragment (ui.chat_pane), which only "after" has
+AppTest always executes full reruns, while a browser reruns only the chat
+fragment when a message is sent, so per_message_ms compares the baseline's
+script time with the chat fragment's. AppTest's wall time per message is
+reported for both as well.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = "24d91aa^"
+
+STAGES = ("turn.chat", "turn.rerun", "ui.chat_pane", "ui.history_sidebar")
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "p50_ms": round(samples[len(samples) // 2], 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3)
+    }
+
+
+def stage_seconds(metrics, stage):
+    """Total seconds recorded for a stage so far; _histograms has the same layout in every revision"""
+    with metrics._lock:
+        hist = metrics._histograms.get(stage)
+        return hist[-2] if hist else 0.0
+
+
+def measure(root, sessions, messages_per_session, turns):
+    """Seed a database and time sending turns messages with root's app.py; runs inside the worker"""
+    sys.path.insert(0, root)
+    os.environ.setdefault("LLM_PROVIDER", "fake")
+    os.environ.setdefault("RESPONSE_CACHE_ENABLED", "0")
+    os.environ.setdefault("METRICS_PORT", "0")
+    from streamlit.testing.v1 import AppTest
+
+    import db_utils
+    import metrics
+
+    db_utils.DB_PATH = os.path.abspath("chat_history.db")
+    metrics.METRICS_DB_PATH = os.path.abspath("metrics.db")
+    db_utils.init_db()
+    user_id = str(uuid.uuid4())
+    for s in range(sessions):
+        session_id = str(uuid.uuid4())
+        for m in range(messages_per_session):
+            db_utils.save_message(session_id, user_id, "user" if m % 2 == 0 else "assistant",
+                                  f"seeded message {m} of session {s}")
+
+    def run(count):
+        metrics.reset()
+        at = AppTest.from_file(os.path.join(root, "app.py"), default_timeout=60)
+        at.session_state["user_id"] = user_id
+        at.run()
+        # First message creates the session; the measured turns continue it
+        at.chat_input[0].set_value("warm up").run()
+
+        wall = []
+        spans = {stage: [] for stage in STAGES}
+        for i in range(count):
+            at.chat_input[0].set_value(f"question {i}")
+            recorded = {stage: stage_seconds(metrics, stage) for stage in STAGES}
+            start = time.perf_counter()
+            at.run()
+            wall.append((time.perf_counter() - start) * 1000)
+            if at.exception:
+                raise SystemExit(at.exception[0].message)
+            for stage in STAGES:
+                spans[stage].append((stage_seconds(metrics, stage) - recorded[stage]) * 1000)
+        return wall, spans
+
+    # Discarded pass so module imports and SQLite caches don't land in the results
+    run(3)
+    wall, spans = run(turns)
+    result = {
+        "apptest_wall": summarize(wall),
+        "script": summarize([chat + rerun for chat, rerun in zip(spans["turn.chat"], spans["turn.rerun"])]),
+        "history_sidebar": summarize(spans["ui.history_sidebar"])
+    }
+    if any(spans["ui.chat_pane"]):
+        result["chat_pane"] = summarize(spans["ui.chat_pane"])
+    return result
+
+
+def run_worker(root, args):
+    """measure() in a fresh process, so each revision imports its own modules"""
+    with tempfile.TemporaryDirectory() as tmp:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", root, "--sessions", str(args.sessions),
+             "--messages-per-session", str(args.messages_per_session), "--turns", str(args.turns)],
+            cwd=tmp, check=True, stdout=subprocess.PIPE, text=True
+        ).stdout
+    return json.loads(output)
+
+
+def run_baseline(revision, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = os.path.join(tmp, "baseline.tar")
+        subprocess.run(["git", "archive", "--format=tar", "-o", archive, revision], cwd=ROOT, check=True)
+        tree = os.path.join(tmp, "tree")
+        with tarfile.open(archive) as tar:
+            tar.extractall(tree)
+        return run_worker(tree, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=200, help="Sessions in the user's history")
+    parser.add_argument("--messages-per-session", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Git revision measured as \"before\"")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(measure(args.worker, args.sessions, args.messages_per_session, args.turns)))
+        return
+
+    before = run_baseline(args.baseline, args)
+    after = run_worker(ROOT, args)
+    print(json.dumps({
+        "sessions": args.sessions,
+        "turns": args.turns,
+        "baseline": args.baseline,
+        "before": before,
+        "after": after,
+        "per_message_ms": {
+            # Script time per message: full reruns before, only the chat fragment after
+            "before_full_rerun": before["script"],
+            "after_fragment_rerun": after["chat_pane"],
+            "history_sidebar": {"before": before["history_sidebar"], "after": after["history_sidebar"]}
+        }
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Measure the memory held per browser session for its chat messages.
+
+Usage:
+    python benchmarks/bench_session_memory.py --sessions 1000 10000 --history 100 --turns 150
+
+Simulates many concurrent sessions in one process, the way one Streamlit
+server keeps every tab's st.session_state.messages alive. Each session has
+--history stored messages, is reopened from the database and then chats for
+--turns more messages, which are saved and appended as app.main does.
+
+  - before: the list of {"role", "content", "timestamp"} dicts the app kept
+    until now, which grows with every turn
+  - after:  transcript.Transcript, slotted records bounded to the newest
+    RESIDENT_MESSAGES plus a page, with older ones paged back on demand
+
+Memory is the Python heap still allocated once every session is built
+(tracemalloc), including pages db_utils' read cache holds on to, plus
+process RSS growth. Results are printed as JSON.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db_utils
+import transcript
+from transcript import Transcript
+
+WORDS = ("sure here is how you can do that the function returns a list of rows so you need to "
+         "check the index before reading it again python sqlite query cache latency memory").split()
+
+START = datetime(2026, 1, 1)
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def make_rows(session_id, user_id, count, offset, rng):
+    """count alternating user/assistant messages, timestamped after offset earlier ones"""
+    return [(session_id, user_id, "user" if (offset + i) % 2 == 0 else "assistant",
+             " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 60))),
+             START + timedelta(seconds=offset + i))
+            for i in range(count)]
+
+
+def open_before(session_id):
+    messages, _ = db_utils.get_session_messages_page(session_id, transcript.PAGE_SIZE)
+    return messages
+
+
+# How each mode opens a stored session; both then append {"role", "content"} dicts
+MODES = {
+    "before": open_before,
+    "after": Transcript.load
+}
+
+
+def run(mode, sessions, history, turns, seed):
+    open_session = MODES[mode]
+    rng = random.Random(seed)
+    tmp_dir = tempfile.mkdtemp(prefix="bench_session_memory_")
+    try:
+        db_utils.set_backend(db_utils.SQLiteBackend(os.path.join(tmp_dir, "chat_history.db")))
+        db_utils.init_db()
+        ids = [(str(uuid.uuid4()), str(uuid.uuid4())) for _ in range(sessions)]
+        for start in range(0, sessions, 500):
+            db_utils.save_messages([row for session_id, user_id in ids[start:start + 500]
+                                    for row in make_rows(session_id, user_id, history, 0, rng)])
+        db_utils._read_cache.clear()
+        gc.collect()
+
+        baseline_rss = rss_bytes()
+        tracemalloc.start()
+        start = time.perf_counter()
+        held = []
+        for session_id, user_id in ids:
+            messages = open_session(session_id)
+            # Made here so the new messages' text is on the traced heap, as typed input would be
+            rows = make_rows(session_id, user_id, turns, history, rng)
+            # The app saves each message as it's sent; batching the inserts keeps seeding fast
+            db_utils.save_messages(rows)
+            for row in rows:
+                messages.append({"role": row[2], "content": row[3]})
+            held.append(messages)
+        seconds = time.perf_counter() - start
+        gc.collect()
+        heap, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        grown = rss_bytes() - baseline_rss
+
+        resident = sum(len(messages) for messages in held)
+        return {
+            "mode": mode,
+            "sessions": sessions,
+            "messages_per_session": history + turns,
+            "resident_messages_per_session": round(resident / sessions, 1),
+            "heap_mb": round(heap / 2**20, 2),
+            "heap_peak_mb": round(peak / 2**20, 2),
+            "heap_kb_per_session": round(heap / 1024 / sessions, 2),
+            "rss_growth_mb": round(grown / 2**20, 2),
+            "seconds": round(seconds, 3)
+        }
+    finally:
+        db_utils.close_all_pools()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--history", type=int, default=100, help="Stored messages per session before it is reopened")
+    parser.add_argument("--turns", type=int, default=150, help="Messages added per session after reopening")
+    parser.add_argument("--modes", nargs="+", choices=sorted(MODES), default=["before", "after"])
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = [run(mode, count, args.history, args.turns, seed=count)
+               for count in args.sessions for mode in args.modes]
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "page_size": transcript.PAGE_SIZE,
+        "resident_messages": transcript.RESIDENT_MESSAGES,
+        "results": results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Measure save_message write throughput against 1..N SQLite shards.
+
+Usage:
+    python benchmarks/bench_shards.py --shards 1 2 4 8 --workers 8 --messages 2000
+
+Each worker process saves messages for its own pool of users, committing
+every message, the way separate app servers sharing one database would. With
+one shard every commit queues on the same file's write lock; with several,
+users on different shards commit in parallel. Results are printed as JSON
+with messages per second per shard count.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db_utils
+
+
+def make_backend(base_path, shards):
+    if shards == 1:
+        return db_utils.SQLiteBackend(base_path)
+    return db_utils.ShardedSQLiteBackend(shards, base_path)
+
+
+def worker(base_path, shards, messages, users, start_event, results):
+    db_utils.set_backend(make_backend(base_path, shards))
+    user_ids = [str(uuid.uuid4()) for _ in range(users)]
+    sessions = {u: str(uuid.uuid4()) for u in user_ids}
+    start_event.wait()
+    start = time.perf_counter()
+    for i in range(messages):
+        user_id = user_ids[i % users]
+        db_utils.save_message(sessions[user_id], user_id, "user", f"benchmark message {i}")
+    results.put(time.perf_counter() - start)
+
+
+def run(shards, workers, messages, users):
+    tmp_dir = tempfile.mkdtemp(prefix="bench_shards_")
+    base_path = os.path.join(tmp_dir, "chat_history.db")
+    try:
+        db_utils.set_backend(make_backend(base_path, shards))
+        db_utils.init_db()
+        db_utils.close_all_pools()
+
+        ctx = multiprocessing.get_context("spawn")
+        start_event = ctx.Event()
+        results = ctx.Queue()
+        procs = [ctx.Process(target=worker, args=(base_path, shards, messages, users, start_event, results))
+                 for _ in range(workers)]
+        for proc in procs:
+            proc.start()
+        time.sleep(1.0)  # let every worker import and open its connections
+        start = time.perf_counter()
+        start_event.set()
+        durations = [results.get() for _ in procs]
+        wall = time.perf_counter() - start
+        for proc in procs:
+            proc.join()
+
+        total = 0
+        for shard in make_backend(base_path, shards).shards():
+            conn = sqlite3.connect(shard)
+            total += conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+            conn.close()
+        return {
+            "shards": shards,
+            "messages": total,
+            "wall_seconds": round(wall, 3),
+            "messages_per_second": round(total / wall, 1),
+            "slowest_worker_seconds": round(max(durations), 3)
+        }
+    finally:
+        db_utils.close_all_pools()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--workers", type=int, default=8, help="Writer processes")
+    parser.add_argument("--messages", type=int, default=2000, help="Messages saved per worker")
+    parser.add_argument("--users", type=int, default=50, help="Users per worker")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "cpus": os.cpu_count(),
+        "workers": args.workers,
+        "messages_per_worker": args.messages,
+        "results": [run(shards, args.workers, args.messages, args.users) for shards in args.shards]
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Measure cold start: import time of app.py and time to first paint.
+
+Usage:
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --runs 10 --idle 2 --output startup.json
+
+Every sample runs in fresh interpreters, so nothing is already imported,
+against an empty database in a temporary directory with the offline fake
+model. Reported per run:
+
+    import_streamlit_ms  `import streamlit` plus its testing harness
+    import_app_ms        `import app` with streamlit already loaded
+    first_paint_ms       first AppTest run of app.py: header, sidebar and transcript
+    first_prompt_ms      the first chat message after --idle seconds, which
+                         includes loading the LLM client unless warm_llm() has
+                         already done so in the background
+
+The slowest modules imported by app.py, from `python -X importtime`, are
+listed under "top_imports".
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the child interpreter; prints one JSON line
+CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import streamlit
+from streamlit.testing.v1 import AppTest
+t1 = time.perf_counter()
+result = {"import_streamlit_ms": (t1 - t0) * 1000}
+if sys.argv[1] == "import":
+    import app
+    result["import_app_ms"] = (time.perf_counter() - t1) * 1000
+else:
+    at = AppTest.from_file(sys.argv[2], default_timeout=60)
+    start = time.perf_counter()
+    at.run()
+    result["first_paint_ms"] = (time.perf_counter() - start) * 1000
+    if at.exception:
+        raise SystemExit(at.exception[0].message)
+    time.sleep(float(sys.argv[3]))
+    at.chat_input[0].set_value("hello")
+    start = time.perf_counter()
+    at.run()
+    result["first_prompt_ms"] = (time.perf_counter() - start) * 1000
+    if at.exception:
+        raise SystemExit(at.exception[0].message)
+print(json.dumps(result))
+"""
+
+
+def child_env():
+    env = dict(os.environ)
+    env.setdefault("GROQ_API_KEY", "unused")
+    env.setdefault("LLM_PROVIDER", "fake")
+    env.setdefault("FAKE_LLM_LATENCY", "0")
+    env.setdefault("FAKE_LLM_TOKEN_DELAY", "0")
+    env.setdefault("RESPONSE_CACHE_ENABLED", "0")
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (ROOT, env.get("PYTHONPATH")) if p)
+    return env
+
+
+def run_child(*args):
+    with tempfile.TemporaryDirectory(prefix="bench_startup_") as workdir:
+        result = subprocess.run(
+            [sys.executable, "-c", CHILD, *args],
+            cwd=workdir, env=child_env(), capture_output=True, text=True, check=True
+        )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run_once(idle):
+    """One cold import of app.py and, in a second interpreter, one cold first paint"""
+    sample = run_child("import")
+    paint = run_child("paint", os.path.join(ROOT, "app.py"), str(idle))
+    sample.update(first_paint_ms=paint["first_paint_ms"], first_prompt_ms=paint["first_prompt_ms"])
+    return sample
+
+
+def top_imports(count):
+    """Slowest modules by cumulative import time when importing app after streamlit"""
+    with tempfile.TemporaryDirectory(prefix="bench_startup_") as workdir:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import streamlit; import app"],
+            cwd=workdir, env=child_env(), capture_output=True, text=True, check=True
+        )
+    rows = []
+    seen_app = False
+    for line in reversed(result.stderr.splitlines()):
+        # Lines are "import time: self | cumulative | name", children before parents
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [p.strip() for p in line[len("import time:"):].split("|")]
+        if not parts[1].isdigit():
+            continue
+        name = parts[2]
+        if name.strip() == "streamlit" and seen_app:
+            break
+        seen_app = True
+        rows.append((int(parts[1]) / 1000, name.strip()))
+    rows.sort(reverse=True)
+    return [{"module": name, "cumulative_ms": round(ms, 1)} for ms, name in rows[:count]]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean_ms": round(statistics.fmean(samples), 1),
+        "p50_ms": round(samples[len(samples) // 2], 1),
+        "min_ms": round(samples[0], 1),
+        "max_ms": round(samples[-1], 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--idle", type=float, default=1.0,
+                        help="Seconds between first paint and the first prompt")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    runs = [run_once(args.idle) for _ in range(args.runs)]
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "runs": args.runs,
+        "idle_seconds": args.idle,
+        "startup": {key: summarize([r[key] for r in runs]) for key in runs[0]},
+        "top_imports": top_imports(args.top)
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
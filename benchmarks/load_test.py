@@ -0,0 +1,302 @@
+"""Drive app.py with N concurrent simulated users and report capacity numbers.
+
+Usage:
+    python benchmarks/load_test.py --users 10 20 40 --latency 0.2 --token-delay 0.01
+    python benchmarks/load_test.py --users 20 --max-p95-ms 500   # exits 1 when over budget
+
+Every user is a headless streamlit.testing AppTest of app.py on its own
+thread, all in one process, the way one Streamlit worker runs its sessions'
+scripts side by side. load_llm() is backed by the offline fake model with the
+given first-token latency and per-token delay. Each user runs a realistic
+flow: open the app, start --sessions chats of --turns turns each (the first
+one from the initial page, the rest via "+ New Chat"), switch back to an
+earlier chat through its sidebar "Switch" button (ui.load_session) and chat
+there, then delete one chat. --think adds a random pause before each action.
+
+Reported per user count, as JSON:
+  - rerun latency p50/p95/p99 overall and per action (each AppTest run is one
+    script rerun, including the LLM reply for chat turns)
+  - DB lock waits: time spent acquiring SQLite's write lock and waiting for a
+    pooled connection (db.write_lock_wait, db.pool_wait)
+  - memory: process RSS growth per simulated session; later levels can reuse
+    memory freed by earlier ones, so run one level for the cleanest figure
+--max-p95-ms / --max-p99-ms / --max-errors turn the run into a regression gate.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def configure_environment(args, tmp_dir):
+    # Read by config at import time, so set before anything imports it
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["FAKE_LLM_LATENCY"] = str(args.latency)
+    os.environ["FAKE_LLM_TOKEN_DELAY"] = str(args.token_delay)
+    os.environ.setdefault("RESPONSE_CACHE_ENABLED", "0")
+    os.environ.setdefault("METRICS_PORT", "0")
+    os.environ["MEMORY_INDEX_DIR"] = os.path.join(tmp_dir, "chat_vectors")
+
+
+def share_runtime():
+    """
+    Make AppTest behave like one server process hosting many sessions.
+    AppTest installs a mock Runtime singleton for the length of each run and
+    clears it afterwards, which breaks any other AppTest running at the same
+    time, so fall back to one shared mock instead. It also compiles the
+    script afresh on every run, and concurrent ast.parse calls are not
+    thread-safe on Python 3.11; a real server compiles once into a shared,
+    locked ScriptCache, so share one here too.
+    """
+    from unittest.mock import MagicMock
+
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    shared = MagicMock(spec=Runtime)
+    shared.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    shared.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: cls._instance or shared)
+    Runtime.exists = classmethod(lambda cls: True)
+
+    script_cache = ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+
+
+def rss_bytes():
+    """Current resident set size (Linux), falling back to the peak elsewhere"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+
+    def pct(p):
+        return round(samples[min(len(samples) - 1, int(len(samples) * p))], 3)
+
+    return {
+        "count": len(samples),
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": round(samples[-1], 3)
+    }
+
+
+def histogram_summary(hist):
+    """count, total and mean of a metrics histogram, with the bucket bound holding its 95th percentile"""
+    if hist is None or not hist["count"]:
+        return {"count": 0, "total_ms": 0.0}
+    target = hist["count"] * 0.95
+    p95 = next((bound for bound, cumulative in hist["buckets"] if cumulative >= target), None)
+    return {
+        "count": hist["count"],
+        "total_ms": round(hist["sum"] * 1000, 3),
+        "mean_ms": round(hist["sum"] / hist["count"] * 1000, 3),
+        "p95_bucket_ms": p95 * 1000 if p95 is not None else None
+    }
+
+
+class SimulatedUser:
+    """One browser session: an AppTest plus the actions it times"""
+
+    def __init__(self, args, rng, samples, errors):
+        from streamlit.testing.v1 import AppTest
+
+        self.args = args
+        self.rng = rng
+        self.samples = samples      # shared: action -> [ms, ...]
+        self.errors = errors        # shared list of error strings
+        self.user_id = str(uuid.uuid4())
+        self.at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=args.timeout)
+        self.at.session_state["user_id"] = self.user_id
+        self.sessions = []
+
+    def _timed(self, action, step):
+        if self.args.think:
+            time.sleep(self.rng.uniform(0, self.args.think))
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            self.errors.append(f"{action}: {type(e).__name__}: {e}")
+            return
+        self.samples.setdefault(action, []).append((time.perf_counter() - start) * 1000)
+        if self.at.exception:
+            self.errors.append(f"{action}: {self.at.exception[0].message}")
+
+    def _button(self, key=None, label=None):
+        for button in self.at.button:
+            if (key is not None and button.key == key) or (label is not None and button.label == label):
+                return button
+        raise LookupError(f"no button {key or label!r} on the page")
+
+    def _chat(self, session_index, turn):
+        prompt = f"user {self.user_id[:8]} chat {session_index} turn {turn}: {self.rng.random():.6f}"
+        self._timed("turn", lambda: self.at.chat_input[0].set_value(prompt).run())
+
+    def run(self):
+        args = self.args
+        self._timed("open_app", self.at.run)
+        for s in range(args.sessions):
+            if s:
+                self._timed("new_chat", lambda: self._button(label="+ New Chat").click().run())
+            for turn in range(args.turns):
+                self._chat(s, turn)
+            self.sessions.append(self.at.session_state["session_id"])
+
+        if len(self.sessions) > 1:
+            # Back to the first chat through the sidebar, then keep talking there
+            self._timed("switch_session", lambda: self._button(key=f"switch_{self.sessions[0]}").click().run())
+            for turn in range(args.turns):
+                self._chat(0, args.turns + turn)
+            doomed = self.sessions[-1]
+            self._timed("delete_session", lambda: self._button(key=f"delete_{doomed}").click().run())
+
+
+def run_level(args, users):
+    import db_utils
+    import metrics
+
+    metrics.reset()
+    samples, errors = {}, []
+    rng = random.Random(users)
+    baseline = rss_bytes()
+    simulated = [SimulatedUser(args, random.Random(rng.random()), samples, errors) for _ in range(users)]
+    start_gate = threading.Barrier(users)
+
+    def drive(user):
+        start_gate.wait()
+        user.run()
+
+    threads = [threading.Thread(target=drive, args=(user,), name=f"load-user-{i}") for i, user in enumerate(simulated)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    db_utils.flush_pending_writes()
+
+    # Measured while every AppTest (and its session state) is still alive
+    grown = rss_bytes() - baseline
+    histograms, _ = metrics.snapshot()
+    all_samples = [ms for action in samples.values() for ms in action]
+    session_count = sum(len(user.sessions) for user in simulated)
+    return {
+        "users": users,
+        "wall_seconds": round(wall, 3),
+        "reruns": len(all_samples),
+        "reruns_per_second": round(len(all_samples) / wall, 2) if wall else None,
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "rerun": percentiles(all_samples),
+        "by_action": {action: percentiles(values) for action, values in sorted(samples.items())},
+        "db": {
+            "write_lock_wait": histogram_summary(histograms.get("db.write_lock_wait")),
+            "pool_wait": histogram_summary(histograms.get("db.pool_wait")),
+            "save_message": histogram_summary(histograms.get("db.save_message"))
+        },
+        "memory": {
+            "rss_growth_mb": round(grown / 2**20, 2),
+            "sessions": session_count,
+            "kb_per_session": round(grown / 1024 / session_count, 1) if session_count else None,
+            "kb_per_user": round(grown / 1024 / users, 1)
+        }
+    }
+
+
+def gate_failures(args, result):
+    failures = []
+    if args.max_p95_ms is not None and result["rerun"].get("p95_ms", 0) > args.max_p95_ms:
+        failures.append(f"{result['users']} users: p95 {result['rerun']['p95_ms']} ms > {args.max_p95_ms} ms")
+    if args.max_p99_ms is not None and result["rerun"].get("p99_ms", 0) > args.max_p99_ms:
+        failures.append(f"{result['users']} users: p99 {result['rerun']['p99_ms']} ms > {args.max_p99_ms} ms")
+    if result["errors"] > args.max_errors:
+        failures.append(f"{result['users']} users: {result['errors']} errors > {args.max_errors}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[5, 10, 20], help="Concurrent users per level")
+    parser.add_argument("--sessions", type=int, default=3, help="Chats each user starts")
+    parser.add_argument("--turns", type=int, default=4, help="Turns per chat")
+    parser.add_argument("--latency", type=float, default=0.1, help="Fake model seconds to first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Fake model seconds between tokens")
+    parser.add_argument("--think", type=float, default=0.0, help="Max random seconds before each action")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds one rerun may take")
+    parser.add_argument("--max-p95-ms", type=float, help="Fail when rerun p95 exceeds this")
+    parser.add_argument("--max-p99-ms", type=float, help="Fail when rerun p99 exceeds this")
+    parser.add_argument("--max-errors", type=int, default=0, help="Fail when more actions than this error")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="load_test_")
+    configure_environment(args, tmp_dir)
+    share_runtime()
+    import db_utils
+    import metrics
+
+    try:
+        db_utils.DB_PATH = os.path.join(tmp_dir, "chat_history.db")
+        metrics.METRICS_DB_PATH = os.path.join(tmp_dir, "metrics.db")
+        db_utils.init_db()
+        # Throwaway user so imports and caches don't land in the first level
+        run_level(argparse.Namespace(**{**vars(args), "sessions": 1, "turns": 1, "think": 0}), 1)
+        results = [run_level(args, users) for users in args.users]
+    finally:
+        db_utils.close_all_pools()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "cpus": os.cpu_count(),
+        "write_behind": db_utils.WRITE_BEHIND,
+        "storage": db_utils.STORAGE_BACKEND,
+        "flow": {"sessions": args.sessions, "turns": args.turns, "latency": args.latency,
+                 "token_delay": args.token_delay, "think": args.think},
+        "results": results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    failures = [failure for result in results for failure in gate_failures(args, result)]
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import db_utils
+from config import Config
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Case- and whitespace-insensitive form used for cache keys"""
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+def make_cache_key(model, temperature, messages):
+    payload = json.dumps({
+        "model": model,
+        "temperature": temperature,
+        "messages": [[msg["role"], normalize_text(msg["content"])] for msg in messages]
+    }, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier LLM response cache: an in-memory LRU in front of a SQLite table.
+    Entries expire after ttl_seconds; each tier evicts least recently used
+    entries beyond its size limit.
+    """
+
+    # Disk eviction runs once every this many writes rather than on each one
+    EVICT_EVERY = 100
+
+    def __init__(self, db_path, memory_entries=512, disk_entries=50000, ttl_seconds=7 * 24 * 3600):
+        self.db_path = db_path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()  # key -> (response, created_at)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0}
+
+        with db_utils.get_connection(self.db_path) as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS llm_cache
+                            (key TEXT PRIMARY KEY,
+                             response TEXT,
+                             created_at REAL,
+                             last_hit REAL)''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_hit ON llm_cache (last_hit)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[1] < self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return entry[0]
+                del self._memory[key]
+
+        with db_utils.get_connection(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE llm_cache SET last_hit = ? WHERE key = ?", (now, key))
+
+        with self._lock:
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._remember(key, row[0], row[1])
+        return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+            self._writes += 1
+            evict = self._writes % self.EVICT_EVERY == 0
+
+        with db_utils.get_connection(self.db_path) as conn:
+            conn.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?)", (key, response, now, now))
+            if evict:
+                conn.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - self.ttl_seconds,))
+                conn.execute("""DELETE FROM llm_cache WHERE key IN
+                                (SELECT key FROM llm_cache ORDER BY last_hit DESC LIMIT -1 OFFSET ?)""",
+                             (self.disk_entries,))
+
+    def record_bypass(self):
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        with db_utils.get_connection(self.db_path) as conn:
+            conn.execute("DELETE FROM llm_cache")
+
+    def _remember(self, key, response, created_at):
+        # Caller holds self._lock
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Process-wide response cache stored next to chat_history.db, or None when disabled"""
+    global _cache
+    if not Config.RESPONSE_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                db_dir = os.path.dirname(os.path.abspath(db_utils.DB_PATH))
+                _cache = ResponseCache(
+                    os.path.join(db_dir, Config.RESPONSE_CACHE_DB),
+                    memory_entries=Config.RESPONSE_CACHE_MEMORY_ENTRIES,
+                    disk_entries=Config.RESPONSE_CACHE_DISK_ENTRIES,
+                    ttl_seconds=Config.RESPONSE_CACHE_TTL
+                )
+    return _cache
@@ -1,23 +1,210 @@
 from llm_utils import load_llm
+import time
+from contextlib import contextmanager
+from admission import (AdmissionRejected, get_admission_controller, is_rate_limit_error,
+                       retry_after, backoff_delay)
+from context_utils import build_context, count_tokens, get_token_budget, message_tokens
+from cache_utils import get_response_cache, make_cache_key
+from config import Config
+from metrics import timed, observe, incr
 
-def generate_response(prompt, history):
+def _recall(prompt, history, user_id):
+    """System message with snippets from the user's earlier sessions, or None"""
+    if not (Config.LONG_TERM_MEMORY and user_id):
+        return None
+    # Imported on first use so numpy stays out of app startup
+    from memory_index import memory_message
+    try:
+        with timed("chat.recall"):
+            return memory_message(user_id, prompt, history)
+    except Exception:
+        incr("chat_memory_errors_total")
+        return None
+
+def _build_messages(prompt, history, user_id=None, use_memory=True):
+    # Format messages for LangChain, packing as much recent history as the token budget allows
+    with timed("chat.build_context"):
+        memory = _recall(prompt, history, user_id) if use_memory else None
+        if memory is None:
+            messages = build_context(prompt, history)
+        else:
+            # Recalled snippets go first and come out of the history's share of the budget
+            messages = [memory] + build_context(prompt, history, get_token_budget() - message_tokens(memory))
+    incr("chat_tokens_in_total", sum(message_tokens(msg) for msg in messages))
+    return messages
+
+def _lookup_cache(llm, messages, use_cache):
+    """Returns (cache, key, cached_response); key is None when the cache is off or bypassed"""
+    cache = get_response_cache()
+    if cache is None:
+        return None, None, None
+    if not use_cache:
+        cache.record_bypass()
+        return cache, None, None
+    key = make_cache_key(
+        getattr(llm, "model_name", Config.ACTIVE_MODEL),
+        getattr(llm, "temperature", None),
+        messages
+    )
+    cached = cache.get(key)
+    incr("chat_cache_hits_total" if cached is not None else "chat_cache_misses_total")
+    return cache, key, cached
+
+def _cacheable(llm):
+    """False when the router's reply came from another model than the preferred one the cache key names"""
+    last_model = getattr(llm, "last_model", None)
+    if last_model is None:
+        return True
+    cacheable = last_model() == getattr(llm, "model_name", None)
+    if not cacheable:
+        incr("chat_cache_fallback_skips_total")
+    return cacheable
+
+# Shown instead of a reply when the admission queue is full or the wait ran out
+BUSY_MESSAGE = "The assistant is busy right now, please try again in a moment."
+
+@contextmanager
+def _admission(user_id, messages, on_wait):
+    """Waits for an LLM slot; set "output_tokens" on the yielded dict to settle real usage"""
+    reply = {"output_tokens": None}
+    controller = get_admission_controller()
+    if controller is None:
+        yield reply
+        return
+    input_tokens = sum(message_tokens(msg) for msg in messages)
+    with controller.admitted(user_id or "anonymous", input_tokens + Config.EXPECTED_RESPONSE_TOKENS,
+                             on_wait) as usage:
+        try:
+            yield reply
+        finally:
+            if reply["output_tokens"] is not None:
+                usage["used_tokens"] = input_tokens + reply["output_tokens"]
+
+def _rate_limit_backoff(error, attempt):
+    """Sleeps before retrying a 429; returns False when the error should be raised instead"""
+    if attempt >= Config.LLM_RATE_LIMIT_RETRIES or not is_rate_limit_error(error):
+        return False
+    delay = retry_after(error) or backoff_delay(attempt)
+    incr("chat_llm_rate_limited_total")
+    # Hold everyone else's queued calls too, instead of letting them hit the same limit
+    controller = get_admission_controller()
+    if controller is not None:
+        controller.pause(delay)
+    time.sleep(delay)
+    return True
+
+def complete(prompt, history, use_cache=True, user_id=None, on_wait=None, use_memory=True):
+    """
+    generate_response without the friendly fallbacks: raises AdmissionRejected
+    when no LLM slot frees up and the provider's error when the call fails.
+    Used by batch jobs, which need to tell failures apart from replies.
+    use_memory=False leaves out snippets recalled from the user's other sessions.
+    """
+    llm = load_llm()
+    messages = _build_messages(prompt, history, user_id, use_memory)
+    cache, key, cached = _lookup_cache(llm, messages, use_cache)
+    if cached is not None:
+        return cached
+    
+    try:
+        with _admission(user_id, messages, on_wait) as reply:
+            attempt = 0
+            while True:
+                try:
+                    with timed("llm.invoke"):
+                        response = llm.invoke(messages).content.strip()
+                    break
+                except Exception as e:
+                    if not _rate_limit_backoff(e, attempt):
+                        raise
+                    attempt += 1
+            reply["output_tokens"] = count_tokens(response)
+    except AdmissionRejected:
+        raise
+    except Exception:
+        incr("chat_llm_errors_total")
+        raise
+    
+    incr("chat_tokens_out_total", count_tokens(response))
+    if key is not None and _cacheable(llm):
+        cache.put(key, response)
+    return response
+
+def generate_response(prompt, history, use_cache=True, user_id=None, on_wait=None):
     """
     Generates AI response using Groq via LangChain
     Args:
         prompt (str): Current user message
-        history (list): Conversation history in format [{"role": "user|assistant", "content": str}]
+        history (list): Conversation history in format [{"role": "user|assistant", "content": str}], or a Transcript
+        use_cache (bool): Set False to skip the response cache for this request
+        user_id (str): Caller, for per-user rate limits and fair queueing
+        on_wait (callable): Called as on_wait(position, seconds) while queued for the LLM
+    """
+    try:
+        return complete(prompt, history, use_cache, user_id, on_wait)
+    except AdmissionRejected:
+        return BUSY_MESSAGE
+    except Exception as e:
+        return f"Sorry, I encountered an error: {str(e)}"
+
+def stream_response(prompt, history, use_cache=True, user_id=None, on_wait=None):
+    """
+    Streaming variant of generate_response, yields text chunks as they arrive.
+    An error before the first chunk is yielded as the reply, like
+    generate_response does; one after it is raised, so the partial reply is
+    never mixed with the error text.
+    Args:
+        prompt (str): Current user message
+        history (list): Conversation history in format [{"role": "user|assistant", "content": str}], or a Transcript
+        use_cache (bool): Set False to skip the response cache for this request
+        user_id (str): Caller, for per-user rate limits and fair queueing
+        on_wait (callable): Called as on_wait(position, seconds) while queued for the LLM
     """
     llm = load_llm()
+    messages = _build_messages(prompt, history, user_id)
+    cache, key, cached = _lookup_cache(llm, messages, use_cache)
+    if cached is not None:
+        yield cached
+        return
     
-    # Format messages for LangChain
-    messages = [
-        {"role": msg["role"], "content": msg["content"]} 
-        for msg in history[-5:]  # Use last 5 messages for context
-    ]
-    messages.append({"role": "user", "content": prompt})
-    
+    chunks = []
+    start = None
     try:
-        response = llm.invoke(messages).content
-        return response.strip()
+        with _admission(user_id, messages, on_wait) as reply:
+            start = time.perf_counter()
+            attempt = 0
+            try:
+                while True:
+                    try:
+                        for chunk in llm.stream(messages):
+                            if chunk.content:
+                                if not chunks:
+                                    observe("llm.first_token", time.perf_counter() - start)
+                                chunks.append(chunk.content)
+                                yield chunk.content
+                        break
+                    except Exception as e:
+                        # A 429 can only be retried before anything was shown
+                        if chunks or not _rate_limit_backoff(e, attempt):
+                            raise
+                        attempt += 1
+            finally:
+                reply["output_tokens"] = count_tokens("".join(chunks))
+    except AdmissionRejected:
+        yield BUSY_MESSAGE
+        return
     except Exception as e:
-        return f"Sorry, I encountered an error: {str(e)}"
\ No newline at end of file
+        incr("chat_llm_errors_total")
+        if chunks:
+            raise
+        yield f"Sorry, I encountered an error: {str(e)}"
+        return
+    finally:
+        if start is not None:
+            observe("llm.stream", time.perf_counter() - start)
+        if chunks:
+            incr("chat_tokens_out_total", count_tokens("".join(chunks)))
+    
+    # Only completed streams are cached, a cancelled one never reaches this point
+    if key is not None and _cacheable(llm):
+        cache.put(key, "".join(chunks).strip())
@@ -2,7 +2,8 @@ import os
 from dotenv import load_dotenv
 import streamlit as st
 
-load_dotenv()
+# Explicit path, so load_dotenv doesn't search up from the caller's frame
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
 
 # Configuration Constants
 APP_CONFIG = {
@@ -17,7 +18,79 @@ class Config:
     GROQ_MODEL = "mixtral-8x7b-32768"
     ACTIVE_MODEL = "llama3-70b-8192"
     
-    if not GROQ_API_KEY:
+    # Context window per model; the rest of the budget is held back for the reply
+    MODEL_CONTEXT_WINDOWS = {
+        "mixtral-8x7b-32768": 32768,
+        "llama3-70b-8192": 8192
+    }
+    DEFAULT_CONTEXT_WINDOW = 4096
+    RESPONSE_TOKEN_RESERVE = 1024
+    # Explicit prompt token budget, overrides the per-model window when set
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0")) or None
+    
+    # LLM response cache (memory LRU in front of a SQLite file next to chat_history.db).
+    # Off unless RESPONSE_CACHE_ENABLED=1: replies are sampled (temperature > 0), so
+    # a cache hit repeats one sample where a fresh call would give another
+    RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+    RESPONSE_CACHE_DB = "llm_cache.db"
+    RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+    RESPONSE_CACHE_MEMORY_ENTRIES = 512
+    RESPONSE_CACHE_DISK_ENTRIES = 50000
+    
+    # Serve Prometheus metrics on this port when non-zero
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+    
+    # "groq" for the real API, "fake" for the offline streaming test model
+    LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq")
+    FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0"))
+    FAKE_LLM_TOKEN_DELAY = float(os.getenv("FAKE_LLM_TOKEN_DELAY", "0"))
+    
+    # Admission control in front of the LLM, limits per minute and 0 disables one.
+    # Defaults follow Groq's free tier; the offline fake model is unlimited
+    LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "30" if LLM_PROVIDER == "groq" else "0"))
+    LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "6000" if LLM_PROVIDER == "groq" else "0"))
+    USER_REQUESTS_PER_MINUTE = int(os.getenv("USER_REQUESTS_PER_MINUTE", "10" if LLM_PROVIDER == "groq" else "0"))
+    USER_TOKENS_PER_MINUTE = int(os.getenv("USER_TOKENS_PER_MINUTE", "3000" if LLM_PROVIDER == "groq" else "0"))
+    LLM_MAX_CONCURRENT = int(os.getenv("LLM_MAX_CONCURRENT", "8" if LLM_PROVIDER == "groq" else "0"))
+    LLM_QUEUE_SIZE = 64
+    LLM_QUEUE_MAX_WAIT = 60
+    # Reply tokens charged up front, settled against the real reply afterwards
+    EXPECTED_RESPONSE_TOKENS = 256
+    # Retries with jittered backoff when the provider answers 429
+    LLM_RATE_LIMIT_RETRIES = 3
+    
+    # Models the router tries in order; the first is preferred while it stays healthy
+    LLM_MODELS = [m.strip() for m in os.getenv("LLM_MODELS", f"{ACTIVE_MODEL},{GROQ_MODEL}").split(",") if m.strip()]
+    # Send a request that has no answer (or first token) after this many seconds
+    # to the next model as well and keep whichever answers first; 0 disables
+    LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+    # Models slower than this median latency in seconds are tried last; 0 disables
+    LLM_SLOW_AFTER = float(os.getenv("LLM_SLOW_AFTER", "0"))
+    ROUTER_WINDOW = 50
+    ROUTER_MAX_ERROR_RATE = 0.5
+    ROUTER_FAILURE_THRESHOLD = 3
+    ROUTER_COOLDOWN = 30
+    
+    # Name sessions from their first message on background threads
+    SESSION_TITLES = os.getenv("SESSION_TITLES", "1") != "0"
+    TITLE_WORKERS = 2
+    # How often the sidebar checks for finished titles while one is pending
+    TITLE_POLL_SECONDS = 2
+    
+    # Long-term memory: snippets from the user's earlier sessions, found in a
+    # local hashed n-gram vector index, are added to each prompt
+    LONG_TERM_MEMORY = os.getenv("LONG_TERM_MEMORY", "1") != "0"
+    MEMORY_INDEX_DIR = os.getenv("MEMORY_INDEX_DIR", "chat_vectors")
+    MEMORY_TOP_K = 3
+    # Cosine similarity a snippet needs to be included
+    MEMORY_MIN_SCORE = 0.2
+    MEMORY_TOKEN_BUDGET = 300
+    MEMORY_SNIPPET_CHARS = 300
+    
+    # Render assistant replies token by token as they arrive
+    STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "1") != "0"
+    
+    if LLM_PROVIDER == "groq" and not GROQ_API_KEY:
         raise ValueError("❌ GROQ_API_KEY missing from .env")
 
 def set_streamlit_config():
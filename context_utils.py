@@ -0,0 +1,65 @@
+import math
+import re
+from functools import lru_cache
+from config import Config
+
+# Approximate framing cost of each chat message (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text):
+    """
+    Estimate the token count of text without a model-specific tokenizer.
+    Long words are charged one token per four characters, which errs on the
+    high side of BPE tokenizers so the budget is not overrun.
+    """
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in _TOKEN_PATTERN.findall(text))
+
+
+def message_tokens(message):
+    # count_tokens is cached per content, so re-assembling a long history
+    # only tokenizes the messages that are new since the last turn
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def get_token_budget(model=None):
+    """Prompt token budget for model (defaults to Config.ACTIVE_MODEL)"""
+    if Config.CONTEXT_TOKEN_BUDGET:
+        return Config.CONTEXT_TOKEN_BUDGET
+    window = Config.MODEL_CONTEXT_WINDOWS.get(model or Config.ACTIVE_MODEL, Config.DEFAULT_CONTEXT_WINDOW)
+    return window - Config.RESPONSE_TOKEN_RESERVE
+
+
+def build_context(prompt, history, budget=None):
+    """
+    Pack the most recent history that fits the token budget
+    Args:
+        prompt (str): Current user message
+        history (list): Conversation history, which may already end with prompt
+        budget (int): Token budget, defaults to get_token_budget()
+    Returns:
+        list of {"role", "content"} dicts, oldest first, always ending with prompt
+    """
+    if budget is None:
+        budget = get_token_budget()
+
+    turns = list(history)
+    # app.main appends the prompt to history before asking for a reply
+    if not (turns and turns[-1]["role"] == "user" and turns[-1]["content"] == prompt):
+        turns.append({"role": "user", "content": prompt})
+
+    selected = []
+    used = 0
+    for msg in reversed(turns):
+        cost = message_tokens(msg)
+        # The prompt itself is always sent, even when it alone exceeds the budget
+        if selected and used + cost > budget:
+            break
+        selected.append({"role": msg["role"], "content": msg["content"]})
+        used += cost
+
+    selected.reverse()
+    return selected
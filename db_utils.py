@@ -1,138 +1,1468 @@
 import sqlite3
-from datetime import datetime
-import streamlit as st
-import uuid
+import os
+import queue
+import threading
+import atexit
+import time
+import logging
+import re
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from datetime import datetime, timedelta
+from metrics import timed_function, incr, observe
 
 # Database file created in project directory
 DB_PATH = 'chat_history.db'
 
+# Connection pool tuning
+POOL_SIZE = 8
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 16000
+STATEMENT_CACHE_SIZE = 128
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # Create initial table if it doesn't exist
-    c.execute('''CREATE TABLE IF NOT EXISTS chats
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  session_id TEXT,
-                  user_id TEXT,
-                  role TEXT,
-                  content TEXT,
-                  timestamp DATETIME)''')
-    
-    # Check if columns exist and add them if needed
-    c.execute("PRAGMA table_info(chats)")
-    columns = [col[1] for col in c.fetchall()]
-    
-    if 'session_name' not in columns:
+# Characters of the first user message kept as the session preview
+PREVIEW_LENGTH = 100
+
+# Optional write-behind: save_message queues rows for a background writer
+# that group-commits them instead of committing each message on the caller
+WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "0") == "1"
+WRITE_BATCH_SIZE = 256
+WRITE_FLUSH_INTERVAL = 0.05
+
+# Process-wide cache of read results (session lists, previews, transcripts)
+READ_CACHE_ENTRIES = 2048
+READ_CACHE_MAX_VERSIONS = 100000
+
+# Rows (or sessions) per transaction in schema backfills
+MIGRATION_CHUNK_SIZE = 5000
+
+# Storage backend: "sqlite" (the DB_PATH file), "sharded" (SHARD_COUNT files
+# next to DB_PATH, users spread by user_id) or "sqlalchemy" (DATABASE_URL)
+STORAGE_BACKEND = os.getenv("CHAT_STORAGE", "sqlite")
+SHARD_COUNT = int(os.getenv("CHAT_SHARDS", "4"))
+DATABASE_URL = os.getenv("CHAT_DATABASE_URL", "")
+# Sessions whose shard is remembered, so session-only lookups skip probing
+SESSION_SHARD_ENTRIES = 100000
+
+# Cold storage: sessions idle this long are compressed into archived_sessions
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = 200
+ARCHIVE_ZSTD_LEVEL = 10
+# Free pages returned to the filesystem per archive batch (incremental vacuum)
+VACUUM_PAGES_PER_BATCH = 2000
+
+logger = logging.getLogger(__name__)
+
+
+def _configure_connection(conn):
+    # Only takes effect on new files, enable_incremental_vacuum() converts old ones
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+
+
+class ConnectionPool:
+    """Thread-safe pool of persistent SQLite connections for one database file"""
+
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        # cached_statements keeps prepared statements alive for the life of the connection
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        _configure_connection(conn)
+        return conn
+
+    def acquire(self):
         try:
-            # First add without default
-            c.execute("ALTER TABLE chats ADD COLUMN session_name TEXT")
-            # Then update all existing rows
-            c.execute("UPDATE chats SET session_name = 'New Chat'")
-        except sqlite3.OperationalError:
+            return self._idle.get_nowait()
+        except queue.Empty:
             pass
-    
-    if 'created_at' not in columns:
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+
+        if not can_create:
+            # Pool exhausted, wait for another thread to hand one back
+            start = time.perf_counter()
+            conn = self._idle.get()
+            observe("db.pool_wait", time.perf_counter() - start)
+            return conn
+
         try:
-            # First add without default
-            c.execute("ALTER TABLE chats ADD COLUMN created_at DATETIME")
-            # Then update all existing rows with current timestamp
-            c.execute("UPDATE chats SET created_at = datetime('now')")
-        except sqlite3.OperationalError:
-            pass
-    
-    # Create indexes
-    c.execute("CREATE INDEX IF NOT EXISTS idx_session ON chats (session_id)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_user ON chats (user_id)")
-    
+            return self._open()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path=None):
+    """Return the process-wide pool for db_path (defaults to DB_PATH)"""
+    key = os.path.abspath(db_path or DB_PATH)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(key)
+    return pool
+
+
+@contextmanager
+def get_connection(db_path=None):
+    """Borrow a pooled connection; commits on success and rolls back on error"""
+    pool = get_pool(db_path)
+    conn = pool.acquire()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        pool.release(conn)
+
+
+@atexit.register
+def close_all_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+    if _backend is not None:
+        _backend.close()
+
+
+class StorageBackend(ABC):
+    """
+    Where chat data lives. Each user's sessions and messages are kept in
+    exactly one shard; the functions in this module ask the backend which
+    shard that is and borrow connections to it. Connections must run this
+    module's SQLite SQL (FTS5, UPSERT, PRAGMAs).
+    """
+
+    @abstractmethod
+    def shards(self):
+        """Every shard key, in a stable order"""
+
+    @abstractmethod
+    def shard_for_user(self, user_id):
+        """Shard key holding user_id's sessions and messages"""
+
+    @abstractmethod
+    def connect(self, shard):
+        """Context manager yielding a connection, committed on success and rolled back on error"""
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    A single SQLite file, DB_PATH unless db_path is given. The default.
+    Args:
+        db_path (str): Database file, read from DB_PATH on each call when None
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path
+
+    def shards(self):
+        return [os.path.abspath(self.db_path or DB_PATH)]
+
+    def shard_for_user(self, user_id):
+        return os.path.abspath(self.db_path or DB_PATH)
+
+    def connect(self, shard):
+        return get_connection(shard)
+
+
+def shard_index(user_id, count):
+    """Stable shard number for user_id (Python's hash() differs between processes)"""
+    return zlib.crc32(user_id.encode("utf-8")) % count
+
+
+class ShardedSQLiteBackend(StorageBackend):
+    """
+    Users spread over several SQLite files by a hash of user_id. Each shard
+    has its own connection pool, write lock and write-behind writer, so
+    writes for users on different shards never wait on each other.
+    Args:
+        count (int): Number of shard files
+        base_path (str): chat_history.db gives chat_history.shard0.db, chat_history.shard1.db, ...;
+            DB_PATH when None
+    """
+
+    def __init__(self, count=SHARD_COUNT, base_path=None):
+        if count < 1:
+            raise ValueError("ShardedSQLiteBackend needs at least one shard")
+        self.count = count
+        self.base_path = base_path
+
+    def shards(self):
+        root, ext = os.path.splitext(os.path.abspath(self.base_path or DB_PATH))
+        return [f"{root}.shard{i}{ext or '.db'}" for i in range(self.count)]
+
+    def shard_for_user(self, user_id):
+        return self.shards()[shard_index(user_id, self.count)]
+
+    def connect(self, shard):
+        return get_connection(shard)
+
+
+class SQLAlchemyBackend(StorageBackend):
+    """
+    One database reached through a SQLAlchemy engine, whose pool replaces
+    ConnectionPool. The queries here are SQLite SQL, so this takes sqlite://
+    URLs; other dialects need those queries ported first.
+    Args:
+        url (str): Database URL, e.g. sqlite:////var/lib/chat/chat_history.db
+        pool_size (int): Connections kept by the engine
+    """
+
+    def __init__(self, url, pool_size=POOL_SIZE):
+        from sqlalchemy import create_engine, event
+
+        if not url.startswith("sqlite"):
+            raise ValueError(f"SQLAlchemyBackend only supports sqlite URLs, got {url!r}")
+        self.url = url
+        self.engine = create_engine(
+            url,
+            pool_size=pool_size,
+            max_overflow=0,
+            pool_pre_ping=True,
+            connect_args={
+                "check_same_thread": False,
+                "timeout": BUSY_TIMEOUT_MS / 1000,
+                "cached_statements": STATEMENT_CACHE_SIZE
+            }
+        )
+        event.listen(self.engine, "connect", lambda dbapi_connection, record: _configure_connection(dbapi_connection))
+
+    def shards(self):
+        return [self.url]
+
+    def shard_for_user(self, user_id):
+        return self.url
+
+    @contextmanager
+    def connect(self, shard):
+        proxy = self.engine.raw_connection()
+        conn = proxy.driver_connection
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            proxy.close()
+
+    def close(self):
+        self.engine.dispose()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_session_shards = OrderedDict()  # session_id -> shard, most recently used last
+_session_shards_lock = threading.Lock()
+
+
+def create_backend(kind=None):
+    """Backend named by kind, defaulting to STORAGE_BACKEND"""
+    kind = kind or STORAGE_BACKEND
+    if kind == "sqlite":
+        return SQLiteBackend()
+    if kind == "sharded":
+        return ShardedSQLiteBackend(SHARD_COUNT)
+    if kind == "sqlalchemy":
+        if not DATABASE_URL:
+            raise ValueError("CHAT_DATABASE_URL must be set for the sqlalchemy storage backend")
+        return SQLAlchemyBackend(DATABASE_URL)
+    raise ValueError(f"Unknown storage backend {kind!r}")
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+
+def set_backend(backend):
+    """Swap the process-wide backend, e.g. in tools and benchmarks; caches are reset"""
+    global _backend
+    flush_pending_writes()
+    with _backend_lock:
+        old, _backend = _backend, backend
+    if old is not None and old is not backend:
+        old.close()
+    with _session_shards_lock:
+        _session_shards.clear()
+    _read_cache.clear()
+    return backend
+
+
+def _remember_session(session_id, shard):
+    with _session_shards_lock:
+        _session_shards[session_id] = shard
+        _session_shards.move_to_end(session_id)
+        while len(_session_shards) > SESSION_SHARD_ENTRIES:
+            _session_shards.popitem(last=False)
+
+
+def _user_shard(user_id):
+    return get_backend().shard_for_user(user_id)
+
+
+def _session_shard(session_id):
+    """
+    Shard holding session_id, or None for a session with no messages yet.
+    Sessions seen through save_message or list_sessions are remembered;
+    anything else is looked up in each shard's sessions table.
+    """
+    backend = get_backend()
+    shards = backend.shards()
+    if len(shards) == 1:
+        return shards[0]
+    with _session_shards_lock:
+        shard = _session_shards.get(session_id)
+    if shard is not None:
+        return shard
+    for shard in shards:
+        writer = _writers.get(shard)
+        found = writer is not None and writer.pending_rows(session_id)
+        if not found:
+            with backend.connect(shard) as conn:
+                found = conn.execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if found:
+            _remember_session(session_id, shard)
+            return shard
+    return None
+
+
+class MessageWriter:
+    """Background thread that drains queued messages into grouped transactions"""
+
+    _STOP = object()
+    MAX_ATTEMPTS = 3
+
+    def __init__(self, shard, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL):
+        self.shard = shard
+        # Read cache scope; the same for every shard of one deployment
+        self.db_path = os.path.abspath(DB_PATH)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._pending = {}  # session_id -> rows queued but not yet committed
+        self._pending_lock = threading.Lock()
+        self._failed = []  # batches that ran out of attempts, retried by flush() and close()
+        self._thread = threading.Thread(target=self._run, name="chat-message-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, row):
+        with self._pending_lock:
+            self._pending.setdefault(row[0], []).append(row)
+        self._queue.put(row)
+
+    def pending_rows(self, session_id):
+        with self._pending_lock:
+            return list(self._pending.get(session_id, ()))
+
+    def flush(self):
+        """
+        Block until everything submitted so far is committed
+        Raises:
+            sqlite3.Error: Batches that failed in the background still can't be stored; they stay queued
+        """
+        self._queue.join()
+        self.retry_failed()
+
+    def close(self):
+        self._queue.put(self._STOP)
+        self._thread.join()
+        try:
+            self.retry_failed()
+        except sqlite3.Error:
+            logger.exception("Lost queued messages that could not be stored")
+
+    def retry_failed(self):
+        """Store batches the background thread gave up on, raising the last error if any still fail"""
+        with self._pending_lock:
+            failed, self._failed = self._failed, []
+        for i, batch in enumerate(failed):
+            try:
+                self._store(batch)
+            except sqlite3.Error:
+                with self._pending_lock:
+                    self._failed.extend(failed[i:])
+                raise
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is self._STOP:
+                self._queue.task_done()
+                break
+
+            # Collect whatever else arrives within the flush window
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._commit(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _commit(self, batch):
+        try:
+            self._store(batch)
+        except sqlite3.Error:
+            # Nothing was stored: listeners aren't told, and the rows stay pending so
+            # this process still shows them until the next flush() retries them
+            logger.exception("Could not store %d queued messages after %d attempts", len(batch), self.MAX_ATTEMPTS)
+            with self._pending_lock:
+                self._failed.append(batch)
+
+    def _store(self, batch):
+        for attempt in range(1, self.MAX_ATTEMPTS + 1):
+            try:
+                with get_backend().connect(self.shard) as conn:
+                    _begin_write(conn)
+                    _insert_messages(conn.cursor(), batch)
+                break
+            except sqlite3.Error:
+                if attempt == self.MAX_ATTEMPTS:
+                    raise
+                time.sleep(0.1 * attempt)
+
+        # Committed rows now show up in session lists as well
+        _invalidate_rows(self.db_path, batch)
+        _notify_write_listeners(batch)
+
+        with self._pending_lock:
+            for row in batch:
+                rows = self._pending.get(row[0])
+                if rows:
+                    rows.remove(row)
+                    if not rows:
+                        del self._pending[row[0]]
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+_write_listeners = []
+_delete_listeners = []
+
+
+def add_write_listener(callback):
+    """
+    Call callback(rows) after messages are committed, on the committing thread
+    Args:
+        callback (callable): Receives (session_id, user_id, role, content, timestamp) rows; keep it cheap
+    """
+    if callback not in _write_listeners:
+        _write_listeners.append(callback)
+
+
+def _notify_write_listeners(rows):
+    for callback in list(_write_listeners):
+        try:
+            callback(rows)
+        except Exception:
+            logger.exception("Write listener %r failed", callback)
+
+
+def add_delete_listener(callback):
+    """
+    Call callback(user_id, chat_ids) after a user's messages are deleted or archived, on the deleting thread
+    Args:
+        callback (callable): Receives the owner and the ids of the removed chats rows; keep it cheap
+    """
+    if callback not in _delete_listeners:
+        _delete_listeners.append(callback)
+
+
+def _notify_delete_listeners(user_id, chat_ids):
+    for callback in list(_delete_listeners):
+        try:
+            callback(user_id, chat_ids)
+        except Exception:
+            logger.exception("Delete listener %r failed", callback)
+
+
+def get_message_writer(shard=None):
+    """Return the process-wide writer for a shard (the only one when None), or None when write-behind is off"""
+    if not WRITE_BEHIND:
+        return None
+    if shard is None:
+        shard = get_backend().shards()[0]
+    writer = _writers.get(shard)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(shard)
+            if writer is None:
+                writer = _writers[shard] = MessageWriter(shard)
+    return writer
+
+
+def flush_pending_writes(shard=None):
+    """
+    Wait for queued messages to commit, for one shard or all of them
+    Raises:
+        sqlite3.Error: Some queued messages could not be stored, after flushing every writer
+    """
+    writers = [_writers.get(shard)] if shard is not None else list(_writers.values())
+    error = None
+    for writer in writers:
+        if writer is not None:
+            try:
+                writer.flush()
+            except sqlite3.Error as e:
+                error = error or e
+    if error is not None:
+        raise error
+
+
+# Registered after close_all_pools so it runs first at exit
+@atexit.register
+def close_message_writers():
+    with _writers_lock:
+        for writer in _writers.values():
+            writer.close()
+        _writers.clear()
+
+
+class ReadCache:
+    """
+    Bounded LRU of query results, validated by per-user and per-session
+    version counters. Readers take the version before querying and writers
+    bump it after committing, so an entry is only served while nothing it
+    depends on has changed. Writes from other processes are not seen.
+    """
+
+    MISS = object()
+
+    def __init__(self, max_entries=READ_CACHE_ENTRIES, max_versions=READ_CACHE_MAX_VERSIONS):
+        self.max_entries = max_entries
+        self.max_versions = max_versions
+        self._entries = OrderedDict()  # key -> (version, value)
+        self._versions = {}  # scope -> version
+        self._lock = threading.Lock()
+
+    def version(self, scope):
+        with self._lock:
+            return self._versions.get(scope, 0)
+
+    def bump(self, *scopes):
+        with self._lock:
+            if len(self._versions) >= self.max_versions:
+                # Forgetting versions would let old entries match again, so drop both
+                self._versions.clear()
+                self._entries.clear()
+            for scope in scopes:
+                self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return self.MISS
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, value):
+        with self._lock:
+            # Never overwrite a newer entry with one read at an older version
+            if self._versions.get(key[1], 0) != version:
+                return
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+
+_read_cache = ReadCache()
+
+
+def _copy_result(value):
+    # Callers append to returned lists (st.session_state.messages), never to the cached one
+    if isinstance(value, list):
+        return list(value)
+    if isinstance(value, tuple) and value and isinstance(value[0], list):
+        return (list(value[0]),) + value[1:]
+    return value
+
+
+def cached_read(kind):
+    """Cache a reader whose first argument is a user_id or session_id, per kind ("user" or "session")"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(owner_id, *args, **kwargs):
+            scope = (os.path.abspath(DB_PATH), kind, owner_id)
+            key = (fn.__name__, scope, args, tuple(sorted(kwargs.items())))
+            version = _read_cache.version(scope)
+            value = _read_cache.get(key, version)
+            if value is not ReadCache.MISS:
+                incr("chat_db_cache_hits_total")
+                return _copy_result(value)
+            incr("chat_db_cache_misses_total")
+            value = fn(owner_id, *args, **kwargs)
+            _read_cache.put(key, version, value)
+            return _copy_result(value)
+        return wrapper
+    return decorator
+
+
+def _invalidate(db_path, user_ids=(), session_ids=()):
+    db_path = os.path.abspath(db_path)
+    _read_cache.bump(*[(db_path, "user", u) for u in set(user_ids)],
+                     *[(db_path, "session", s) for s in set(session_ids)])
+
+
+def _invalidate_rows(db_path, rows):
+    _invalidate(db_path, [row[1] for row in rows], [row[0] for row in rows])
+
+
+def _invalidate_session(session_id, shard=None):
+    """Invalidate a session and its owner's listings"""
+    shard = shard or _session_shard(session_id)
+    row = None
+    if shard is not None:
+        with get_backend().connect(shard) as conn:
+            row = conn.execute("SELECT user_id FROM sessions WHERE id = ?", (session_id,)).fetchone()
+    _invalidate(DB_PATH, [row[0]] if row else [], [session_id])
+
+
+def _id_ranges(c, table, chunk_size):
+    """(low, high] rowid ranges covering table, for chunked backfills"""
+    c.execute(f"SELECT COALESCE(MIN(rowid), 1) - 1, COALESCE(MAX(rowid), 0) FROM {table}")
+    low, high = c.fetchone()
+    while low < high:
+        yield low, min(low + chunk_size, high)
+        low += chunk_size
+
+
+def _migrate_create_chats(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS chats
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     session_id TEXT,
+                     user_id TEXT,
+                     role TEXT,
+                     content TEXT,
+                     timestamp DATETIME)''')
+
+
+def _migrate_legacy_session_columns(conn):
+    # Legacy per-row session columns, superseded by the sessions table but
+    # kept so older databases can still be backfilled from them
+    columns = [col[1] for col in conn.execute("PRAGMA table_info(chats)")]
+    if 'session_name' not in columns:
+        conn.execute("ALTER TABLE chats ADD COLUMN session_name TEXT")
+    if 'created_at' not in columns:
+        conn.execute("ALTER TABLE chats ADD COLUMN created_at DATETIME")
     conn.commit()
-    conn.close()
 
-def save_message(session_id, user_id, role, content):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # Check if this is the first message in the session
-    c.execute("SELECT COUNT(*) FROM chats WHERE session_id = ?", (session_id,))
-    is_first_message = c.fetchone()[0] == 0
-    
-    if is_first_message:
-        # For the first message, set created_at and default session name
-        c.execute("""INSERT INTO chats 
-                     (session_id, user_id, role, content, timestamp, session_name, created_at) 
-                     VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                  (session_id, user_id, role, content, datetime.now(), "New Chat", datetime.now()))
+    # Fill existing rows a chunk at a time so writers are never locked out for
+    # the whole table. Run even when the columns already exist: a backfill cut
+    # short last time left NULLs behind the committed ALTER TABLE
+    backfills = ["UPDATE chats SET session_name = 'New Chat' WHERE session_name IS NULL AND id > ? AND id <= ?",
+                 "UPDATE chats SET created_at = datetime('now') WHERE created_at IS NULL AND id > ? AND id <= ?"]
+    for sql in backfills:
+        for low, high in _id_ranges(conn.cursor(), "chats", MIGRATION_CHUNK_SIZE):
+            conn.execute(sql, (low, high))
+            conn.commit()
+
+
+def _migrate_chat_indexes(conn):
+    # (session_id, timestamp) serves both lookups and ordered/paged transcript reads
+    conn.execute("DROP INDEX IF EXISTS idx_session")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_session_timestamp ON chats (session_id, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user ON chats (user_id)")
+
+
+def _migrate_sessions_table(conn):
+    # One row per session, maintained incrementally by save_message
+    conn.execute('''CREATE TABLE IF NOT EXISTS sessions
+                    (id TEXT PRIMARY KEY,
+                     user_id TEXT,
+                     name TEXT DEFAULT 'New Chat',
+                     created_at DATETIME,
+                     last_used DATETIME,
+                     message_count INTEGER DEFAULT 0,
+                     preview TEXT)''')
+    conn.execute("DROP INDEX IF EXISTS idx_sessions_user")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_recent ON sessions (user_id, last_used, id)")
+    conn.commit()
+    _backfill_sessions(conn)
+
+
+def _migrate_search_index(conn):
+    # Full-text index over message content, kept in sync by triggers.
+    # user_id is indexed too so searches are restricted inside the index.
+    # Recreated from scratch so an interrupted earlier run can't leave duplicates
+    conn.execute("DROP TABLE IF EXISTS chats_fts")
+    conn.execute("""CREATE VIRTUAL TABLE chats_fts
+                    USING fts5(content, user_id, content='chats', content_rowid='id',
+                               tokenize='unicode61 remove_diacritics 2')""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS chats_fts_insert AFTER INSERT ON chats BEGIN
+                        INSERT INTO chats_fts (rowid, content, user_id)
+                        VALUES (new.id, new.content, new.user_id);
+                    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS chats_fts_delete AFTER DELETE ON chats BEGIN
+                        INSERT INTO chats_fts (chats_fts, rowid, content, user_id)
+                        VALUES ('delete', old.id, old.content, old.user_id);
+                    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS chats_fts_update AFTER UPDATE OF content, user_id ON chats BEGIN
+                        INSERT INTO chats_fts (chats_fts, rowid, content, user_id)
+                        VALUES ('delete', old.id, old.content, old.user_id);
+                        INSERT INTO chats_fts (rowid, content, user_id)
+                        VALUES (new.id, new.content, new.user_id);
+                    END""")
+    conn.commit()
+
+    # Rows inserted from here on are indexed by the trigger; index the rest in chunks
+    for low, high in _id_ranges(conn.cursor(), "chats", MIGRATION_CHUNK_SIZE):
+        conn.execute("""INSERT INTO chats_fts (rowid, content, user_id)
+                        SELECT id, content, user_id FROM chats WHERE id > ? AND id <= ?""", (low, high))
+        conn.commit()
+
+
+def _migrate_archive_table(conn):
+    # Compressed transcripts of idle sessions; their sessions row stays so they still list
+    conn.execute('''CREATE TABLE IF NOT EXISTS archived_sessions
+                    (session_id TEXT PRIMARY KEY,
+                     user_id TEXT,
+                     message_count INTEGER,
+                     archived_at DATETIME,
+                     raw_bytes INTEGER,
+                     payload BLOB)''')
+    columns = [col[1] for col in conn.execute("PRAGMA table_info(sessions)")]
+    if 'archived_at' not in columns:
+        conn.execute("ALTER TABLE sessions ADD COLUMN archived_at DATETIME")
+    if 'restored_at' not in columns:
+        conn.execute("ALTER TABLE sessions ADD COLUMN restored_at DATETIME")
+
+
+# Ordered schema migrations. Each runs once per database and records its
+# version in schema_version; never renumber or edit an applied step, add a new one
+MIGRATIONS = [
+    (1, "create chats table", _migrate_create_chats),
+    (2, "legacy session_name/created_at columns", _migrate_legacy_session_columns),
+    (3, "chat indexes", _migrate_chat_indexes),
+    (4, "sessions table", _migrate_sessions_table),
+    (5, "full-text search index", _migrate_search_index),
+    (6, "archived_sessions table", _migrate_archive_table),
+]
+
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+def migrate(db_path=None):
+    """
+    Apply pending migrations to db_path, or to every shard of the backend when None
+    Returns:
+        list of (version, name) applied by this call
+    """
+    if db_path is not None:
+        return _migrate_connection(get_connection(db_path))
+    applied = []
+    backend = get_backend()
+    for shard in backend.shards():
+        applied.extend(step for step in _migrate_connection(backend.connect(shard)) if step not in applied)
+    return applied
+
+
+def _migrate_connection(connection):
+    applied = []
+    with connection as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS schema_version
+                        (version INTEGER PRIMARY KEY,
+                         name TEXT,
+                         applied_at DATETIME)''')
+        conn.commit()
+        current = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+        for version, name, step in MIGRATIONS:
+            if version <= current:
+                continue
+            step(conn)
+            conn.execute("INSERT OR IGNORE INTO schema_version VALUES (?, ?, ?)",
+                         (version, name, datetime.now()))
+            conn.commit()
+            applied.append((version, name))
+    if applied:
+        _read_cache.clear()
+    return applied
+
+
+def schema_version(db_path=None):
+    """Schema version of db_path, or the lowest across the backend's shards when None"""
+    if db_path is not None:
+        connections = [get_connection(db_path)]
     else:
-        # For subsequent messages, just insert the basic info
-        c.execute("""INSERT INTO chats 
+        connections = [get_backend().connect(shard) for shard in get_backend().shards()]
+    versions = []
+    for connection in connections:
+        with connection as conn:
+            try:
+                versions.append(conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0])
+            except sqlite3.OperationalError:
+                versions.append(0)
+    return min(versions)
+
+
+@timed_function("db.init_db")
+def init_db():
+    """Bring the database schema up to date; only the first call per process does any work"""
+    key = tuple(get_backend().shards())
+    if key in _migrated:
+        return
+    with _migrate_lock:
+        if key not in _migrated:
+            migrate()
+            _migrated.add(key)
+
+
+def _backfill_sessions(conn, chunk_size=None):
+    """Recompute sessions rows from chats a chunk of sessions at a time, keeping names already set"""
+    chunk_size = chunk_size or MIGRATION_CHUNK_SIZE
+    last = ""
+    total = 0
+    while True:
+        # Distinct session ids come straight off idx_session_timestamp
+        ids = [row[0] for row in conn.execute(
+            "SELECT DISTINCT session_id FROM chats WHERE session_id > ? ORDER BY session_id LIMIT ?",
+            (last, chunk_size)
+        )]
+        if not ids:
+            break
+        placeholders = ",".join("?" * len(ids))
+        conn.execute(f"""
+            INSERT INTO sessions (id, user_id, name, created_at, last_used, message_count, preview)
+            SELECT 
+                session_id,
+                MIN(user_id),
+                COALESCE(MAX(session_name), 'New Chat'),
+                MIN(COALESCE(created_at, timestamp)),
+                MAX(timestamp),
+                COUNT(*),
+                (SELECT substr(p.content, 1, {PREVIEW_LENGTH}) FROM chats p
+                 WHERE p.session_id = chats.session_id AND p.role = 'user'
+                 ORDER BY p.timestamp ASC LIMIT 1)
+            FROM chats
+            WHERE session_id IN ({placeholders})
+            GROUP BY session_id
+            ON CONFLICT(id) DO UPDATE SET
+                created_at = excluded.created_at,
+                last_used = excluded.last_used,
+                message_count = excluded.message_count,
+                preview = excluded.preview
+        """, ids)
+        conn.commit()
+        total += len(ids)
+        last = ids[-1]
+    return total
+
+def rebuild_search_index():
+    """Re-index every message in chats_fts"""
+    backend = get_backend()
+    for shard in backend.shards():
+        with backend.connect(shard) as conn:
+            conn.execute("INSERT INTO chats_fts (chats_fts) VALUES ('rebuild')")
+
+def backfill_sessions():
+    """Rebuild sessions rows from chats, keeping any names already set"""
+    backend = get_backend()
+    count = 0
+    for shard in backend.shards():
+        with backend.connect(shard) as conn:
+            count += _backfill_sessions(conn)
+    _read_cache.clear()
+    return count
+
+def _begin_write(conn):
+    """
+    Take the write lock before inserting: the wait for it is measured on its
+    own, and a deferred transaction can't fail upgrading to a writer later
+    """
+    start = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    observe("db.write_lock_wait", time.perf_counter() - start)
+
+def _insert_messages(c, rows):
+    """Insert (session_id, user_id, role, content, timestamp) rows and update their sessions"""
+    c.executemany("""INSERT INTO chats 
                      (session_id, user_id, role, content, timestamp) 
-                     VALUES (?, ?, ?, ?, ?)""",
-                  (session_id, user_id, role, content, datetime.now()))
+                     VALUES (?, ?, ?, ?, ?)""", rows)
     
-    conn.commit()
-    conn.close()
+    # Create the session on its first message, otherwise bump its counters
+    c.executemany("""INSERT INTO sessions 
+                     (id, user_id, name, created_at, last_used, message_count, preview) 
+                     VALUES (?, ?, 'New Chat', ?, ?, 1, ?)
+                     ON CONFLICT(id) DO UPDATE SET
+                         last_used = excluded.last_used,
+                         message_count = message_count + 1,
+                         preview = COALESCE(preview, excluded.preview)""",
+                  [(session_id, user_id, ts, ts, content[:PREVIEW_LENGTH] if role == "user" else None)
+                   for session_id, user_id, role, content, ts in rows])
+
+@timed_function("db.save_message")
+def save_message(session_id, user_id, role, content):
+    row = (session_id, user_id, role, content, datetime.now())
+    shard = _user_shard(user_id)
+    _remember_session(session_id, shard)
+    writer = get_message_writer(shard)
+    if writer is not None:
+        writer.submit(row)
+        # Transcripts already include queued rows; listings are invalidated again on commit
+        _invalidate_rows(DB_PATH, [row])
+        return
+    with get_backend().connect(shard) as conn:
+        _begin_write(conn)
+        _insert_messages(conn.cursor(), [row])
+    _invalidate_rows(DB_PATH, [row])
+    _notify_write_listeners([row])
+
+@timed_function("db.save_messages")
+def save_messages(rows):
+    """
+    Bulk insert for imports and seeding, one transaction per shard
+    Args:
+        rows: (session_id, user_id, role, content, timestamp) tuples
+    Returns:
+        number of rows inserted
+    """
+    by_shard = {}
+    for row in rows:
+        by_shard.setdefault(_user_shard(row[1]), []).append(row)
+    for shard, shard_rows in by_shard.items():
+        with get_backend().connect(shard) as conn:
+            _begin_write(conn)
+            _insert_messages(conn.cursor(), shard_rows)
+        for session_id in {row[0] for row in shard_rows}:
+            _remember_session(session_id, shard)
+        _invalidate_rows(DB_PATH, shard_rows)
+        _notify_write_listeners(shard_rows)
+    return sum(len(shard_rows) for shard_rows in by_shard.values())
 
+@timed_function("db.get_all_sessions")
+@cached_read("user")
 def get_all_sessions(user_id):
     """Returns sessions with proper datetime objects"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row  # Enable column access by name
-    c = conn.cursor()
-    c.execute("""
-        SELECT 
-            session_id, 
-            datetime(MAX(timestamp), 'localtime') as last_used
-        FROM chats 
-        WHERE user_id = ? 
-        GROUP BY session_id 
-        ORDER BY last_used DESC
-    """, (user_id,))
-    sessions = [dict(row) for row in c.fetchall()]  # Convert to dictionaries
-    conn.close()
+    with get_backend().connect(_user_shard(user_id)) as conn:
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row  # Enable column access by name
+        c.execute("""
+            SELECT 
+                id as session_id, 
+                name as session_name,
+                datetime(last_used, 'localtime') as last_used
+            FROM sessions 
+            WHERE user_id = ? 
+            ORDER BY last_used DESC
+        """, (user_id,))
+        sessions = [dict(row) for row in c.fetchall()]  # Convert to dictionaries
+    incr("chat_db_rows_read_total", len(sessions))
     return sessions
+@timed_function("db.list_sessions")
+@cached_read("user")
+def list_sessions(user_id, limit=20, cursor=None):
+    """
+    One page of a user's sessions, most recently used first
+    Args:
+        user_id (str): Owner of the sessions
+        limit (int): Page size
+        cursor (tuple): next_cursor from the previous page, None for the first page
+    Returns:
+        (sessions, next_cursor) where next_cursor is None on the last page
+    """
+    shard = _user_shard(user_id)
+    with get_backend().connect(shard) as conn:
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row
+        if cursor is None:
+            c.execute("""
+                SELECT id, name, preview, last_used,
+                       datetime(last_used, 'localtime') as last_used_local
+                FROM sessions 
+                WHERE user_id = ? 
+                ORDER BY last_used DESC, id DESC
+                LIMIT ?
+            """, (user_id, limit + 1))
+        else:
+            c.execute("""
+                SELECT id, name, preview, last_used,
+                       datetime(last_used, 'localtime') as last_used_local
+                FROM sessions 
+                WHERE user_id = ? AND (last_used, id) < (?, ?)
+                ORDER BY last_used DESC, id DESC
+                LIMIT ?
+            """, (user_id, cursor[0], cursor[1], limit + 1))
+        rows = c.fetchall()
+    incr("chat_db_rows_read_total", len(rows))
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1]['last_used'], rows[-1]['id'])
+    # Opening any of these sessions later needs no shard lookup
+    for row in rows:
+        _remember_session(row['id'], shard)
+
+    sessions = [{
+        'session_id': row['id'],
+        'session_name': row['name'],
+        'preview': _format_preview(row['preview']),
+        'last_used': row['last_used_local']
+    } for row in rows]
+    return sessions, next_cursor
+
+def _format_preview(preview):
+    return preview[:30] + "..." if preview else "New Chat"
+
+@timed_function("db.get_session_messages")
+@cached_read("session")
 def get_session_messages(session_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""SELECT role, content, timestamp 
-                 FROM chats 
-                 WHERE session_id = ? 
-                 ORDER BY timestamp""", (session_id,))
-    messages = [{'role': row[0], 'content': row[1], 'timestamp': row[2]} 
-               for row in c.fetchall()]
-    conn.close()
+    shard = _session_shard(session_id)
+    if shard is None:
+        return []
+    # Read-your-writes: snapshot rows still queued in the write-behind writer
+    # before querying, then drop any that committed in the meantime
+    writer = get_message_writer(shard)
+    pending = writer.pending_rows(session_id) if writer is not None else []
+
+    with get_backend().connect(shard) as conn:
+        c = conn.cursor()
+        c.execute("""SELECT role, content, timestamp 
+                     FROM chats 
+                     WHERE session_id = ? 
+                     ORDER BY timestamp""", (session_id,))
+        messages = [{'role': row[0], 'content': row[1], 'timestamp': row[2]} 
+                   for row in c.fetchall()]
+    incr("chat_db_rows_read_total", len(messages))
+    
+    return _merge_pending(messages, pending)
+
+def _merge_pending(messages, pending):
+    """Append queued rows that had not committed when messages was read"""
+    if pending:
+        committed = {(m['role'], m['content'], m['timestamp']) for m in messages}
+        for _, _, role, content, ts in pending:
+            if (role, content, str(ts)) not in committed:
+                messages.append({'role': role, 'content': content, 'timestamp': str(ts)})
     return messages
 
+def _read_session_page(session_id, limit, before):
+    """
+    get_session_messages_page as (id, role, content, timestamp) rows; queued
+    rows not yet committed have id None
+    """
+    shard = _session_shard(session_id)
+    if shard is None:
+        return [], None
+    writer = get_message_writer(shard)
+    pending = writer.pending_rows(session_id) if writer is not None and before is None else []
+    if len(pending) >= limit:
+        # A page of queued rows only would have no committed row to continue
+        # from, so let them commit; whatever is left failed to commit
+        writer.flush()
+        pending = writer.pending_rows(session_id)[-(limit - 1):] if limit > 1 else []
+
+    with get_backend().connect(shard) as conn:
+        c = conn.cursor()
+        if before is None:
+            c.execute("""SELECT id, role, content, timestamp 
+                         FROM chats 
+                         WHERE session_id = ? 
+                         ORDER BY timestamp DESC, id DESC
+                         LIMIT ?""", (session_id, limit + 1))
+        else:
+            c.execute("""SELECT id, role, content, timestamp 
+                         FROM chats 
+                         WHERE session_id = ? AND (timestamp, id) < (?, ?)
+                         ORDER BY timestamp DESC, id DESC
+                         LIMIT ?""", (session_id, before[0], before[1], limit + 1))
+        rows = c.fetchall()
+    incr("chat_db_rows_read_total", len(rows))
+
+    rows.reverse()
+    if pending:
+        committed = {(row[1], row[2], row[3]) for row in rows}
+        rows += [(None, role, content, str(ts)) for _, _, role, content, ts in pending
+                 if (role, content, str(ts)) not in committed]
+
+    # Queued rows count towards the page too; the oldest row kept is always
+    # a committed one, so the cursor can continue from it
+    older_cursor = None
+    if len(rows) > limit:
+        rows = rows[-limit:]
+        older_cursor = (rows[0][3], rows[0][0])
+    return rows, older_cursor
+
+@timed_function("db.get_session_messages_page")
+@cached_read("session")
+def get_session_messages_page(session_id, limit=50, before=None):
+    """
+    One page of a session's messages, walking backwards from the newest
+    Args:
+        session_id (str): Session to read
+        limit (int): Page size
+        before (tuple): older_cursor from the previous page, None for the newest page
+    Returns:
+        (messages oldest first, older_cursor) where older_cursor is None on the first page of the session
+    """
+    rows, older_cursor = _read_session_page(session_id, limit, before)
+    messages = [{'role': row[1], 'content': row[2], 'timestamp': row[3]} for row in rows]
+    return messages, older_cursor
+
+@timed_function("db.read_session_page")
+def read_session_page(session_id, limit=50, before=None):
+    """
+    Uncached get_session_messages_page for callers that keep their own copy
+    of the messages, so the page isn't held twice
+    Returns:
+        ((id, role, content, timestamp) rows oldest first, older_cursor); id is None for rows still queued
+    """
+    return _read_session_page(session_id, limit, before)
+
+@timed_function("db.get_session_messages_after")
+def get_session_messages_after(session_id, after_id=None):
+    """
+    A session's messages stored after chat id after_id (all when None), in
+    insertion order, so a caller can learn the ids of messages it saved
+    Returns:
+        list of (id, role, content) tuples
+    """
+    shard = _session_shard(session_id)
+    if shard is None:
+        return []
+    # Queued messages get their ids when they commit
+    flush_pending_writes(shard)
+    with get_backend().connect(shard) as conn:
+        rows = conn.execute("""SELECT id, role, content FROM chats
+                               WHERE session_id = ? AND id > ? ORDER BY id""",
+                            (session_id, after_id or 0)).fetchall()
+    incr("chat_db_rows_read_total", len(rows))
+    return rows
+
+@timed_function("db.get_message_cursor")
+def get_message_cursor(session_id, chat_id):
+    """
+    older_cursor that pages back from just before message chat_id
+    Returns:
+        cursor for get_session_messages_page(before=...), None when the message is gone
+    """
+    shard = _session_shard(session_id)
+    if shard is None:
+        return None
+    with get_backend().connect(shard) as conn:
+        row = conn.execute("SELECT timestamp, id FROM chats WHERE id = ? AND session_id = ?",
+                           (chat_id, session_id)).fetchone()
+    return tuple(row) if row else None
+
+def _fts_query(user_id, query):
+    """
+    Quote each search term so user input can't inject FTS5 syntax; the last term matches as a prefix.
+    The user_id phrase only narrows the search inside the index: other ids
+    sharing its tokens match too, so callers must still filter on chats.user_id
+    """
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return None
+    phrases = ['"' + term + '"' for term in terms]
+    phrases[-1] += "*"
+    quoted_user = '"' + user_id.replace('"', '""') + '"'
+    return f"user_id : {quoted_user} AND content : ({' '.join(phrases)})"
+
+@timed_function("db.search_messages")
+def search_messages(user_id, query, limit=20):
+    """
+    Full-text search over a user's messages, best matches first
+    Returns:
+        list of dicts with session_id, role, snippet (matches wrapped in **) and timestamp
+    """
+    match = _fts_query(user_id, query)
+    if match is None:
+        return []
+    with get_backend().connect(_user_shard(user_id)) as conn:
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row
+        c.execute("""
+            SELECT 
+                chats.session_id,
+                chats.role,
+                snippet(chats_fts, 0, '**', '**', '…', 12) as snippet,
+                chats.timestamp
+            FROM chats_fts
+            JOIN chats ON chats.id = chats_fts.rowid AND chats.user_id = ?
+            WHERE chats_fts MATCH ?
+            ORDER BY bm25(chats_fts, 1.0, 0.0)
+            LIMIT ?
+        """, (user_id, match, limit))
+        results = [dict(row) for row in c.fetchall()]
+    incr("chat_db_rows_read_total", len(results))
+    return results
+
+@timed_function("db.get_messages_after")
+def get_messages_after(user_id, after_id, limit=1000):
+    """
+    A user's messages with id above after_id, in id order, for incremental indexing
+    Returns:
+        list of (id, role, content) tuples
+    """
+    with get_backend().connect(_user_shard(user_id)) as conn:
+        rows = conn.execute("""SELECT id, role, content FROM chats
+                               WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?""",
+                            (user_id, after_id, limit)).fetchall()
+    incr("chat_db_rows_read_total", len(rows))
+    return rows
+
+@timed_function("db.get_messages_by_id")
+def get_messages_by_id(user_id, ids):
+    """
+    Look up a user's messages by id; ids that no longer exist (deleted or archived) are left out
+    Returns:
+        {id: {"session_id", "role", "content", "timestamp"}}
+    """
+    if not ids:
+        return {}
+    placeholders = ",".join("?" * len(ids))
+    with get_backend().connect(_user_shard(user_id)) as conn:
+        rows = conn.execute(f"""SELECT id, session_id, role, content, timestamp FROM chats
+                                WHERE user_id = ? AND id IN ({placeholders})""",
+                            (user_id, *ids)).fetchall()
+    incr("chat_db_rows_read_total", len(rows))
+    return {row[0]: {"session_id": row[1], "role": row[2], "content": row[3], "timestamp": row[4]}
+            for row in rows}
+
+@timed_function("db.delete_session")
 def delete_session(session_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM chats WHERE session_id = ?", (session_id,))
-    conn.commit()
-    conn.close()
+    # Queued messages would otherwise recreate the session after the delete
+    flush_pending_writes()
+    shard = _session_shard(session_id)
+    if shard is None:
+        return
+    with get_backend().connect(shard) as conn:
+        row = conn.execute("SELECT user_id FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        chat_ids = [r[0] for r in conn.execute("SELECT id FROM chats WHERE session_id = ?", (session_id,))]
+        conn.execute("DELETE FROM chats WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM archived_sessions WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+    _invalidate(DB_PATH, [row[0]] if row else [], [session_id])
+    if row and chat_ids:
+        _notify_delete_listeners(row[0], chat_ids)
 
+@timed_function("db.update_session_name")
 def update_session_name(session_id, new_name):
-    """Update the session name for all records of this session"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # Update session_name for all messages in this session
-    c.execute("""UPDATE chats 
-                 SET session_name = ?
-                 WHERE session_id = ?""",
-              (new_name, session_id))
-    
-    conn.commit()
-    conn.close()
+    """Rename a session (single row update in sessions)"""
+    flush_pending_writes()
+    shard = _session_shard(session_id)
+    if shard is None:
+        return
+    with get_backend().connect(shard) as conn:
+        conn.execute("UPDATE sessions SET name = ? WHERE id = ?", (new_name, session_id))
+    _invalidate_session(session_id, shard)
 
+@timed_function("db.get_session_preview")
+@cached_read("session")
 def get_session_preview(session_id):
     """Get the first user message as preview"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        SELECT content FROM chats 
-        WHERE session_id = ? AND role = 'user' 
-        ORDER BY timestamp ASC 
-        LIMIT 1
-    """, (session_id,))
-    result = c.fetchone()
-    conn.close()
-    return result[0][:30] + "..." if result else "New Chat"
\ No newline at end of file
+    shard = _session_shard(session_id)
+    if shard is None:
+        return _format_preview(None)
+    with get_backend().connect(shard) as conn:
+        c = conn.cursor()
+        c.execute("SELECT preview FROM sessions WHERE id = ?", (session_id,))
+        result = c.fetchone()
+    return _format_preview(result[0] if result else None)
+def _incremental_vacuum(conn, pages=VACUUM_PAGES_PER_BATCH):
+    """Return up to pages free pages to the filesystem; a no-op unless auto_vacuum is INCREMENTAL"""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    return free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+@timed_function("db.archive_sessions")
+def archive_sessions(older_than_days=None, batch_size=ARCHIVE_BATCH_SIZE, limit=None):
+    """
+    Move the messages of sessions idle for older_than_days into archived_sessions,
+    one zstandard-compressed blob per session, and free the space with an
+    incremental vacuum. Archived sessions keep their sessions row so they still
+    list in the sidebar; restore_session() brings the messages back on open.
+    Until then they drop out of full-text search.
+    Args:
+        older_than_days (int): Idle age to archive at, defaults to ARCHIVE_AFTER_DAYS
+        batch_size (int): Sessions per transaction
+        limit (int): Stop after this many sessions, None for all eligible
+    Returns:
+        dict with sessions, messages, raw_bytes, compressed_bytes and pages_freed
+    """
+    import zstandard
+
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff = datetime.now() - timedelta(days=days)
+    compressor = zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL)
+    stats = {"sessions": 0, "messages": 0, "raw_bytes": 0, "compressed_bytes": 0, "pages_freed": 0}
+
+    # Queued messages may belong to sessions about to be archived
+    flush_pending_writes()
+    backend = get_backend()
+    for shard in backend.shards():
+        _archive_shard(backend, shard, cutoff, compressor, batch_size, limit, stats)
+    incr("chat_db_sessions_archived_total", stats["sessions"])
+    return stats
+
+def _archive_shard(backend, shard, cutoff, compressor, batch_size, limit, stats):
+    import json
+
+    while limit is None or stats["sessions"] < limit:
+        take = batch_size if limit is None else min(batch_size, limit - stats["sessions"])
+        with backend.connect(shard) as conn:
+            # A restored session is left alone until it has gone idle again
+            sessions = conn.execute("""SELECT id, user_id FROM sessions
+                                       WHERE last_used < ? AND archived_at IS NULL
+                                         AND (restored_at IS NULL OR restored_at < ?)
+                                       LIMIT ?""", (cutoff, cutoff, take)).fetchall()
+            if not sessions:
+                break
+            now = datetime.now()
+            removed = {}  # user_id -> chat ids moved out of chats
+            for session_id, user_id in sessions:
+                rows = conn.execute("""SELECT id, role, content, timestamp FROM chats
+                                       WHERE session_id = ? ORDER BY timestamp, id""", (session_id,)).fetchall()
+                removed.setdefault(user_id, []).extend(row[0] for row in rows)
+                rows = [row[1:] for row in rows]
+                raw = json.dumps(rows, default=str, separators=(",", ":")).encode("utf-8")
+                payload = compressor.compress(raw)
+                conn.execute("INSERT OR REPLACE INTO archived_sessions VALUES (?, ?, ?, ?, ?, ?)",
+                             (session_id, user_id, len(rows), now, len(raw), payload))
+                conn.execute("DELETE FROM chats WHERE session_id = ?", (session_id,))
+                conn.execute("UPDATE sessions SET archived_at = ? WHERE id = ?", (now, session_id))
+                stats["messages"] += len(rows)
+                stats["raw_bytes"] += len(raw)
+                stats["compressed_bytes"] += len(payload)
+            conn.commit()
+            stats["pages_freed"] += _incremental_vacuum(conn)
+        stats["sessions"] += len(sessions)
+        _invalidate(DB_PATH, {user_id for _, user_id in sessions}, [session_id for session_id, _ in sessions])
+        for user_id, chat_ids in removed.items():
+            if chat_ids:
+                _notify_delete_listeners(user_id, chat_ids)
+
+@timed_function("db.restore_session")
+def restore_session(session_id):
+    """
+    Bring an archived session's messages back into chats
+    Returns:
+        number of messages restored, 0 when the session wasn't archived
+    """
+    import json
+    import zstandard
+
+    shard = _session_shard(session_id)
+    if shard is None:
+        return 0
+    with get_backend().connect(shard) as conn:
+        row = conn.execute("SELECT user_id, payload FROM archived_sessions WHERE session_id = ?",
+                           (session_id,)).fetchone()
+        if row is None:
+            return 0
+        user_id, payload = row
+        messages = json.loads(zstandard.ZstdDecompressor().decompress(payload))
+        conn.executemany("""INSERT INTO chats (session_id, user_id, role, content, timestamp)
+                            VALUES (?, ?, ?, ?, ?)""",
+                         [(session_id, user_id, role, content, ts) for role, content, ts in messages])
+        conn.execute("DELETE FROM archived_sessions WHERE session_id = ?", (session_id,))
+        conn.execute("UPDATE sessions SET archived_at = NULL, restored_at = ? WHERE id = ?",
+                     (datetime.now(), session_id))
+    _invalidate(DB_PATH, [user_id], [session_id])
+    incr("chat_db_sessions_restored_total")
+    return len(messages)
+
+@timed_function("db.is_archived")
+def is_archived(session_id):
+    shard = _session_shard(session_id)
+    if shard is None:
+        return False
+    with get_backend().connect(shard) as conn:
+        row = conn.execute("SELECT archived_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+    return bool(row and row[0])
+
+def enable_incremental_vacuum():
+    """
+    Switch existing database files to auto_vacuum=INCREMENTAL. This takes one
+    full VACUUM per shard, which rewrites the file and blocks writers while it runs
+    Returns:
+        number of shards converted, 0 when all already were
+    """
+    flush_pending_writes()
+    backend = get_backend()
+    converted = 0
+    for shard in backend.shards():
+        with backend.connect(shard) as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                continue
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.commit()
+            conn.execute("VACUUM")
+        converted += 1
+    return converted
@@ -0,0 +1,77 @@
+import asyncio
+import re
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """
+    Offline stand-in for ChatGroq that streams its reply word by word
+    Args:
+        responses (list): Canned replies used in rotation; echoes the last message when empty
+        latency (float): Seconds before the first token
+        token_delay (float): Seconds between tokens
+        error (str): When set, calls raise RuntimeError(error) instead of replying
+    """
+    responses: List[str] = []
+    latency: float = 0.0
+    token_delay: float = 0.0
+    error: Optional[str] = None
+    temperature: float = 0.7
+    model_name: str = "fake-streaming"
+
+    _calls: int = PrivateAttr(default=0)
+
+    @property
+    def _llm_type(self):
+        return "fake-streaming"
+
+    def _reply(self, messages):
+        if self.responses:
+            reply = self.responses[self._calls % len(self.responses)]
+        else:
+            reply = f"You said: {messages[-1].content}" if messages else "Hello!"
+        self._calls += 1
+        return reply
+
+    def _tokens(self, messages):
+        if self.error:
+            raise RuntimeError(self.error)
+        return re.findall(r"\S+\s*", self._reply(messages))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        tokens = self._tokens(messages)
+        time.sleep(self.latency + self.token_delay * len(tokens))
+        message = AIMessage(content="".join(tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        time.sleep(self.latency)
+        for i, token in enumerate(self._tokens(messages)):
+            if i and self.token_delay:
+                time.sleep(self.token_delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        tokens = self._tokens(messages)
+        await asyncio.sleep(self.latency + self.token_delay * len(tokens))
+        message = AIMessage(content="".join(tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        await asyncio.sleep(self.latency)
+        for i, token in enumerate(self._tokens(messages)):
+            if i and self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
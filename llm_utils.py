@@ -1,15 +1,66 @@
-from langchain_groq import ChatGroq
+import importlib
+import threading
 from config import Config
+from router import ModelRouter
 import streamlit as st
 
-@st.cache_resource
-def load_llm():
+# Client modules for each provider; heavy, so imported on first use or by warm_llm()
+PROVIDER_MODULES = {
+    "groq": "langchain_groq",
+    "fake": "fake_llm"
+}
+
+_warm_thread = None
+_warm_lock = threading.Lock()
+
+def create_llm(model_name):
+    """Chat model client for one model name of the configured provider"""
+    if Config.LLM_PROVIDER == "fake":
+        from fake_llm import FakeStreamingChatModel
+        return FakeStreamingChatModel(
+            model_name=model_name,
+            latency=Config.FAKE_LLM_LATENCY,
+            token_delay=Config.FAKE_LLM_TOKEN_DELAY
+        )
+    from langchain_groq import ChatGroq
     return ChatGroq(
         temperature=0.7,
-        model_name=Config.ACTIVE_MODEL,  # Use the new model
+        model_name=model_name,
         api_key=Config.GROQ_API_KEY
     )
 
+@st.cache_resource
+def load_llm():
+    """Router over Config.LLM_MODELS with failover and optional hedging"""
+    return ModelRouter(
+        [(name, create_llm(name)) for name in Config.LLM_MODELS or [Config.ACTIVE_MODEL]],
+        hedge_after=Config.LLM_HEDGE_AFTER,
+        window=Config.ROUTER_WINDOW,
+        max_error_rate=Config.ROUTER_MAX_ERROR_RATE,
+        slow_after=Config.LLM_SLOW_AFTER,
+        failure_threshold=Config.ROUTER_FAILURE_THRESHOLD,
+        cooldown=Config.ROUTER_COOLDOWN
+    )
+
+def _import_provider():
+    try:
+        importlib.import_module(PROVIDER_MODULES.get(Config.LLM_PROVIDER, "langchain_groq"))
+    except Exception:
+        # load_llm() raises the real error on the first prompt
+        pass
+
+def warm_llm():
+    """
+    Import the LLM client modules on a background thread so the first prompt
+    doesn't pay for them; called once the page has rendered
+    """
+    global _warm_thread
+    with _warm_lock:
+        if _warm_thread is None:
+            _warm_thread = threading.Thread(target=_import_provider, name="llm-warmup", daemon=True)
+            _warm_thread.start()
+    return _warm_thread
+
 def initialize_chat_session():
     if "messages" not in st.session_state:
         st.session_state.messages = [{
@@ -0,0 +1,402 @@
+import json
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from hashlib import blake2b
+
+import numpy as np
+
+import db_utils
+from config import Config
+from context_utils import count_tokens
+from metrics import timed, incr
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock guards an index
+    fcntl = None
+
+# Embedding: hashed character 3- and 4-grams plus whole words, in DIM signed buckets
+DIM = 512
+NGRAM_SIZES = (3, 4)
+# Weight of the word features relative to the n-grams
+WORD_WEIGHT = 1.0
+INDEXED_ROLES = ("user", "assistant")
+# Too common to say anything about what a message is about
+STOP_WORDS = frozenset("""
+    a about again all am an and any are as at be been but by can could did do does for from had has have he her
+    him his how i if in is it its just me my no not of on or our she so than that the their them then there
+    they this to too us was we were what when where which who why will with would you your
+""".split())
+
+# Rows preallocated for a new index; files double when full
+INITIAL_CAPACITY = 1024
+# Messages embedded per database read while catching up
+SYNC_BATCH_SIZE = 2000
+# Unindexed messages a recall embeds itself; a longer backlog is left to the
+# background thread, and recall returns nothing until it has caught up
+INLINE_SYNC_LIMIT = 50
+# Users whose index files stay mapped, least recently used closed first
+MAX_OPEN_INDEXES = 256
+# Candidates scored per wanted snippet, so excluded or deleted messages don't leave gaps
+OVERFETCH = 4
+
+_HASH_MULTIPLIER = np.uint32(0x9E3779B1)
+_WORD = re.compile(r"\w+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _unit(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def embed(text):
+    """Unit-length float32 vector of text's hashed n-grams and words; offline and deterministic"""
+    words = [word for word in _WORD.findall(text.lower()) if word not in STOP_WORDS]
+    data = np.frombuffer(f" {' '.join(words)} ".encode("utf-8"), dtype=np.uint8).astype(np.uint32)
+    grams = np.zeros(DIM, dtype=np.float32)
+    for n in NGRAM_SIZES:
+        count = len(data) - n + 1
+        if count <= 0:
+            continue
+        # Multiplicative hash of each n-gram, computed for all positions at once
+        hashes = np.full(count, n, dtype=np.uint32)
+        for i in range(n):
+            hashes = (hashes ^ data[i:i + count]) * _HASH_MULTIPLIER
+        hashes ^= hashes >> np.uint32(16)
+        signs = np.where(hashes & np.uint32(0x80000000), -1.0, 1.0)
+        grams += np.bincount(hashes % DIM, weights=signs, minlength=DIM)
+    # Damp repeated n-grams so long messages aren't dominated by their most common ones
+    grams = np.sign(grams) * np.log1p(np.abs(grams))
+
+    word_vector = np.zeros(DIM, dtype=np.float32)
+    for word in set(words):
+        h = zlib.crc32(word.encode("utf-8"))
+        word_vector[h % DIM] += -1.0 if h & 0x80000000 else 1.0
+    return _unit(_unit(grams) + WORD_WEIGHT * _unit(word_vector)).astype(np.float32)
+
+
+class UserIndex:
+    """
+    One user's message vectors: vectors.npy (capacity x DIM float32) and
+    ids.npy (chat ids), memory-mapped and grown by doubling, plus meta.json
+    with the filled row count and the last chat id indexed. The index is
+    derived data; it is rebuilt when missing or built from another shard.
+    """
+
+    def __init__(self, directory, source):
+        self.directory = directory
+        self.source = source
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        try:
+            with open(self._path("meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        if (hasattr(self, "_view") and meta.get("count") == self.count
+                and meta.get("last_id") == self.last_id and meta.get("source") == self.source):
+            return
+        if meta.get("source") != self.source or meta.get("dim") != DIM:
+            self._create(INITIAL_CAPACITY)
+            self.count, self.last_id = 0, 0
+            self._write_meta()
+        else:
+            self.count, self.last_id = meta["count"], meta["last_id"]
+            self._vectors = np.load(self._path("vectors.npy"), mmap_mode="r+")
+            self._ids = np.load(self._path("ids.npy"), mmap_mode="r+")
+        # Searches read this one tuple, so they never see arrays and count out of step
+        self._view = (self._vectors, self._ids, self.count)
+
+    def _create(self, capacity, keep=0):
+        vectors = np.lib.format.open_memmap(self._path("vectors.npy.tmp"), mode="w+",
+                                            dtype=np.float32, shape=(capacity, DIM))
+        ids = np.lib.format.open_memmap(self._path("ids.npy.tmp"), mode="w+", dtype=np.int64, shape=(capacity,))
+        if keep:
+            vectors[:keep] = self._vectors[:keep]
+            ids[:keep] = self._ids[:keep]
+        vectors.flush()
+        ids.flush()
+        os.replace(self._path("vectors.npy.tmp"), self._path("vectors.npy"))
+        os.replace(self._path("ids.npy.tmp"), self._path("ids.npy"))
+        self._vectors, self._ids = vectors, ids
+
+    def _write_meta(self):
+        with open(self._path("meta.json.tmp"), "w") as f:
+            json.dump({"count": self.count, "last_id": self.last_id, "source": self.source, "dim": DIM}, f)
+        os.replace(self._path("meta.json.tmp"), self._path("meta.json"))
+
+    @contextmanager
+    def locked(self):
+        """Exclusive access for writing, across threads and processes"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._path("lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    # Another process may have appended since we last looked
+                    self._load()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def append(self, ids, vectors, last_id):
+        """Add rows and record last_id as indexed; call while locked()"""
+        needed = self.count + len(ids)
+        if needed > len(self._ids):
+            self._create(max(needed, 2 * len(self._ids)), keep=self.count)
+        if ids:
+            self._vectors[self.count:needed] = vectors
+            self._ids[self.count:needed] = ids
+        self.count, self.last_id = needed, last_id
+        self._write_meta()
+        self._view = (self._vectors, self._ids, self.count)
+
+    def remove(self, chat_ids):
+        """Drop the rows of chat_ids, e.g. of a deleted session; call while locked(). Returns rows removed"""
+        keep = ~np.isin(self._ids[:self.count], np.fromiter(chat_ids, dtype=np.int64))
+        kept = int(keep.sum())
+        removed = self.count - kept
+        if not removed:
+            return 0
+        vectors, ids = self._vectors[:self.count][keep], self._ids[:self.count][keep]
+        # Compacted into new files like a resize, so searches still holding the old view are unaffected
+        self._create(len(self._ids))
+        self._vectors[:kept] = vectors
+        self._ids[:kept] = ids
+        self.count = kept
+        self._write_meta()
+        self._view = (self._vectors, self._ids, self.count)
+        return removed
+
+    def search(self, query, k):
+        """
+        Nearest rows to a unit query vector by cosine similarity
+        Returns:
+            (chat ids, scores), best first
+        """
+        vectors, ids, count = self._view
+        if not count or k <= 0:
+            return [], []
+        scores = vectors[:count] @ query
+        k = min(k, count)
+        top = np.argpartition(scores, count - k)[count - k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return ids[top].tolist(), scores[top].tolist()
+
+
+_indexes = OrderedDict()   # user_id -> UserIndex
+_indexes_lock = threading.Lock()
+_executor = None
+_scheduled = set()         # user ids with a background sync queued
+
+
+def index_dir(user_id):
+    digest = blake2b(user_id.encode("utf-8"), digest_size=16).hexdigest()
+    return os.path.join(Config.MEMORY_INDEX_DIR, digest[:2], digest)
+
+
+def get_index(user_id):
+    """The open index for user_id, created empty for a new user"""
+    source = db_utils.get_backend().shard_for_user(user_id)
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is None or index.source != source:
+            index = _indexes[user_id] = UserIndex(index_dir(user_id), source)
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > MAX_OPEN_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def sync(user_id):
+    """
+    Embed user_id's messages stored since the last sync
+    Returns:
+        number of messages added to the index
+    """
+    index = get_index(user_id)
+    added = 0
+    with index.locked():
+        while True:
+            rows = db_utils.get_messages_after(user_id, index.last_id, SYNC_BATCH_SIZE)
+            if not rows:
+                break
+            kept = [(chat_id, content) for chat_id, role, content in rows
+                    if role in INDEXED_ROLES and content and content.strip()]
+            vectors = np.stack([embed(content) for _, content in kept]) if kept else None
+            index.append([chat_id for chat_id, _ in kept], vectors, rows[-1][0])
+            added += len(kept)
+            if len(rows) < SYNC_BATCH_SIZE:
+                break
+    if added:
+        incr("chat_memory_indexed_total", added)
+    return added
+
+
+def _sync_scheduled(user_id):
+    with _indexes_lock:
+        _scheduled.discard(user_id)
+    try:
+        sync(user_id)
+    except Exception:
+        incr("chat_memory_errors_total")
+
+
+def _get_executor():
+    # Caller holds _indexes_lock
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-index")
+    return _executor
+
+
+def schedule_sync(user_ids):
+    """Queue a background sync for each user that doesn't have one queued already"""
+    with _indexes_lock:
+        executor = _get_executor()
+        users = set(user_ids) - _scheduled
+        _scheduled.update(users)
+    for user_id in users:
+        executor.submit(_sync_scheduled, user_id)
+
+
+def _on_write(rows):
+    # Runs on the committing thread, so only queue the work
+    schedule_sync(row[1] for row in rows if row[1])
+
+
+def prune(user_id, chat_ids):
+    """
+    Remove the vectors of deleted or archived messages from user_id's index
+    Returns:
+        number of rows removed
+    """
+    if not os.path.exists(os.path.join(index_dir(user_id), "meta.json")):
+        # Never indexed, nothing to remove and no reason to create files
+        return 0
+    index = get_index(user_id)
+    with index.locked():
+        removed = index.remove(chat_ids)
+    if removed:
+        incr("chat_memory_pruned_total", removed)
+    return removed
+
+
+def _prune_scheduled(user_id, chat_ids):
+    try:
+        prune(user_id, chat_ids)
+    except Exception:
+        incr("chat_memory_errors_total")
+
+
+def schedule_prune(user_id, chat_ids):
+    """Queue prune() on the background thread, after any sync already queued"""
+    with _indexes_lock:
+        executor = _get_executor()
+    executor.submit(_prune_scheduled, user_id, list(chat_ids))
+
+
+def _on_delete(user_id, chat_ids):
+    # Runs on the deleting thread; pruning rewrites the index files
+    schedule_prune(user_id, chat_ids)
+
+
+def _catch_up(user_id):
+    """
+    Index the few messages saved since the last sync, typically the prompt
+    being answered. Returns False, after queueing a background sync, when the
+    backlog is too long to embed on a chat turn, e.g. a user's whole history
+    the first time memory is used
+    """
+    backlog = db_utils.get_messages_after(user_id, get_index(user_id).last_id, INLINE_SYNC_LIMIT + 1)
+    if len(backlog) > INLINE_SYNC_LIMIT:
+        schedule_sync([user_id])
+        return False
+    if backlog:
+        sync(user_id)
+    return True
+
+
+def recall(user_id, query, exclude=(), k=None):
+    """
+    A user's past messages most similar to query
+    Args:
+        user_id (str): Whose history to search
+        query (str): Text to match, usually the new prompt
+        exclude (iterable): Message contents to leave out, e.g. those already in the prompt
+        k (int): Snippets wanted, defaults to Config.MEMORY_TOP_K
+    Returns:
+        list of {"session_id", "role", "content", "timestamp", "score"}, best first
+    """
+    k = Config.MEMORY_TOP_K if k is None else k
+    # Normally little or nothing to do: writes are indexed in the background as they commit
+    with timed("memory.sync"):
+        ready = _catch_up(user_id)
+    if not ready:
+        incr("chat_memory_not_ready_total")
+        return []
+    with timed("memory.search"):
+        ids, scores = get_index(user_id).search(embed(query), k * OVERFETCH + len(exclude))
+    candidates = [(chat_id, score) for chat_id, score in zip(ids, scores) if score >= Config.MEMORY_MIN_SCORE]
+    if not candidates:
+        return []
+    messages = db_utils.get_messages_by_id(user_id, [chat_id for chat_id, _ in candidates])
+    # Deleted in another process, or before this one registered its delete listener
+    gone = [chat_id for chat_id, _ in candidates if chat_id not in messages]
+    if gone:
+        schedule_prune(user_id, gone)
+    exclude = set(exclude)
+    results = []
+    for chat_id, score in candidates:
+        message = messages.get(chat_id)
+        if message is None or message["content"] in exclude:
+            continue
+        results.append({**message, "score": round(score, 4)})
+        if len(results) == k:
+            break
+    incr("chat_memory_recalled_total", len(results))
+    return results
+
+
+def memory_message(user_id, prompt, history):
+    """
+    System message quoting relevant snippets from the user's earlier sessions,
+    within Config.MEMORY_TOKEN_BUDGET, or None when nothing relevant is found
+    """
+    snippets = recall(user_id, prompt, exclude=[msg["content"] for msg in history] + [prompt])
+    lines = []
+    used = 0
+    for snippet in snippets:
+        content = _WHITESPACE.sub(" ", snippet["content"]).strip()
+        if len(content) > Config.MEMORY_SNIPPET_CHARS:
+            content = content[:Config.MEMORY_SNIPPET_CHARS].rsplit(" ", 1)[0] + "…"
+        line = f"- [{str(snippet['timestamp'])[:10]}] {snippet['role']}: {content}"
+        cost = count_tokens(line)
+        if used + cost > Config.MEMORY_TOKEN_BUDGET:
+            break
+        lines.append(line)
+        used += cost
+    if not lines:
+        return None
+    return {
+        "role": "system",
+        "content": "Possibly relevant excerpts from the user's earlier conversations:\n" + "\n".join(lines)
+    }
+
+
+db_utils.add_write_listener(_on_write)
+db_utils.add_delete_listener(_on_delete)
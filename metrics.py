@@ -0,0 +1,261 @@
+import atexit
+import json
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Rolling per-turn metrics table, kept in its own file next to chat_history.db
+METRICS_DB_PATH = 'metrics.db'
+ROLLING_ROWS = 10000
+# Finished turns are written there by a background thread, up to this many per
+# transaction; past TURN_QUEUE_SIZE waiting turns new ones are dropped
+TURN_BATCH_SIZE = 200
+TURN_QUEUE_SIZE = 10000
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_histograms = {}  # stage -> [bucket counts..., sum, count]
+_counters = {}    # name -> value
+_local = threading.local()
+
+
+def observe(stage, seconds):
+    """Record one duration for stage, and add it to the current turn if one is open"""
+    with _lock:
+        hist = _histograms.get(stage)
+        if hist is None:
+            hist = _histograms[stage] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist[i] += 1
+        hist[-2] += seconds
+        hist[-1] += 1
+
+    turn = getattr(_local, "turn", None)
+    if turn is not None:
+        turn["spans"].append((stage, round(seconds * 1000, 3)))
+
+
+def incr(name, value=1):
+    """Increase a counter, and the matching per-turn counter if a turn is open"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+    turn = getattr(_local, "turn", None)
+    if turn is not None:
+        turn["counters"][name] = turn["counters"].get(name, 0) + value
+
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def timed_function(stage):
+    """Decorator form of timed()"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def turn(kind="chat"):
+    """
+    Collect every span and counter recorded on this thread into one turn.
+    Yields the turn dict, whose "kind" may be changed before it closes. The
+    finished turn is observed as stage "turn.<kind>" and queued for the
+    rolling metrics table.
+    """
+    outer = getattr(_local, "turn", None)
+    if outer is not None:
+        # Already inside a turn, spans flow into the outer one
+        yield outer
+        return
+
+    _local.turn = data = {"kind": kind, "spans": [], "counters": {}}
+    start = time.perf_counter()
+    try:
+        yield data
+    finally:
+        _local.turn = None
+        total = time.perf_counter() - start
+        observe(f"turn.{data['kind']}", total)
+        _record_turn(data["kind"], total, data)
+
+
+_turn_queue = queue.Queue(maxsize=TURN_QUEUE_SIZE)
+_turn_writer = None
+_turn_writer_lock = threading.Lock()
+
+
+def _record_turn(kind, total, data):
+    # Written off the script thread, so a rerun never waits on metrics.db
+    _start_turn_writer()
+    try:
+        _turn_queue.put_nowait((time.time(), kind, round(total * 1000, 3),
+                                json.dumps(data["spans"]), json.dumps(data["counters"])))
+    except queue.Full:
+        incr("chat_metrics_dropped_turns_total")
+
+
+def _start_turn_writer():
+    global _turn_writer
+    if _turn_writer is not None:
+        return
+    with _turn_writer_lock:
+        if _turn_writer is None:
+            _turn_writer = threading.Thread(target=_write_turns, name="turn-metrics-writer", daemon=True)
+            _turn_writer.start()
+            # Write out whatever is still queued when the process exits
+            atexit.register(flush_turn_metrics)
+
+
+def _write_turns():
+    while True:
+        rows = [_turn_queue.get()]
+        while len(rows) < TURN_BATCH_SIZE:
+            try:
+                rows.append(_turn_queue.get_nowait())
+            except queue.Empty:
+                break
+        _store_turns(rows)
+        for _ in rows:
+            _turn_queue.task_done()
+
+
+def _store_turns(rows):
+    # Imported here because db_utils itself is instrumented with this module
+    import db_utils
+    try:
+        with db_utils.get_connection(METRICS_DB_PATH) as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS turn_metrics
+                            (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                             recorded_at REAL,
+                             kind TEXT,
+                             total_ms REAL,
+                             spans TEXT,
+                             counters TEXT)''')
+            conn.executemany(
+                "INSERT INTO turn_metrics (recorded_at, kind, total_ms, spans, counters) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            # Keep the table rolling instead of growing forever
+            last = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            conn.execute("DELETE FROM turn_metrics WHERE id <= ?", (last - ROLLING_ROWS,))
+    except Exception:
+        # Metrics must never break a chat turn
+        incr("chat_metrics_write_errors_total", len(rows))
+
+
+def flush_turn_metrics():
+    """Block until every finished turn is in the metrics table"""
+    if _turn_writer is not None:
+        _turn_queue.join()
+
+
+def turn_latency_percentiles(window_seconds=3600, kind="chat"):
+    """p50/p95/p99 turn latency in ms over the rolling table's recent window"""
+    import db_utils
+    flush_turn_metrics()
+    try:
+        with db_utils.get_connection(METRICS_DB_PATH) as conn:
+            rows = conn.execute(
+                "SELECT total_ms FROM turn_metrics WHERE kind = ? AND recorded_at >= ? ORDER BY total_ms",
+                (kind, time.time() - window_seconds)
+            ).fetchall()
+    except Exception:
+        rows = []
+    if not rows:
+        return {"count": 0}
+    values = [r[0] for r in rows]
+
+    def pct(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+    return {"count": len(values), "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99)}
+
+
+def render_prometheus():
+    """All histograms and counters in Prometheus text exposition format"""
+    with _lock:
+        histograms = {k: list(v) for k, v in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = [
+        "# HELP chat_stage_seconds Latency of instrumented chat stages",
+        "# TYPE chat_stage_seconds histogram"
+    ]
+    for stage, hist in sorted(histograms.items()):
+        for bound, count in zip(BUCKETS, hist):
+            lines.append(f'chat_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+        lines.append(f'chat_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist[-1]}')
+        lines.append(f'chat_stage_seconds_sum{{stage="{stage}"}} {hist[-2]:.6f}')
+        lines.append(f'chat_stage_seconds_count{{stage="{stage}"}} {hist[-1]}')
+
+    for name, value in sorted(counters.items()):
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    """
+    Copies of every histogram and counter, for harnesses and reports
+    Returns:
+        ({stage: {"buckets": [(upper bound, cumulative count)...], "sum": seconds, "count": n}}, {name: value})
+    """
+    with _lock:
+        histograms = {
+            stage: {"buckets": list(zip(BUCKETS, hist[:len(BUCKETS)])), "sum": hist[-2], "count": hist[-1]}
+            for stage, hist in _histograms.items()
+        }
+        return histograms, dict(_counters)
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Serve /metrics on a daemon thread; safe to call on every rerun"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    return _server
@@ -1,3 +1,13 @@
-from db_utils import init_db
-init_db()
+import sys
+from db_utils import migrate, schema_version, backfill_sessions, rebuild_search_index
+
+for version, name in migrate():
+    print(f"Applied migration {version}: {name}")
+print(f"Schema version {schema_version()}")
+
+# Derived tables are built by the migrations; --rebuild recomputes them from chats
+if "--rebuild" in sys.argv:
+    print(f"Backfilled {backfill_sessions()} sessions")
+    rebuild_search_index()
+    print("Rebuilt full-text search index")
 print("Database migration complete!")
\ No newline at end of file
@@ -0,0 +1,253 @@
+"""Bulk export/import of chat messages as Parquet.
+
+Usage:
+    python parquet_db.py export exports/chats --partition date
+    python parquet_db.py export exports/chats --partition user --low-priority
+    python parquet_db.py import exports/chats
+
+Export reads chats by id a chunk at a time, one short read transaction per
+chunk, and streams each chunk to Parquet as an Arrow record batch, so memory
+stays flat however large the database is. Partitioning is hive-style:
+date=YYYY-MM-DD/ or user_bucket=N/. --include-archived also writes the
+messages of archived sessions (with a null id).
+
+Import loads a Parquet file or directory back through batched inserts,
+creating sessions as it goes and restoring their names. Message ids are
+reassigned by the target database.
+
+--low-priority lowers the process's CPU priority, uses smaller chunks and
+sleeps between them so the app's writers keep getting the database.
+"""
+import argparse
+import os
+import sys
+import time
+
+import db_utils
+
+# Rows per read chunk / record batch
+CHUNK_SIZE = 5000
+LOW_PRIORITY_CHUNK_SIZE = 500
+# In low-priority mode, sleep this many times as long as each chunk took
+LOW_PRIORITY_IDLE_RATIO = 4
+LOW_PRIORITY_NICE = 10
+# Rows buffered per partition before a row group is written, and partitions
+# open at once; together they bound export memory
+MIN_ROWS_PER_GROUP = 4096
+MAX_OPEN_FILES = 32
+USER_BUCKETS = 64
+
+PARTITIONS = ("none", "date", "user")
+
+
+def chat_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("id", pa.int64()),
+        ("session_id", pa.string()),
+        ("user_id", pa.string()),
+        ("role", pa.string()),
+        ("content", pa.string()),
+        ("timestamp", pa.timestamp("us")),
+        ("session_name", pa.string()),
+    ])
+
+
+class Throttle:
+    """Paces chunked work; a no-op unless low_priority is set"""
+
+    def __init__(self, low_priority):
+        self.low_priority = low_priority
+        self.chunk_size = LOW_PRIORITY_CHUNK_SIZE if low_priority else CHUNK_SIZE
+        self.started = time.perf_counter()
+        if low_priority and hasattr(os, "nice"):
+            os.nice(LOW_PRIORITY_NICE)
+
+    def pause(self):
+        if self.low_priority:
+            time.sleep((time.perf_counter() - self.started) * LOW_PRIORITY_IDLE_RATIO)
+        self.started = time.perf_counter()
+
+
+def _to_batch(rows, schema, partition):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    ids, session_ids, user_ids, roles, contents, timestamps, names = zip(*rows)
+    timestamps = pa.array([str(ts) if ts is not None else None for ts in timestamps], pa.string())
+    columns = [
+        pa.array(ids, pa.int64()),
+        pa.array(session_ids, pa.string()),
+        pa.array(user_ids, pa.string()),
+        pa.array(roles, pa.string()),
+        pa.array(contents, pa.string()),
+        pc.cast(timestamps, pa.timestamp("us")),
+        pa.array(names, pa.string()),
+    ]
+    if partition == "date":
+        columns.append(pc.utf8_slice_codeunits(timestamps, 0, 10))
+    elif partition == "user":
+        columns.append(pa.array([db_utils.shard_index(u or "", USER_BUCKETS) for u in user_ids], pa.int32()))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def _live_rows(backend, shard, throttle):
+    last = 0
+    while True:
+        with backend.connect(shard) as conn:
+            rows = conn.execute("""SELECT c.id, c.session_id, c.user_id, c.role, c.content, c.timestamp, s.name
+                                   FROM chats c LEFT JOIN sessions s ON s.id = c.session_id
+                                   WHERE c.id > ? ORDER BY c.id LIMIT ?""", (last, throttle.chunk_size)).fetchall()
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield rows
+        throttle.pause()
+
+
+def _archived_rows(backend, shard, throttle):
+    import json
+    import zstandard
+
+    decompressor = zstandard.ZstdDecompressor()
+    last = ""
+    while True:
+        # Archived sessions are decompressed one at a time, so a page is a few sessions, not chunk_size
+        with backend.connect(shard) as conn:
+            sessions = conn.execute("""SELECT a.session_id, a.user_id, a.payload, s.name
+                                       FROM archived_sessions a LEFT JOIN sessions s ON s.id = a.session_id
+                                       WHERE a.session_id > ? ORDER BY a.session_id LIMIT 16""", (last,)).fetchall()
+        if not sessions:
+            return
+        last = sessions[-1][0]
+        rows = []
+        for session_id, user_id, payload, name in sessions:
+            for role, content, ts in json.loads(decompressor.decompress(payload)):
+                rows.append((None, session_id, user_id, role, content, ts, name))
+            if len(rows) >= throttle.chunk_size:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+        throttle.pause()
+
+
+def export_chats(path, partition="none", include_archived=False, low_priority=False,
+                 compression="zstd", overwrite=False):
+    """
+    Stream every message in every shard into a Parquet dataset at path
+    Returns:
+        number of rows written
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    db_utils.init_db()
+    db_utils.flush_pending_writes()
+    backend = db_utils.get_backend()
+    throttle = Throttle(low_priority)
+
+    schema = chat_schema()
+    partitioning = None
+    if partition == "date":
+        schema = schema.append(pa.field("date", pa.string()))
+        partitioning = ds.partitioning(pa.schema([schema.field("date")]), flavor="hive")
+    elif partition == "user":
+        schema = schema.append(pa.field("user_bucket", pa.int32()))
+        partitioning = ds.partitioning(pa.schema([schema.field("user_bucket")]), flavor="hive")
+
+    written = 0
+
+    def batches():
+        nonlocal written
+        for shard in backend.shards():
+            chunks = [_live_rows(backend, shard, throttle)]
+            if include_archived:
+                chunks.append(_archived_rows(backend, shard, throttle))
+            for source in chunks:
+                for rows in source:
+                    written += len(rows)
+                    yield _to_batch(rows, schema, partition)
+
+    ds.write_dataset(
+        pa.RecordBatchReader.from_batches(schema, batches()),
+        path,
+        format="parquet",
+        partitioning=partitioning,
+        file_options=ds.ParquetFileFormat().make_write_options(compression=compression),
+        min_rows_per_group=MIN_ROWS_PER_GROUP,
+        max_open_files=MAX_OPEN_FILES,
+        existing_data_behavior="delete_matching" if overwrite else "error",
+    )
+    return written
+
+
+def _restore_names(backend, names):
+    by_shard = {}
+    for session_id, (user_id, name) in names.items():
+        by_shard.setdefault(backend.shard_for_user(user_id or ""), []).append((name, session_id))
+    for shard, updates in by_shard.items():
+        with backend.connect(shard) as conn:
+            # Only sessions still carrying the default, so titles set since aren't clobbered
+            conn.executemany("UPDATE sessions SET name = ? WHERE id = ? AND name = 'New Chat'", updates)
+
+
+def import_chats(path, low_priority=False):
+    """
+    Load a Parquet file or dataset written by export_chats into the current backend
+    Returns:
+        number of rows inserted
+    """
+    import pyarrow.dataset as ds
+
+    db_utils.init_db()
+    backend = db_utils.get_backend()
+    throttle = Throttle(low_priority)
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    columns = ["session_id", "user_id", "role", "content", "timestamp", "session_name"]
+    imported = 0
+    for batch in dataset.to_batches(columns=columns, batch_size=throttle.chunk_size):
+        if not batch.num_rows:
+            continue
+        session_ids, user_ids, roles, contents, timestamps, names = (
+            batch.column(name).to_pylist() for name in columns
+        )
+        imported += db_utils.save_messages(list(zip(session_ids, user_ids, roles, contents, timestamps)))
+        _restore_names(backend, {session_id: (user_id, name)
+                                 for session_id, user_id, name in zip(session_ids, user_ids, names)
+                                 if name and name != "New Chat"})
+        throttle.pause()
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Write chats to a Parquet dataset")
+    export.add_argument("path", help="Output directory")
+    export.add_argument("--partition", choices=PARTITIONS, default="none")
+    export.add_argument("--include-archived", action="store_true", help="Also export archived sessions")
+    export.add_argument("--compression", default="zstd")
+    export.add_argument("--overwrite", action="store_true", help="Replace partitions already in path")
+    export.add_argument("--low-priority", action="store_true", help="Yield to the app's writers")
+
+    load = commands.add_parser("import", help="Load a Parquet file or dataset into chats")
+    load.add_argument("path", help="Parquet file or directory")
+    load.add_argument("--low-priority", action="store_true", help="Yield to the app's writers")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "export":
+        rows = export_chats(args.path, args.partition, args.include_archived, args.low_priority,
+                            args.compression, args.overwrite)
+        print(f"Exported {rows} messages to {args.path}", file=sys.stderr)
+    else:
+        rows = import_chats(args.path, args.low_priority)
+        print(f"Imported {rows} messages from {args.path}", file=sys.stderr)
+    print(f"{rows / max(time.perf_counter() - start, 1e-9):,.0f} rows/s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Copy chat data into a sharded layout (ShardedSQLiteBackend).
+
+Usage:
+    python reshard_db.py --shards 8
+    python reshard_db.py --shards 16 --source chat_history.shard0.db chat_history.shard1.db ...
+
+Every user's sessions, messages and archived sessions are copied to the shard
+chosen by hashing their user_id. Sources are opened read-only and may be at
+any older schema version: columns they lack are copied as NULL, and sessions
+rows are rebuilt from the messages of sources without a sessions table. The
+target shard files must be empty. Afterwards start the app with
+CHAT_STORAGE=sharded and CHAT_SHARDS set to the same count.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+from urllib.parse import quote
+
+import db_utils
+
+# Source rows read per batch
+CHUNK_SIZE = 5000
+
+SESSION_COLUMNS = ("id", "user_id", "name", "created_at", "last_used", "message_count", "preview",
+                   "archived_at", "restored_at")
+CHAT_COLUMNS = ("session_id", "user_id", "role", "content", "timestamp", "session_name", "created_at")
+ARCHIVE_COLUMNS = ("session_id", "user_id", "message_count", "archived_at", "raw_bytes", "payload")
+
+
+def open_read_only(path):
+    if not os.path.exists(path):
+        raise SystemExit(f"Source {path} does not exist")
+    return sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True)
+
+
+def source_columns(source, table):
+    """Columns of table in source; empty when an older schema doesn't have the table"""
+    return {row[1] for row in source.execute(f"PRAGMA table_info({table})")}
+
+
+def copy_table(source, backend, table, columns, user_column, order_column="rowid"):
+    """
+    Copy table from source into the backend's shards in rowid order, a chunk at a time
+    Returns:
+        rows copied, None when the source has no such table
+    """
+    present = source_columns(source, table)
+    if not present:
+        return None
+    selected = ", ".join(column if column in present else f"NULL AS {column}" for column in columns)
+    select = f"SELECT {order_column}, {selected} FROM {table} WHERE {order_column} > ? ORDER BY {order_column} LIMIT ?"
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    user_index = columns.index(user_column)
+    last = 0
+    copied = 0
+    while True:
+        rows = source.execute(select, (last, CHUNK_SIZE)).fetchall()
+        if not rows:
+            return copied
+        last = rows[-1][0]
+        by_shard = {}
+        for row in rows:
+            by_shard.setdefault(backend.shard_for_user(row[1 + user_index] or ""), []).append(row[1:])
+        for shard, shard_rows in by_shard.items():
+            with backend.connect(shard) as conn:
+                conn.executemany(insert, shard_rows)
+        copied += len(rows)
+
+
+def reshard(sources, backend):
+    """
+    Copy every source database into backend's shards
+    Returns:
+        {table: rows copied}
+    """
+    db_utils.set_backend(backend)
+    db_utils.init_db()
+    for shard in backend.shards():
+        with backend.connect(shard) as conn:
+            if conn.execute("SELECT EXISTS (SELECT 1 FROM sessions)").fetchone()[0]:
+                raise SystemExit(f"Target shard {shard} already has data, refusing to copy into it")
+
+    totals = {"sessions": 0, "chats": 0, "archived_sessions": 0}
+    rebuild_sessions = False
+    for path in sources:
+        source = open_read_only(path)
+        try:
+            sessions = copy_table(source, backend, "sessions", SESSION_COLUMNS, "user_id")
+            # Target ids are reassigned; copying in id order keeps each session's order
+            totals["chats"] += copy_table(source, backend, "chats", CHAT_COLUMNS, "user_id", order_column="id") or 0
+            totals["archived_sessions"] += copy_table(source, backend, "archived_sessions", ARCHIVE_COLUMNS,
+                                                      "user_id") or 0
+        finally:
+            source.close()
+        if sessions is None:
+            rebuild_sessions = True
+        else:
+            totals["sessions"] += sessions
+        print(f"Copied {path}", file=sys.stderr)
+
+    if rebuild_sessions:
+        # Recomputed from the copied messages; names already copied are kept
+        db_utils.backfill_sessions()
+        totals["sessions"] = sum(sessions for _, sessions, _ in shard_counts(backend))
+    return totals
+
+
+def shard_counts(backend):
+    counts = []
+    for shard in backend.shards():
+        with backend.connect(shard) as conn:
+            counts.append((shard, conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0],
+                           conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0]))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shards", type=int, default=db_utils.SHARD_COUNT, help="Number of target shards")
+    parser.add_argument("--source", nargs="+", default=[db_utils.DB_PATH], help="Databases to copy from")
+    parser.add_argument("--base", default=db_utils.DB_PATH,
+                        help="Target base path; chat_history.db gives chat_history.shard0.db, ...")
+    args = parser.parse_args()
+
+    backend = db_utils.ShardedSQLiteBackend(args.shards, args.base)
+    if set(backend.shards()) & {os.path.abspath(p) for p in args.source}:
+        raise SystemExit("Source and target shards must be different files")
+
+    totals = reshard(args.source, backend)
+    print(f"Copied {totals['sessions']} sessions, {totals['chats']} messages and "
+          f"{totals['archived_sessions']} archived sessions into {args.shards} shards")
+    for shard, sessions, messages in shard_counts(backend):
+        print(f"  {shard}: {sessions} sessions, {messages} messages")
+    print(f"Start the app with CHAT_STORAGE=sharded CHAT_SHARDS={args.shards}")
+
+
+if __name__ == "__main__":
+    main()
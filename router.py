@@ -0,0 +1,303 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from metrics import observe, incr
+
+# Worker threads shared by all routers for hedged and streamed requests
+ROUTER_WORKERS = 16
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=ROUTER_WORKERS, thread_name_prefix="llm-router")
+    return _executor
+
+
+class ModelStats:
+    """
+    Rolling outcome window for one model
+    Args:
+        window (int): Number of recent calls kept
+    """
+
+    def __init__(self, window=50):
+        self.calls = deque(maxlen=window)  # (ok, seconds)
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.disabled = False
+
+    def record(self, ok, seconds):
+        self.calls.append((ok, seconds))
+        self.consecutive_failures = 0 if ok else self.consecutive_failures + 1
+
+    def error_rate(self):
+        if not self.calls:
+            return 0.0
+        return sum(1 for ok, _ in self.calls if not ok) / len(self.calls)
+
+    def latency(self, pct):
+        """Latency percentile of successful calls in seconds, None before the first one"""
+        values = sorted(seconds for ok, seconds in self.calls if ok)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+class AllModelsFailed(Exception):
+    """Every configured model failed; errors holds (model_name, exception) pairs"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(f"{name}: {error}" for name, error in errors) or "No models configured")
+
+
+class ModelRouter:
+    """
+    Routes chat requests over several models, preferring them in the order
+    given while they are healthy. A failed request moves on to the next model,
+    and with hedge_after set a request with no answer (or, when streaming, no
+    first token) after that many seconds is also sent to the next model; the
+    first to answer wins.
+    Args:
+        models (list): (name, chat model) pairs in order of preference
+        hedge_after (float): Seconds before hedging a slow request, 0 disables hedging
+        window (int): Recent calls per model used for error rate and latency
+        max_error_rate (float): Models above this error rate are tried after healthy ones
+        slow_after (float): Models whose median latency exceeds this many seconds are
+            tried after healthy ones, 0 disables
+        failure_threshold (int): Consecutive failures that put a model in cooldown
+        cooldown (float): Seconds a failing model is skipped for
+    """
+
+    def __init__(self, models, hedge_after=0.0, window=50, max_error_rate=0.5, slow_after=0.0,
+                 failure_threshold=3, cooldown=30.0):
+        if not models:
+            raise ValueError("ModelRouter needs at least one model")
+        self.models = list(models)
+        self.hedge_after = hedge_after
+        self.max_error_rate = max_error_rate
+        self.slow_after = slow_after
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._stats = {name: ModelStats(window) for name, _ in self.models}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # The response cache keys on these, so they describe the preferred model;
+    # replies from any other model are not cached (see last_model)
+    @property
+    def model_name(self):
+        return self.models[0][0]
+
+    @property
+    def temperature(self):
+        return getattr(self.models[0][1], "temperature", None)
+
+    def last_model(self):
+        """Name of the model that answered this thread's latest request, None when none did"""
+        return getattr(self._local, "model", None)
+
+    def order(self):
+        """Models to try, healthy ones first, each group in configured order"""
+        now = time.monotonic()
+        ranked = []
+        with self._lock:
+            for index, (name, llm) in enumerate(self.models):
+                stats = self._stats[name]
+                median = stats.latency(50)
+                degraded = (stats.error_rate() > self.max_error_rate
+                            or bool(self.slow_after and median is not None and median > self.slow_after))
+                # Disabled and cooling-down models stay at the back rather than
+                # being dropped, so a request is never refused outright
+                ranked.append(((stats.disabled, stats.cooldown_until > now, degraded, index), name, llm))
+        ranked.sort(key=lambda item: item[0])
+        return [(name, llm) for _, name, llm in ranked]
+
+    def stats(self):
+        """Per-model error rate, latency percentiles and state, for display and debugging"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                name: {
+                    "calls": len(stats.calls),
+                    "error_rate": round(stats.error_rate(), 3),
+                    "p50_s": stats.latency(50),
+                    "p95_s": stats.latency(95),
+                    "cooling_down": stats.cooldown_until > now,
+                    "disabled": stats.disabled
+                }
+                for name, stats in self._stats.items()
+            }
+
+    def _record(self, name, seconds, error=None):
+        with self._lock:
+            stats = self._stats[name]
+            stats.record(error is None, seconds)
+            if error is None:
+                return
+            if "model_decommissioned" in str(error):
+                # Never coming back; keep it out of the way for the process lifetime
+                stats.disabled = True
+            elif stats.consecutive_failures >= self.failure_threshold:
+                stats.cooldown_until = time.monotonic() + self.cooldown
+        incr("chat_router_model_errors_total")
+
+    def _call(self, name, llm, messages):
+        start = time.perf_counter()
+        try:
+            result = llm.invoke(messages)
+        except Exception as e:
+            self._record(name, time.perf_counter() - start, e)
+            raise
+        seconds = time.perf_counter() - start
+        self._record(name, seconds)
+        observe(f"llm.model.{name}", seconds)
+        return result
+
+    def invoke(self, messages):
+        self._local.model = None
+        candidates = self.order()
+        if not self.hedge_after or len(candidates) == 1:
+            errors = []
+            for name, llm in candidates:
+                if errors:
+                    incr("chat_router_failovers_total")
+                try:
+                    result = self._call(name, llm, messages)
+                except Exception as e:
+                    errors.append((name, e))
+                    continue
+                self._local.model = name
+                return result
+            raise AllModelsFailed(errors)
+        return self._invoke_hedged(candidates, messages)
+
+    def _invoke_hedged(self, candidates, messages):
+        executor = _get_executor()
+        remaining = list(candidates)
+        pending = {}
+        errors = []
+        hedged = False
+
+        def launch():
+            name, llm = remaining.pop(0)
+            pending[executor.submit(self._call, name, llm, messages)] = name
+
+        launch()
+        while pending:
+            timeout = self.hedge_after if remaining and not hedged else None
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                incr("chat_router_hedges_total")
+                launch()
+                continue
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append((name, e))
+                    continue
+                # Losing requests run to completion in the background and only feed the stats
+                if name != candidates[0][0]:
+                    incr("chat_router_fallback_wins_total")
+                self._local.model = name
+                return result
+            if not pending and remaining:
+                incr("chat_router_failovers_total")
+                launch()
+        raise AllModelsFailed(errors)
+
+    def stream(self, messages):
+        """
+        Yields chunks from the first model to produce a token. A model that fails
+        before its first token is replaced by the next one; once chunks have been
+        yielded the reply is committed to that model and its errors are raised.
+        Latency for streams is recorded as time to first token.
+        """
+        self._local.model = None
+        candidates = self.order()
+        remaining = list(candidates)
+        events = queue.Queue()
+        cancelled = {}
+        active = set()
+        errors = []
+        winner = None
+        hedged = False
+        executor = _get_executor()
+
+        def run(name, llm, cancel):
+            start = time.perf_counter()
+            first = True
+            try:
+                for chunk in llm.stream(messages):
+                    if cancel.is_set():
+                        return
+                    if first and chunk.content:
+                        first = False
+                        seconds = time.perf_counter() - start
+                        self._record(name, seconds)
+                        observe(f"llm.model.{name}", seconds)
+                    events.put((name, "chunk", chunk))
+            except Exception as e:
+                if first:
+                    self._record(name, time.perf_counter() - start, e)
+                events.put((name, "error", e))
+                return
+            if first:
+                # Finished without any content, still a successful call
+                self._record(name, time.perf_counter() - start)
+            events.put((name, "done", None))
+
+        def launch():
+            name, llm = remaining.pop(0)
+            cancelled[name] = threading.Event()
+            active.add(name)
+            executor.submit(run, name, llm, cancelled[name])
+
+        launch()
+        try:
+            while active:
+                hedge = winner is None and remaining and self.hedge_after and not hedged
+                try:
+                    name, kind, payload = events.get(timeout=self.hedge_after if hedge else None)
+                except queue.Empty:
+                    hedged = True
+                    incr("chat_router_hedges_total")
+                    launch()
+                    continue
+
+                if winner is not None and name != winner:
+                    continue
+                if kind == "chunk":
+                    if winner is None:
+                        winner = self._local.model = name
+                        for other, cancel in cancelled.items():
+                            if other != name:
+                                cancel.set()
+                        if name != candidates[0][0]:
+                            incr("chat_router_fallback_wins_total")
+                    yield payload
+                elif kind == "done":
+                    return
+                else:
+                    active.discard(name)
+                    if winner == name:
+                        raise payload
+                    errors.append((name, payload))
+                    if not active and remaining:
+                        incr("chat_router_failovers_total")
+                        launch()
+            raise AllModelsFailed(errors)
+        finally:
+            # Consumer stopped early or a winner is done; stop the rest
+            for cancel in cancelled.values():
+                cancel.set()
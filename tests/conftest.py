@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Modules live at the repository root; run offline against the fake model
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("METRICS_PORT", "0")
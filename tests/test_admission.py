@@ -0,0 +1,215 @@
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+import chat_utils
+from admission import AdmissionController, AdmissionRejected, TokenBucket, is_rate_limit_error, retry_after
+from router import AllModelsFailed
+
+
+def rate_limit_error(retry_after_header=None):
+    headers = {"retry-after": retry_after_header} if retry_after_header is not None else {}
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "https://api.example/v1/chat"))
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_token_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(rate=2, capacity=4)
+    now = bucket.updated
+    assert bucket.wait_time(4, now) == 0
+    bucket.take(4)
+    assert bucket.wait_time(1, now) == pytest.approx(0.5)
+    assert bucket.wait_time(1, now + 0.5) == 0
+    assert bucket.wait_time(4, now + 100) == 0
+    assert bucket.tokens == 4
+
+
+def test_token_bucket_caps_oversized_requests_and_settles_debt():
+    bucket = TokenBucket(rate=1, capacity=3)
+    now = bucket.updated
+    # More than a full bucket only waits for a full bucket
+    assert bucket.wait_time(10, now) == 0
+    bucket.take(3)
+    bucket.take(2)
+    assert bucket.wait_time(1, now) == pytest.approx(3)
+    bucket.give(100)
+    assert bucket.tokens == 3
+
+
+def test_requests_per_minute_limit_delays_the_next_call():
+    controller = AdmissionController(requests_per_minute=60, max_wait=0)
+    controller._global[0][1].capacity = controller._global[0][1].tokens = 1
+    controller.release(controller.acquire("u", 1))
+    start = time.monotonic()
+    controller.release(controller.acquire("u", 1, poll=0.05))
+    assert time.monotonic() - start >= 0.9
+
+
+def test_waiting_calls_are_served_round_robin_across_users():
+    controller = AdmissionController(max_concurrent=1)
+    held = controller.acquire("first", 1)
+    granted = []
+
+    def call(label, user_id):
+        granted.append((label, controller.acquire(user_id, 1, poll=0.05)))
+
+    threads = []
+    for label, user_id in [("a1", "a"), ("a2", "a"), ("a3", "a"), ("b1", "b"), ("c1", "c")]:
+        threads.append(threading.Thread(target=call, args=(label, user_id)))
+        threads[-1].start()
+        # Enqueue in a known order
+        wait_until(lambda: controller.stats()["waiting"] == len(threads))
+
+    for expected in range(1, len(threads) + 1):
+        controller.release(held)
+        wait_until(lambda: len(granted) == expected)
+        held = granted[-1][1]
+    controller.release(held)
+    for thread in threads:
+        thread.join()
+    assert [label for label, _ in granted] == ["a1", "b1", "c1", "a2", "a3"]
+
+
+def test_queue_position_reflects_round_robin_order():
+    controller = AdmissionController(max_concurrent=1)
+    held = controller.acquire("first", 1)
+    positions = {}
+
+    def call(label, user_id):
+        def on_wait(position, seconds):
+            positions.setdefault(label, position)
+        controller.release(controller.acquire(user_id, 1, on_wait, poll=0.05))
+
+    threads = []
+    for label, user_id in [("a1", "a"), ("a2", "a"), ("b1", "b")]:
+        threads.append(threading.Thread(target=call, args=(label, user_id)))
+        threads[-1].start()
+        wait_until(lambda: len(positions) == len(threads))
+    controller.release(held)
+    for thread in threads:
+        thread.join()
+    # b1 was queued last but is served before a's second call
+    assert positions == {"a1": 1, "a2": 2, "b1": 2}
+
+
+def test_full_queue_is_rejected():
+    controller = AdmissionController(max_concurrent=1, max_queue=1, max_wait=1.0)
+    held = controller.acquire("u", 1)
+    waiter = threading.Thread(target=lambda: controller.release(controller.acquire("v", 1, poll=0.05)))
+    waiter.start()
+    wait_until(lambda: controller.stats()["waiting"] == 1)
+    with pytest.raises(AdmissionRejected):
+        controller.acquire("w", 1)
+    controller.release(held)
+    waiter.join()
+
+
+def test_call_waiting_longer_than_max_wait_is_rejected():
+    controller = AdmissionController(max_concurrent=1, max_wait=0.1)
+    held = controller.acquire("u", 1)
+    with pytest.raises(AdmissionRejected):
+        controller.acquire("v", 1, poll=0.02)
+    assert controller.stats() == {"waiting": 0, "in_flight": 1, "users_queued": 0}
+    controller.release(held)
+    controller.release(controller.acquire("v", 1))
+
+
+def test_max_wait_gives_the_busy_reply(monkeypatch):
+    controller = AdmissionController(max_concurrent=1, max_wait=0.1)
+    held = controller.acquire("someone-else", 1)
+    monkeypatch.setattr(chat_utils, "get_admission_controller", lambda: controller)
+    monkeypatch.setattr(chat_utils, "get_response_cache", lambda: None)
+    try:
+        assert chat_utils.generate_response("hi", []) == chat_utils.BUSY_MESSAGE
+        assert list(chat_utils.stream_response("hi", [])) == [chat_utils.BUSY_MESSAGE]
+    finally:
+        controller.release(held)
+
+
+def test_rate_limit_errors_are_recognised_by_status_and_type():
+    assert is_rate_limit_error(rate_limit_error())
+    assert is_rate_limit_error(AllModelsFailed([("a", RuntimeError("down")), ("b", rate_limit_error())]))
+
+    class RateLimitError(Exception):
+        pass
+
+    assert is_rate_limit_error(RateLimitError("slow down"))
+    # Numbers in a message are not a status code
+    assert not is_rate_limit_error(ValueError("Prompt is 4290 tokens, over the limit"))
+    assert not is_rate_limit_error(RuntimeError("Error code: 429"))
+    assert not is_rate_limit_error(AllModelsFailed([("a", RuntimeError("down"))]))
+
+
+def test_retry_after_header():
+    assert retry_after(rate_limit_error("2")) == 2.0
+    assert retry_after(rate_limit_error("0.5")) == 0.5
+    assert retry_after(rate_limit_error()) is None
+    assert retry_after(rate_limit_error("Wed, 21 Oct 2015 07:28:00 GMT")) is None
+    assert retry_after(rate_limit_error("-1")) is None
+    wrapped = AllModelsFailed([("a", rate_limit_error("1")), ("b", rate_limit_error("3"))])
+    assert retry_after(wrapped) == 3.0
+
+
+def test_429_pauses_the_queue_for_retry_after_then_retries(monkeypatch):
+    controller = AdmissionController(max_concurrent=4)
+    slept = []
+    calls = []
+
+    class Reply:
+        content = "hello"
+
+    class LLM:
+        model_name = "fake"
+
+        def invoke(self, messages):
+            calls.append(messages)
+            if len(calls) == 1:
+                raise rate_limit_error("2")
+            return Reply()
+
+    monkeypatch.setattr(chat_utils, "get_admission_controller", lambda: controller)
+    monkeypatch.setattr(chat_utils, "get_response_cache", lambda: None)
+    monkeypatch.setattr(chat_utils, "load_llm", LLM)
+    monkeypatch.setattr(chat_utils.time, "sleep", slept.append)
+    before = time.monotonic()
+    assert chat_utils.complete("hi", []) == "hello"
+    assert len(calls) == 2
+    assert slept == [2.0]
+    # Everyone else's queued calls are held for the same time
+    assert controller._paused_until == pytest.approx(before + 2.0, abs=0.5)
+
+
+def test_paused_controller_holds_new_calls():
+    controller = AdmissionController(max_concurrent=4)
+    controller.pause(0.2)
+    start = time.monotonic()
+    controller.release(controller.acquire("u", 1, poll=0.05))
+    assert time.monotonic() - start >= 0.2
+
+
+def test_other_errors_are_not_retried(monkeypatch):
+    calls = []
+
+    class LLM:
+        model_name = "fake"
+
+        def invoke(self, messages):
+            calls.append(messages)
+            raise RuntimeError("Error code: 429 tokens in prompt")
+
+    monkeypatch.setattr(chat_utils, "get_admission_controller", lambda: None)
+    monkeypatch.setattr(chat_utils, "get_response_cache", lambda: None)
+    monkeypatch.setattr(chat_utils, "load_llm", LLM)
+    with pytest.raises(RuntimeError):
+        chat_utils.complete("hi", [])
+    assert len(calls) == 1
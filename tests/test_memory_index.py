@@ -0,0 +1,68 @@
+import uuid
+
+import pytest
+
+import db_utils
+import memory_index
+from config import Config
+
+
+@pytest.fixture
+def chat_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "MEMORY_INDEX_DIR", str(tmp_path / "chat_vectors"))
+    monkeypatch.setattr(db_utils, "WRITE_BEHIND", False)
+    db_utils.set_backend(db_utils.SQLiteBackend(str(tmp_path / "chat_history.db")))
+    db_utils.init_db()
+    memory_index._indexes.clear()
+    yield
+    memory_index._indexes.clear()
+    db_utils.set_backend(None)
+    db_utils.close_all_pools()
+
+
+def wait_for_background():
+    with memory_index._indexes_lock:
+        executor = memory_index._get_executor()
+    executor.submit(lambda: None).result(timeout=10)
+
+
+def save_session(user_id, messages):
+    session_id = str(uuid.uuid4())
+    for i, content in enumerate(messages):
+        db_utils.save_message(session_id, user_id, "user" if i % 2 == 0 else "assistant", content)
+    return session_id
+
+
+def test_deleted_session_is_pruned_and_not_recalled(chat_db):
+    user_id = str(uuid.uuid4())
+    kept = save_session(user_id, ["how do I bake sourdough bread", "feed the starter and bake hot"])
+    deleted = save_session(user_id, ["sourdough bread keeps going flat", "proof it for less time"])
+    memory_index.sync(user_id)
+    wait_for_background()
+    assert memory_index.get_index(user_id).count == 4
+    assert {r["session_id"] for r in memory_index.recall(user_id, "sourdough bread", k=4)} == {kept, deleted}
+
+    db_utils.delete_session(deleted)
+    wait_for_background()
+    assert memory_index.get_index(user_id).count == 2
+    assert {r["session_id"] for r in memory_index.recall(user_id, "sourdough bread", k=4)} == {kept}
+
+
+def test_messages_missing_at_recall_are_pruned(chat_db, monkeypatch):
+    user_id = str(uuid.uuid4())
+    kept = save_session(user_id, ["tuning postgres autovacuum settings"])
+    deleted = save_session(user_id, ["postgres autovacuum keeps running"])
+    memory_index.sync(user_id)
+    wait_for_background()
+
+    # As if another process deleted it, without telling this one's listener
+    monkeypatch.setattr(db_utils, "_delete_listeners", [])
+    db_utils.delete_session(deleted)
+    assert [r["session_id"] for r in memory_index.recall(user_id, "postgres autovacuum", k=2)] == [kept]
+    wait_for_background()
+    assert memory_index.get_index(user_id).count == 1
+
+
+def test_prune_skips_users_without_an_index(chat_db, tmp_path):
+    assert memory_index.prune("nobody", [1, 2]) == 0
+    assert not (tmp_path / "chat_vectors").exists()
@@ -0,0 +1,128 @@
+import os
+import shutil
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import db_utils
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LATEST = db_utils.MIGRATIONS[-1][0]
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def fresh_pools():
+    yield
+    db_utils.close_all_pools()
+    db_utils._read_cache.clear()
+
+
+def make_legacy_db(path, sessions=12, messages=5):
+    """chats as the app first created it, before session_name/created_at existed"""
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE chats
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     session_id TEXT,
+                     user_id TEXT,
+                     role TEXT,
+                     content TEXT,
+                     timestamp DATETIME)''')
+    conn.execute("CREATE INDEX idx_session ON chats (session_id)")
+    conn.execute("CREATE INDEX idx_user ON chats (user_id)")
+    start = datetime(2025, 1, 1)
+    rows = [(f"s{s:02d}", f"u{s % 3}", "user" if m % 2 == 0 else "assistant",
+             f"message {m} about topic{s}", start + timedelta(minutes=s * messages + m))
+            for s in range(sessions) for m in range(messages)]
+    conn.executemany("INSERT INTO chats (session_id, user_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                     rows)
+    conn.commit()
+    conn.close()
+
+
+def interrupt_backfill(monkeypatch, call, chunks):
+    """Make the call-th chunked backfill (0-based) stop after committing chunks chunks"""
+    real = db_utils._id_ranges
+    calls = []
+
+    def ranges(c, table, chunk_size):
+        calls.append(table)
+        for done, chunk in enumerate(real(c, table, chunk_size)):
+            if len(calls) - 1 == call and done == chunks:
+                raise Interrupted()
+            yield chunk
+
+    monkeypatch.setattr(db_utils, "MIGRATION_CHUNK_SIZE", 7)
+    monkeypatch.setattr(db_utils, "_id_ranges", ranges)
+
+
+def check_migrated(path):
+    conn = sqlite3.connect(path)
+    try:
+        chats = conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+        assert conn.execute("SELECT COUNT(*) FROM chats WHERE session_name IS NULL OR created_at IS NULL"
+                            ).fetchone()[0] == 0
+        # One sessions row per session, counting every message
+        assert conn.execute("SELECT COUNT(DISTINCT session_id) FROM chats").fetchone()[0] == \
+            conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        assert conn.execute("SELECT COALESCE(SUM(message_count), 0) FROM sessions").fetchone()[0] == chats
+        # Every message indexed exactly once
+        assert conn.execute("SELECT COUNT(*) FROM chats_fts").fetchone()[0] == chats
+        conn.execute("INSERT INTO chats_fts (chats_fts) VALUES ('integrity-check')")
+        return chats
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("call, chunks, interrupted_at", [
+    (0, 3, 1),  # session_name backfill
+    (1, 1, 1),  # created_at backfill
+    (2, 4, 4),  # full-text index backfill
+])
+def test_interrupted_backfill_resumes(tmp_path, monkeypatch, call, chunks, interrupted_at):
+    path = str(tmp_path / "chat_history.db")
+    make_legacy_db(path)
+
+    with monkeypatch.context() as patch:
+        interrupt_backfill(patch, call, chunks)
+        with pytest.raises(Interrupted):
+            db_utils.migrate(path)
+    assert db_utils.schema_version(path) == interrupted_at
+
+    applied = db_utils.migrate(path)
+    assert [version for version, _ in applied] == list(range(interrupted_at + 1, LATEST + 1))
+    assert db_utils.schema_version(path) == LATEST
+    assert check_migrated(path) == 60
+
+    conn = sqlite3.connect(path)
+    try:
+        matches = conn.execute("SELECT COUNT(*) FROM chats_fts WHERE chats_fts MATCH 'topic4'").fetchone()[0]
+        assert matches == 5
+        assert conn.execute("SELECT message_count, preview FROM sessions WHERE id = 's04'").fetchone() == \
+            (5, "message 0 about topic4")
+    finally:
+        conn.close()
+    assert db_utils.migrate(path) == []
+
+
+def test_baseline_database_migrates_after_interruption(tmp_path, monkeypatch):
+    # The chat_history.db shipped with the repository predates every migration
+    path = str(tmp_path / "chat_history.db")
+    shutil.copy(os.path.join(ROOT, "chat_history.db"), path)
+    conn = sqlite3.connect(path)
+    chats = conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+    conn.close()
+
+    with monkeypatch.context() as patch:
+        interrupt_backfill(patch, 2, 1)
+        with pytest.raises(Interrupted):
+            db_utils.migrate(path)
+    assert db_utils.schema_version(path) == 4
+
+    db_utils.migrate(path)
+    assert db_utils.schema_version(path) == LATEST
+    assert check_migrated(path) == chats
@@ -0,0 +1,104 @@
+import pytest
+from langchain_core.messages import HumanMessage
+
+from fake_llm import FakeStreamingChatModel
+from router import AllModelsFailed, ModelRouter
+
+MESSAGES = [HumanMessage(content="hi")]
+
+
+def fake(reply, **kwargs):
+    return FakeStreamingChatModel(responses=[reply], **kwargs)
+
+
+def names(router):
+    return [name for name, _ in router.order()]
+
+
+def streamed(router):
+    return "".join(chunk.content for chunk in router.stream(MESSAGES))
+
+
+def test_invoke_fails_over_in_configured_order():
+    router = ModelRouter([("a", fake("from a", error="boom")),
+                          ("b", fake("from b", error="boom")),
+                          ("c", fake("from c"))])
+    assert router.invoke(MESSAGES).content == "from c"
+    assert router.last_model() == "c"
+    assert router.stats()["a"]["error_rate"] == 1.0
+    assert router.stats()["b"]["error_rate"] == 1.0
+
+
+def test_invoke_raises_when_every_model_fails():
+    router = ModelRouter([("a", fake("x", error="down")), ("b", fake("y", error="down"))])
+    with pytest.raises(AllModelsFailed) as raised:
+        router.invoke(MESSAGES)
+    assert [name for name, _ in raised.value.errors] == ["a", "b"]
+    assert router.last_model() is None
+
+
+def test_consecutive_failures_put_a_model_in_cooldown():
+    failing = fake("from a", error="timeout")
+    # max_error_rate=1 keeps the error-rate demotion out of the way
+    router = ModelRouter([("a", failing), ("b", fake("from b"))], failure_threshold=2, cooldown=60,
+                         max_error_rate=1.0)
+    router.invoke(MESSAGES)
+    assert names(router) == ["a", "b"]
+    router.invoke(MESSAGES)
+    assert names(router) == ["b", "a"]
+    assert router.stats()["a"]["cooling_down"]
+
+    # Skipped while cooling down, even once it would answer again
+    failing.error = None
+    assert router.invoke(MESSAGES).content == "from b"
+
+
+def test_cooldown_expires(monkeypatch):
+    router = ModelRouter([("a", fake("from a", error="timeout")), ("b", fake("from b"))],
+                         failure_threshold=1, cooldown=5, max_error_rate=1.0)
+    router.invoke(MESSAGES)
+    assert names(router) == ["b", "a"]
+
+    import router as router_module
+    now = router_module.time.monotonic()
+    monkeypatch.setattr(router_module.time, "monotonic", lambda: now + 6)
+    assert names(router) == ["a", "b"]
+
+
+def test_decommissioned_model_is_disabled_for_good():
+    router = ModelRouter([("a", fake("from a", error="Error code: 400 - model_decommissioned")),
+                          ("b", fake("from b"))], failure_threshold=100, max_error_rate=1.0)
+    assert router.invoke(MESSAGES).content == "from b"
+    assert router.stats()["a"]["disabled"]
+    assert names(router) == ["b", "a"]
+    for _ in range(5):
+        router.invoke(MESSAGES)
+    assert router.stats()["a"]["calls"] == 1
+
+
+def test_stream_fails_over_before_the_first_token():
+    router = ModelRouter([("a", fake("from a", error="boom")), ("b", fake("from b"))])
+    assert streamed(router) == "from b"
+    assert router.last_model() == "b"
+
+
+def test_hedged_stream_sends_only_the_fallback_when_it_wins():
+    slow = fake("one two three four", latency=0.5)
+    router = ModelRouter([("a", slow), ("b", fake("five six seven"))], hedge_after=0.05)
+    assert streamed(router) == "five six seven"
+    assert router.last_model() == "b"
+
+
+def test_hedged_stream_sends_only_the_primary_when_it_wins():
+    # Both are streaming by the time the primary's first token arrives
+    primary = fake("one two three four", latency=0.15, token_delay=0.02)
+    fallback = fake("five six seven", latency=0.2, token_delay=0.02)
+    router = ModelRouter([("a", primary), ("b", fallback)], hedge_after=0.05)
+    assert streamed(router) == "one two three four"
+    assert router.last_model() == "a"
+
+
+def test_hedged_invoke_returns_the_first_answer():
+    router = ModelRouter([("a", fake("from a", latency=0.5)), ("b", fake("from b"))], hedge_after=0.05)
+    assert router.invoke(MESSAGES).content == "from b"
+    assert router.last_model() == "b"
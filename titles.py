@@ -0,0 +1,141 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from admission import AdmissionRejected, get_admission_controller
+from cache_utils import normalize_text
+from config import Config
+from db_utils import update_session_name
+from metrics import timed, incr
+
+# Session ids already titled (or given up on) in this process, oldest dropped first
+MAX_REMEMBERED_SESSIONS = 50000
+# Finished titles reused for sessions that open with the same message
+MAX_REMEMBERED_TITLES = 1024
+TITLE_MAX_LENGTH = 50
+
+_executor = None
+_lock = threading.Lock()
+_inflight = {}                # normalized first message -> [(session_id, user_id), ...]
+_queued = set()               # session ids waiting for a title
+_pending_users = {}           # user_id -> sessions still waiting for a title
+_finished = OrderedDict()     # session_id -> None
+_titles = OrderedDict()       # normalized first message -> title
+_versions = {}                # user_id -> titles stored so far
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=Config.TITLE_WORKERS, thread_name_prefix="session-title")
+    return _executor
+
+
+def clean_title(text):
+    """First line of a model reply, without quotes or a "Title:" prefix"""
+    lines = [line for line in text.strip().splitlines() if line.strip()]
+    title = lines[0].strip() if lines else ""
+    if title.lower().startswith("title:"):
+        title = title[len("title:"):].strip()
+    title = title.strip("\"'*# ").strip()
+    if len(title) > TITLE_MAX_LENGTH:
+        title = title[:TITLE_MAX_LENGTH].rsplit(" ", 1)[0] or title[:TITLE_MAX_LENGTH]
+    return title
+
+
+def generate_title(llm, first_message):
+    """Blocking LLM call for a short title; "New Chat" when nothing usable comes back"""
+    prompt = f"Generate a 3-5 word title for: {first_message}"
+    response = llm.invoke(prompt).content
+    return clean_title(response) or "New Chat"
+
+
+def request_title(session_id, user_id, first_message, llm):
+    """
+    Queue a title for a session, returning immediately. Each session is titled
+    at most once per process, and sessions opening with the same message
+    share a single LLM call.
+    Args:
+        session_id (str): Session to name
+        user_id (str): Its owner, for rate limits and sidebar refreshes
+        first_message (str): The session's first user message
+        llm: Chat model from load_llm(), resolved on the calling script thread
+    """
+    if not Config.SESSION_TITLES or not first_message.strip():
+        return
+    key = normalize_text(first_message)
+    with _lock:
+        if session_id in _finished or session_id in _queued:
+            return
+        _queued.add(session_id)
+        _pending_users[user_id] = _pending_users.get(user_id, 0) + 1
+        title = _titles.get(key)
+        if title is None:
+            waiting = _inflight.get(key)
+            if waiting is not None:
+                waiting.append((session_id, user_id))
+                incr("chat_titles_deduplicated_total")
+                return
+            _inflight[key] = [(session_id, user_id)]
+    if title is not None:
+        incr("chat_titles_deduplicated_total")
+        _store(session_id, user_id, title)
+        return
+    _get_executor().submit(_run, key, first_message, user_id, llm)
+
+
+def _run(key, first_message, user_id, llm):
+    title = None
+    try:
+        controller = get_admission_controller()
+        with timed("titles.generate"):
+            if controller is None:
+                title = generate_title(llm, first_message)
+            else:
+                # Titles compete for the same provider limits as chat replies
+                with controller.admitted(user_id, Config.EXPECTED_RESPONSE_TOKENS):
+                    title = generate_title(llm, first_message)
+    except AdmissionRejected:
+        incr("chat_titles_skipped_total")
+    except Exception:
+        incr("chat_title_errors_total")
+
+    with _lock:
+        waiting = _inflight.pop(key, [])
+        if title is not None and title != "New Chat":
+            _titles[key] = title
+            while len(_titles) > MAX_REMEMBERED_TITLES:
+                _titles.popitem(last=False)
+    for session_id, owner in waiting:
+        _store(session_id, owner, title)
+
+
+def _store(session_id, user_id, title):
+    try:
+        if title and title != "New Chat":
+            update_session_name(session_id, title)
+    except Exception:
+        incr("chat_title_errors_total")
+    with _lock:
+        # Failures are remembered too, so a broken provider isn't asked again on every turn
+        _finished[session_id] = None
+        _queued.discard(session_id)
+        while len(_finished) > MAX_REMEMBERED_SESSIONS:
+            _finished.popitem(last=False)
+        if _pending_users.get(user_id):
+            _pending_users[user_id] -= 1
+            if not _pending_users[user_id]:
+                del _pending_users[user_id]
+        _versions[user_id] = _versions.get(user_id, 0) + 1
+
+
+def has_pending(user_id):
+    """True while a title for one of user_id's sessions is being generated"""
+    with _lock:
+        return bool(_pending_users.get(user_id))
+
+
+def version(user_id):
+    """Changes whenever a title for one of user_id's sessions has been stored"""
+    with _lock:
+        return _versions.get(user_id, 0)
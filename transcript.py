@@ -0,0 +1,153 @@
+import sys
+from db_utils import read_session_page, get_session_messages_after, get_message_cursor
+
+# Messages loaded from the database and rendered per transcript page
+PAGE_SIZE = 50
+# Newest messages kept in memory while nothing older is on screen
+RESIDENT_MESSAGES = 100
+
+GREETING = "Hello! How can I help you today?"
+
+
+class Message:
+    """
+    One chat message. Slotted, with the role interned and no timestamp, and
+    readable like the {"role", "content"} dicts it replaces
+    """
+
+    __slots__ = ("role", "content", "saved", "chat_id")
+
+    def __init__(self, role, content, saved=True, chat_id=None):
+        self.role = sys.intern(role)
+        self.content = content
+        # False for greetings and error notices that never reach the database
+        self.saved = saved
+        # Row id once stored; appended messages learn theirs when the transcript is trimmed
+        self.chat_id = chat_id
+
+    def __getitem__(self, key):
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        return {"role": self.role, "content": self.content}
+
+    def __repr__(self):
+        return f"Message({self.role!r}, {self.content[:40]!r})"
+
+
+class Transcript:
+    """
+    The messages of one session held for a browser tab: only the newest
+    ones are kept in memory, older ones are paged back from SQLite on demand.
+    Iterates, indexes and appends like the list of dicts it replaces, so it
+    can be passed as history to generate_response/stream_response.
+    Args:
+        session_id (str): Session the messages belong to
+        messages (list): Message records, oldest first
+        older_cursor (tuple): Cursor to the messages before these, None when there are none
+        max_resident (int): Messages kept in memory beyond the visible window
+    """
+
+    __slots__ = ("session_id", "_messages", "older_cursor", "window", "max_resident")
+
+    def __init__(self, session_id, messages=(), older_cursor=None, max_resident=RESIDENT_MESSAGES):
+        self.session_id = session_id
+        self._messages = list(messages)
+        self.older_cursor = older_cursor
+        # How many of the newest messages are on screen
+        self.window = PAGE_SIZE
+        self.max_resident = max_resident
+
+    @classmethod
+    def new(cls, session_id, greeting=GREETING):
+        return cls(session_id, [Message("assistant", greeting, saved=False)])
+
+    @classmethod
+    def load(cls, session_id):
+        """The newest page of a stored session; empty when it has no messages"""
+        rows, older_cursor = read_session_page(session_id, PAGE_SIZE)
+        return cls(session_id, _messages(rows), older_cursor)
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __getitem__(self, index):
+        return self._messages[index]
+
+    def append(self, message, saved=True):
+        """
+        Add a message at the end
+        Args:
+            message: {"role", "content"} dict or Message
+            saved (bool): False for messages that are shown but never stored
+        """
+        if not isinstance(message, Message):
+            message = Message(message["role"], message["content"], saved)
+        self._messages.append(message)
+        self._trim()
+
+    @property
+    def has_older(self):
+        """True when there is anything above the visible window, in memory or in the database"""
+        return len(self._messages) > self.window or self.older_cursor is not None
+
+    def visible(self):
+        return self._messages[-self.window:]
+
+    def show_older(self):
+        """Widen the visible window by a page, reading from the database once memory runs out"""
+        self.window += PAGE_SIZE
+        if self.window > len(self._messages) and self.older_cursor is not None:
+            rows, self.older_cursor = read_session_page(self.session_id, PAGE_SIZE, self.older_cursor)
+            self._messages[:0] = _messages(rows)
+
+    def _resolve_ids(self):
+        """Match saved messages that have no chat id yet to the rows stored for them"""
+        unresolved = [message for message in self._messages if message.saved and message.chat_id is None]
+        if not unresolved:
+            return
+        known = [message.chat_id for message in self._messages if message.chat_id is not None]
+        rows = iter(get_session_messages_after(self.session_id, max(known, default=None)))
+        for message in unresolved:
+            # Rows written by another tab are skipped; a message not stored yet ends the match
+            for chat_id, role, content in rows:
+                if role == message.role and content == message.content:
+                    message.chat_id = chat_id
+                    break
+            else:
+                return
+
+    def _trim(self):
+        keep = max(self.window, self.max_resident)
+        # Trimmed a page at a time so the lookups happen once per page of new messages
+        if len(self._messages) <= keep + PAGE_SIZE:
+            return
+        self._resolve_ids()
+        # Cut just before a stored message, so paging back resumes exactly there
+        start = len(self._messages) - keep
+        while start < len(self._messages) and self._messages[start].chat_id is None:
+            start += 1
+        if start == len(self._messages):
+            return
+        older_cursor = get_message_cursor(self.session_id, self._messages[start].chat_id)
+        if older_cursor is None:
+            return
+        self.older_cursor = older_cursor
+        self._messages = self._messages[start:]
+
+
+def _messages(rows):
+    return [Message(role, content, chat_id=chat_id) for chat_id, role, content, _ in rows]
@@ -2,10 +2,18 @@ import streamlit as st
 import uuid
 from datetime import datetime
 from llm_utils import load_llm
-from db_utils import get_all_sessions, get_session_messages, delete_session, update_session_name, get_session_preview 
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from config import set_streamlit_config
+from functools import lru_cache
+from db_utils import list_sessions, delete_session, update_session_name, search_messages, flush_pending_writes, is_archived, restore_session
+from config import Config, set_streamlit_config
+import titles
+from transcript import Transcript
+from metrics import timed_function
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# Sessions fetched per sidebar page
+SIDEBAR_PAGE_SIZE = 20
+# Matching messages fetched for the sidebar search box
+SEARCH_RESULT_LIMIT = 20
 
 def set_sidebar_default_expanded():
     st.markdown("""
@@ -19,36 +27,73 @@ def set_sidebar_default_expanded():
     
 
 def generate_session_name(messages):
-    llm = load_llm()
+    """Blocking title for a transcript; the app uses request_session_title() instead"""
     user_messages = [msg['content'] for msg in messages[:3] if msg['role'] == 'user']
     
     if not user_messages:
         return "New Chat"
     
-    prompt = f"Generate a 3-5 word title for: {user_messages[0]}"
-    response = llm.invoke(prompt).content
-    
-    return response.strip()[:50] or "New Chat"
+    return titles.generate_title(load_llm(), user_messages[0])
+
+def request_session_title(first_message):
+    """Name the current session in the background once its first exchange is done"""
+    titles.request_title(st.session_state.session_id, st.session_state.user_id, first_message, load_llm())
 
 def load_session(session_id):
     """Load a specific chat session from database"""
     try:
         st.session_state.session_id = session_id
-        st.session_state.messages = get_session_messages(session_id)
+        open_session_page(session_id)
         st.rerun()
     except Exception as e:
         st.error(f"Failed to load session: {str(e)}")
-        st.session_state.messages = [{
-            "role": "assistant",
-            "content": "Sorry, I couldn't load that conversation"
-        }]
+        st.session_state.messages = Transcript.new(session_id, "Sorry, I couldn't load that conversation")
+
+def show_search_results(query):
+    """List the best matching conversations for query, one entry per session"""
+    try:
+        results = search_messages(st.session_state.user_id, query, limit=SEARCH_RESULT_LIMIT)
+    except Exception as e:
+        st.error(f"Search failed: {str(e)}")
+        return
+
+    if not results:
+        st.info("No matching messages")
+        return
+
+    seen = set()
+    for result in results:
+        if result['session_id'] in seen:
+            continue
+        seen.add(result['session_id'])
+        st.markdown(result['snippet'])
+        if st.button("Open", key=f"search_{result['session_id']}"):
+            load_session(result['session_id'])
+
+def open_session_page(session_id):
+    """Load only the newest page of a session; older pages are fetched on demand"""
+    # Sessions moved to cold storage come back the first time they are opened
+    if is_archived(session_id):
+        restore_session(session_id)
+    st.session_state.messages = Transcript.load(session_id)
+    return st.session_state.messages
+
+def load_older_messages():
+    """Widen the rendered window by a page, reading from the database once memory runs out"""
+    st.session_state.messages.show_older()
+
+def render_transcript():
+    """Render the newest messages only, with a control to page in older ones"""
+    transcript = st.session_state.messages
+    if transcript.has_older and st.button("Show older messages", key="load_older_messages"):
+        load_older_messages()
+
+    for msg in transcript.visible():
+        display_message(msg.role, msg.content)
 
 def start_new_session():
     st.session_state.session_id = str(uuid.uuid4())
-    st.session_state.messages = [{
-        "role": "assistant",
-        "content": "Hello! How can I help you today?"
-    }]
+    st.session_state.messages = Transcript.new(st.session_state.session_id)
     st.rerun()
 
 def setup_page_config(config=None):
@@ -206,16 +251,164 @@ def display_header():
         </div>
     """, unsafe_allow_html=True)
 
-def display_message(role, content):
+def bubble_html(role, content):
     message_class = "user-message" if role == "user" else "assistant-message"
-    st.markdown(f"""
+    return f"""
         <div class="chat-message">
             <div class="{message_class}">
                 {content}
             </div>
         </div>
-    """, unsafe_allow_html=True)
+    """
+
+@lru_cache(maxsize=4096)
+def message_html(role, content):
+    """Bubble HTML for a message, memoized so reruns don't rebuild unchanged messages"""
+    return bubble_html(role, content)
+
+def display_message(role, content, container=None):
+    """Render a chat bubble; pass an st.empty() container to redraw it in place"""
+    if container is not None:
+        # Redrawn once per streamed chunk: each partial reply would take its own memo entry
+        container.markdown(bubble_html(role, content), unsafe_allow_html=True)
+        return
+    st.markdown(message_html(role, content), unsafe_allow_html=True)
+
+def queue_notice():
+    """
+    Placeholder showing the caller's place in the LLM queue, returned as the
+    on_wait callback for generate_response/stream_response
+    """
+    placeholder = st.empty()
+    def on_wait(position, wait_seconds):
+        if position:
+            placeholder.info(f"⏳ Busy right now, you're number {position} in line (about {wait_seconds:.0f}s)")
+        else:
+            placeholder.empty()
+    return on_wait
+
+def rerun_fragment():
+    """Rerun just the calling fragment, or the whole app when it is running as part of a full rerun"""
+    ctx = get_script_run_ctx()
+    st.rerun(scope="fragment" if ctx is not None and ctx.fragment_ids_this_run else "app")
+
+def refresh_sidebar():
+    """Mark the cached session list stale; call after anything that changes it"""
+    st.session_state.sidebar_version = st.session_state.get('sidebar_version', 0) + 1
+
+def get_sidebar_sessions():
+    """
+    Sessions for the expanded sidebar pages, re-queried only when
+    refresh_sidebar() was called or another page was requested
+    """
+    if 'sidebar_pages' not in st.session_state:
+        st.session_state.sidebar_pages = 1
+    key = (st.session_state.user_id, st.session_state.get('sidebar_version', 0), st.session_state.sidebar_pages,
+           titles.version(st.session_state.user_id))
+    cached = st.session_state.get('sidebar_cache')
+    if cached is not None and cached[0] == key:
+        return cached[1], cached[2]
+
+    # Queued write-behind rows must land before the list is rebuilt
+    flush_pending_writes()
+
+    # Walk the pages the user has expanded, one keyset query each
+    sessions = []
+    cursor = None
+    for _ in range(st.session_state.sidebar_pages):
+        page, cursor = list_sessions(st.session_state.user_id, SIDEBAR_PAGE_SIZE, cursor)
+        sessions.extend(page)
+        if cursor is None:
+            break
+
+    st.session_state.sidebar_cache = (key, sessions, cursor)
+    return sessions, cursor
+
+def history_panel():
+    """
+    Session list and search. Interactions inside it rerun only this fragment,
+    and its data comes from get_sidebar_sessions() so reruns skip the database
+    """
+    st.markdown("## Chat History")
 
+    query = st.text_input("Search conversations", key="history_search", placeholder="Search messages...")
+    if query.strip():
+        show_search_results(query)
+        st.divider()
+
+    try:
+        sessions, cursor = get_sidebar_sessions()
+    except Exception as e:
+        st.error(f"Error loading history: {str(e)}")
+        sessions = []
+        cursor = None
+
+    current_session = st.session_state.session_id
+
+    if not sessions:
+        st.info("No previous conversations")
+    else:
+        for session in sessions:
+            # Generated titles replace the preview once they are stored
+            preview = session['session_name'] if session['session_name'] not in (None, "New Chat") else session['preview']
+            last_used = session['last_used']
+            
+            # Format timestamp properly
+            if isinstance(last_used, str):
+                try:
+                    # If it's already a string, parse it
+                    last_used = datetime.strptime(last_used, "%Y-%m-%d %H:%M:%S")
+                except ValueError:
+                    last_used = "Unknown"
+            
+            time_str = last_used.strftime("%b %d, %H:%M") if hasattr(last_used, 'strftime') else "Unknown"
+            
+            cols = st.columns([0.8, 0.2])
+            with cols[0]:
+                st.markdown(
+                    f"""
+                    <div style='padding: 8px; border-radius: 8px; 
+                        background-color: {"#f0f4f8" if session['session_id'] == current_session else "transparent"};
+                        margin-bottom: 8px;'>
+                        <div style='font-weight: 500;'>{preview}</div>
+                        <div style='font-size: 0.8em; color: #64748b;'>{time_str}</div>
+                    </div>
+                    """,
+                    unsafe_allow_html=True
+                )
+                
+                if st.button("Switch", key=f"switch_{session['session_id']}"):
+                    load_session(session['session_id'])
+
+            with cols[1]:
+                if st.button("🗑️", key=f"delete_{session['session_id']}"):
+                    delete_session(session['session_id'])
+                    refresh_sidebar()
+                    if session['session_id'] == current_session:
+                        start_new_session()
+                    rerun_fragment()
+
+        if cursor is not None and st.button("Load more", key="load_more_sessions"):
+            st.session_state.sidebar_pages += 1
+            rerun_fragment()
+
+    if st.button("+ New Chat", type="primary"):
+        start_new_session()
+
+def polling_history_panel():
+    """history_panel for while a title is being generated"""
+    if not titles.has_pending(st.session_state.user_id):
+        # Which panel is mounted is only decided on a full rerun, and chat
+        # turns rerun just the chat pane, so switch back to the static one
+        st.rerun(scope="app")
+    history_panel()
+
+# While a title is being generated the panel also reruns itself on a timer, so
+# the title shows up without touching the rest of the page
+history_panel_fragment = st.fragment(history_panel)
+polling_history_panel_fragment = st.fragment(polling_history_panel, run_every=Config.TITLE_POLL_SECONDS)
+
+@timed_function("ui.history_sidebar")
 def history_sidebar():
     set_sidebar_default_expanded()
     st.markdown("""
@@ -236,8 +429,6 @@ def history_sidebar():
     </style>
     """, unsafe_allow_html=True)
     with st.sidebar:
-        st.markdown("## Chat History")
-        
         # Initialize session if needed
         if 'user_id' not in st.session_state:
             st.session_state.user_id = str(uuid.uuid4())
@@ -245,58 +436,10 @@ def history_sidebar():
             start_new_session()
             return
 
-        try:
-            sessions = get_all_sessions(st.session_state.user_id)
-        except Exception as e:
-            st.error(f"Error loading history: {str(e)}")
-            sessions = []
-
-        current_session = st.session_state.session_id
-
-        if not sessions:
-            st.info("No previous conversations")
+        if titles.has_pending(st.session_state.user_id):
+            polling_history_panel_fragment()
         else:
-            for session in sessions:
-                preview = get_session_preview(session['session_id'])
-                last_used = session['last_used']
-                
-                # Format timestamp properly
-                if isinstance(last_used, str):
-                    try:
-                        # If it's already a string, parse it
-                        from datetime import datetime
-                        last_used = datetime.strptime(last_used, "%Y-%m-%d %H:%M:%S")
-                    except ValueError:
-                        last_used = "Unknown"
-                
-                time_str = last_used.strftime("%b %d, %H:%M") if hasattr(last_used, 'strftime') else "Unknown"
-                
-                cols = st.columns([0.8, 0.2])
-                with cols[0]:
-                    st.markdown(
-                        f"""
-                        <div style='padding: 8px; border-radius: 8px; 
-                            background-color: {"#f0f4f8" if session['session_id'] == current_session else "transparent"};
-                            margin-bottom: 8px;'>
-                            <div style='font-weight: 500;'>{preview}</div>
-                            <div style='font-size: 0.8em; color: #64748b;'>{time_str}</div>
-                        </div>
-                        """,
-                        unsafe_allow_html=True
-                    )
-                    
-                    if st.button("Switch", key=f"switch_{session['session_id']}"):
-                        load_session(session['session_id'])
-
-                with cols[1]:
-                    if st.button("🗑️", key=f"delete_{session['session_id']}"):
-                        delete_session(session['session_id'])
-                        if session['session_id'] == current_session:
-                            start_new_session()
-                        st.rerun()
-
-        if st.button("+ New Chat", type="primary"):
-            start_new_session()
+            history_panel_fragment()
         
         st.components.v1.html("""
         <script>